@@ -0,0 +1,6 @@
+"""
+standalone benchmarks, run them as modules from the repo root
+
+ie:
+    python -m benchmarks.value_memory
+"""
@@ -0,0 +1,89 @@
+"""
+measures the number of messages of each type that can be encoded and
+decoded a second, and the encode rate of the previous inspect driven
+encoding with uuid1 message ids, for comparison
+
+    python -m benchmarks.message_codec [num_messages]
+"""
+import inspect
+import sys
+import timeit
+import uuid
+
+import msgpack
+
+from kickboxer.cluster import codec, messages
+from kickboxer.store.redis import Value
+from kickboxer.utils import now_timestamp
+
+NODE_ID = uuid.uuid4()
+TOKENS = [2 ** 126, 2 ** 127]
+VALUE = Value('v' * 100, now_timestamp())
+RECORDS = [codec.encode_record('key{}'.format(i), VALUE) for i in range(10)]
+
+# constructor args, after the sender id, for messages that take any
+SAMPLE_ARGS = {
+    messages.ConnectionRequest: (('localhost', 4379), TOKENS, 'N1'),
+    messages.ConnectionAcceptedResponse: (TOKENS, 'N1'),
+    messages.ConnectionRefusedResponse: ('refused',),
+    messages.DiscoverPeersResponse: ([(('localhost', 4379), NODE_ID, TOKENS, 'N1')] * 3,),
+    messages.RetrievalDigestRequest: ('get', 'key', []),
+    messages.RetrievalDigestResponse: ('d' * 20,),
+    messages.RetrievalValueRequest: ('get', 'key', []),
+    messages.RetrievalValueResponse: (codec.encode_value(VALUE),),
+    messages.MutationOperationRequest: ('set', 'key', ['v' * 100], VALUE.timestamp),
+    messages.MutationOperationResponse: (VALUE.timestamp,),
+    messages.BatchRetrievalRequest: ('get', ['key{}'.format(i) for i in range(10)], []),
+    messages.BatchRetrievalResponse: ([codec.encode_value(VALUE)] * 10,),
+    messages.BatchMutationRequest: ([('set', 'key', ['v' * 100], VALUE.timestamp)] * 10,),
+    messages.BatchMutationResponse: ([VALUE.timestamp] * 10,),
+    messages.StreamRequest: ([TOKENS],),
+    messages.StreamDataRequest: (RECORDS, [TOKENS]),
+    messages.MerkleTreeRequest: (TOKENS[0], TOKENS[1], [[4, i] for i in range(16)]),
+    messages.MerkleTreeResponse: (['h' * 20] * 16,),
+    messages.RepairDataRequest: (TOKENS[0], TOKENS[1], RECORDS),
+    messages.RepairDataResponse: (RECORDS,),
+    messages.AnnounceTokenRequest: (str(TOKENS[0]),),
+    messages.RequestTokenResponse: (str(TOKENS[0]),),
+    messages.ChangedTokenRequest: (NODE_ID, TOKENS[0]),
+    messages.RemoveNodeRequest: (NODE_ID,),
+    messages.ErrorResponse: ('error',),
+}
+
+
+_previous_arg_specs = {}
+
+
+def previous_encode(message):
+    """ the previous encoding, getting the cached constructor args, with a uuid1 message id """
+    message.message_id = uuid.uuid1().bytes
+    message_type = message.__message_type__
+    if message_type not in _previous_arg_specs:
+        args = inspect.getargspec(message.__init__).args
+        _previous_arg_specs[message_type] = [a for a in args if a != 'self']
+    message_body = msgpack.dumps([getattr(message, a) for a in _previous_arg_specs[message_type]])
+    return messages.Message._header.pack(message_type, len(message_body)), message_body
+
+
+def main(num_messages=100000):
+    print 'messages: {:,}'.format(num_messages)
+    print '{:<28}{:>16}{:>16}{:>18}{:>8}'.format('', 'encodes/sec', 'decodes/sec', 'previous enc/sec', 'bytes')
+    for message_type, klass in sorted(messages.Message.__klass_map__.items()):
+        args = (NODE_ID,) + SAMPLE_ARGS.get(klass, ())
+        message = klass(*args)
+        header, body = message.encode()
+
+        encode_time = timeit.timeit(lambda: klass(*args).encode(), number=num_messages)
+        decode_time = timeit.timeit(lambda: messages.Message.decode(message_type, body), number=num_messages)
+        previous_time = timeit.timeit(lambda: previous_encode(klass(*args)), number=num_messages)
+        print '{:<28}{:>16,.0f}{:>16,.0f}{:>18,.0f}{:>8,}'.format(
+            klass.__name__,
+            num_messages / encode_time,
+            num_messages / decode_time,
+            num_messages / previous_time,
+            len(header) + len(body),
+        )
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,75 @@
+"""
+compares encoding values for peer messages with the codec against the
+previous nested pickles, for a get response and a streamed batch,
+measuring encode and decode rates, and the message body size
+
+    python -m benchmarks.peer_codec [num_messages] [value_size]
+"""
+import cPickle as pickle
+import sys
+import timeit
+
+import msgpack
+
+from kickboxer.cluster import codec
+from kickboxer.store.redis import Value
+from kickboxer.utils import now_timestamp
+
+BATCH_SIZE = 100
+
+
+class PickleCodec(object):
+    """ the previous encoding, values and records pickled into byte strings """
+
+    @staticmethod
+    def encode_value(value):
+        return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def decode_value(data):
+        return pickle.loads(data)
+
+    @staticmethod
+    def encode_record(key, value):
+        return pickle.dumps((key, value), pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def decode_record(data):
+        return pickle.loads(data)
+
+
+def measure(encode, decode, number):
+    """ returns (encodes/sec, decodes/sec, body size) for the given message """
+    body = msgpack.dumps(encode())
+    encode_time = timeit.timeit(lambda: msgpack.dumps(encode()), number=number)
+    decode_time = timeit.timeit(lambda: decode(msgpack.loads(body)), number=number)
+    return number / encode_time, number / decode_time, len(body)
+
+
+def main(num_messages=100000, value_size=100):
+    ts = now_timestamp()
+    value = Value('v' * value_size, ts)
+    records = [('key{}'.format(i), Value('v' * value_size, ts + i)) for i in range(BATCH_SIZE)]
+
+    print 'messages: {:,}, value size: {}, batch size: {}'.format(num_messages, value_size, BATCH_SIZE)
+    print '{:<14}{:<10}{:>16}{:>16}{:>14}'.format('', '', 'encodes/sec', 'decodes/sec', 'body bytes')
+    for klass in (PickleCodec, codec):
+        name = klass.__name__.split('.')[-1]
+        results = (
+            ('get', measure(
+                lambda: klass.encode_value(value),
+                klass.decode_value,
+                num_messages
+            )),
+            ('stream', measure(
+                lambda: [klass.encode_record(k, v) for k, v in records],
+                lambda batch: [klass.decode_record(r) for r in batch],
+                max(num_messages / BATCH_SIZE, 1)
+            )),
+        )
+        for message, (encodes, decodes, size) in results:
+            print '{:<14}{:<10}{:>16,.0f}{:>16,.0f}{:>14,}'.format(name, message, encodes, decodes, size)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,50 @@
+"""
+compares replica lookups against the precomputed TokenRing snapshot with
+the previous per lookup bisect of a blist sortedset
+
+    python -m benchmarks.ring_routing [num_nodes] [num_lookups]
+"""
+import sys
+import timeit
+
+from blist import sortedset
+
+from kickboxer.cluster.node.base import BaseNode
+from kickboxer.cluster.ring import TokenRing
+from kickboxer.partitioner.md5 import MD5Partitioner
+
+
+class _TokenContainer(object):
+    def __init__(self, token):
+        self.token = token
+
+
+class SortedSetRing(object):
+    """ the previous ring, a sortedset of nodes, with replicas worked out on every lookup """
+
+    def __init__(self, nodes, replication_factor):
+        self.ring = sortedset(nodes, key=lambda n: n.token)
+        self.replication_factor = replication_factor
+
+    def get_nodes_for_token(self, token):
+        ring = self.ring
+        idx = (ring.bisect(_TokenContainer(token)) - 1) % len(ring)
+        return [ring[(idx + i) % len(ring)] for i in range(self.replication_factor)]
+
+
+def main(num_nodes=1000, num_lookups=1000000):
+    partitioner = MD5Partitioner()
+    nodes = [BaseNode(token=partitioner.get_random_token()) for _ in range(num_nodes)]
+    tokens = [partitioner.get_random_token() for _ in range(num_lookups)]
+
+    print 'nodes: {:,}  lookups: {:,}'.format(num_nodes, num_lookups)
+    print '{:<16}{:>20}'.format('', 'lookups/sec')
+    for klass in (SortedSetRing, TokenRing):
+        ring = klass(nodes, 3)
+        lookup = ring.get_nodes_for_token
+        elapsed = timeit.timeit(lambda: [lookup(t) for t in tokens], number=1)
+        print '{:<16}{:>20,.0f}'.format(klass.__name__, num_lookups / elapsed)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
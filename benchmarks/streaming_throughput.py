@@ -0,0 +1,72 @@
+"""
+measures streaming throughput between two local nodes, with batched
+streaming, and with one value per request and a single request in
+flight, like the previous per key streaming
+
+    python -m benchmarks.streaming_throughput [num_keys] [value_size]
+"""
+import sys
+import time
+
+import gevent
+
+from kickboxer.cluster.cluster import Cluster
+from kickboxer.server import Kickboxer
+from kickboxer.utils import now_timestamp
+
+
+def start_nodes(port):
+    nodes = []
+    for i in range(2):
+        seeds = [nodes[0].peer_address] if nodes else None
+        node = Kickboxer(
+            client_address=None,
+            peer_address=('localhost', port + i),
+            seed_peers=seeds,
+            name='N{}'.format(i),
+            cluster_status=Cluster.Status.NORMAL,
+        )
+        node.start()
+        nodes.append(node)
+    gevent.sleep(0.01)
+    return nodes
+
+
+def measure(num_keys, value_size, batch_size, window, port):
+    src, dst = start_nodes(port)
+    try:
+        ts = now_timestamp()
+        value = 'v' * value_size
+        for i in range(num_keys):
+            src.store.set('key{}'.format(i), value, ts)
+
+        src.cluster.stream_batch_size = batch_size
+        src.cluster.stream_window = window
+        start = time.time()
+        src.cluster.stream_to_node(dst.node_id)
+        elapsed = time.time() - start
+        assert len(dst.store.all_keys()) == num_keys
+        return elapsed, src.cluster.metrics['streamed_bytes']
+    finally:
+        src.stop()
+        dst.stop()
+
+
+def main(num_keys=100000, value_size=100):
+    print 'keys: {:,}  value size: {:,}b'.format(num_keys, value_size)
+    print '{:<16}{:>12}{:>16}'.format('', 'MB/s', 'keys/sec')
+    configs = [
+        ('per key', 1, 1),
+        ('batched', Cluster.stream_batch_size, Cluster.stream_window),
+    ]
+    for i, (name, batch_size, window) in enumerate(configs):
+        elapsed, num_bytes = measure(num_keys, value_size, batch_size, window, 5379 + (i * 10))
+        print '{:<16}{:>12.1f}{:>16,.0f}'.format(
+            name,
+            num_bytes / elapsed / (1024 * 1024),
+            num_keys / elapsed,
+        )
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
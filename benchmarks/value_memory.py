@@ -0,0 +1,74 @@
+"""
+compares the per key memory footprint and timestamp handling cost
+of the store's Value against the previous __dict__/datetime Value
+
+    python -m benchmarks.value_memory [num_keys]
+"""
+from datetime import datetime
+import gc
+import sys
+import timeit
+
+from kickboxer.store.redis import Value
+from kickboxer.utils import serialize_timestamp, deserialize_timestamp
+
+
+class DictValue(object):
+    """ the previous Value implementation, a regular object with a datetime timestamp """
+
+    def __init__(self, value, timestamp=None):
+        self.data = value
+        self.timestamp = timestamp
+        if isinstance(self.timestamp, (int, long)):
+            self.timestamp = deserialize_timestamp(self.timestamp)
+
+    def serialize(self):
+        return self.data, serialize_timestamp(self.timestamp)
+
+    @classmethod
+    def deserialize(cls, data):
+        val, ts = data
+        return DictValue(val, deserialize_timestamp(ts))
+
+
+def value_size(value):
+    """ bytes held by a value, not counting the value data, which is shared """
+    size = sys.getsizeof(value) + sys.getsizeof(value.timestamp)
+    if hasattr(value, '__dict__'):
+        size += sys.getsizeof(value.__dict__)
+    return size
+
+
+def measure_memory(klass, num_keys):
+    gc.collect()
+    ts = serialize_timestamp(datetime.utcnow())
+    values = [klass('value', ts + i) for i in range(num_keys)]
+    total = sum(value_size(v) for v in values)
+    del values
+    gc.collect()
+    return total
+
+
+def measure_cpu(klass, number):
+    ts = serialize_timestamp(datetime.utcnow())
+    value = klass('value', ts)
+    stmt = lambda: klass.deserialize(value.serialize())
+    return timeit.timeit(stmt, number=number)
+
+
+def main(num_keys=1000000):
+    print 'values: {:,}'.format(num_keys)
+    print '{:<12}{:>20}{:>16}{:>20}'.format('', 'MB per 1M keys', 'bytes per key', 'round trips/sec')
+    for klass in (DictValue, Value):
+        total = measure_memory(klass, num_keys)
+        elapsed = measure_cpu(klass, num_keys)
+        print '{:<12}{:>20.1f}{:>16.1f}{:>20,.0f}'.format(
+            klass.__name__,
+            (total / float(num_keys)) * 1000000 / (1024 * 1024),
+            total / float(num_keys),
+            num_keys / elapsed,
+        )
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -1,20 +1,24 @@
-from datetime import datetime
-import pickle
+from collections import defaultdict
+from contextlib import contextmanager
+import logging
+import time
 
-from blist import sortedset
 import gevent
 from gevent.queue import Queue
 from gevent.pool import Pool
 
-from kickboxer.cluster import messages
+from kickboxer.cluster import codec, messages
 from kickboxer.cluster.connection import Connection
+from kickboxer.cluster.hints import HintStore
 from kickboxer.cluster.node.local import LocalNode
 from kickboxer.cluster.node.remote import RemoteNode
+from kickboxer.cluster.ring import TokenRing, merge_token_ranges
+from kickboxer.cluster.streaming import StreamCheckpoint, StreamingSession
+from kickboxer.cluster.throttle import ConcurrencyLimit, TokenBucket
+from kickboxer.metrics import Metrics
+from kickboxer.utils import now_timestamp
 
-
-class _TokenContainer(object):
-    def __init__(self, token):
-        self.token = token
+logger = logging.getLogger(__name__)
 
 
 class ClusterException(Exception): pass
@@ -26,6 +30,10 @@ class ClusterQueryException(ClusterException): pass
 class ClusterStreamingException(ClusterException): pass
 
 
+class _DigestMismatch(Exception):
+    """ raised when a digest read can't be completed, and full values need to be read """
+
+
 class Cluster(object):
     """
     Maintains the local view of the cluster, and coordinates client requests, and
@@ -57,12 +65,49 @@ class Cluster(object):
     # other nodes before timing out
     response_timeout = 10
 
+    # read full values from one replica, and digests from the rest
+    digest_reads = True
+
+    # the maximum number of values, and bytes, sent in each
+    # StreamDataRequest, and the number of requests a node
+    # streaming data keeps in flight
+    stream_batch_size = 1000
+    stream_batch_bytes = 1 << 20
+    stream_window = 4
+
+    # the number of times token ranges are streamed again after
+    # their sources fail, before streaming is abandoned
+    stream_retries = 3
+
+    # limits on streaming traffic, so streaming doesn't starve client
+    # requests. Throughput is in bytes per second, and None is unlimited.
+    # They can be changed at runtime with the properties of the same name
+    default_outbound_stream_throughput = None
+    default_inbound_stream_throughput = None
+    default_max_stream_sessions = None
+
+    # repair traffic has it's own limit, in bytes of values applied by
+    # this node per second, so repairs don't use up the streaming budget
+    # new nodes need. Repair values are batched like streamed values
+    default_repair_throughput = None
+
+    # the number of seconds removed nodes are kept out of the ring. Removed
+    # nodes can still be streaming their data out, and the connections
+    # they open while they do shouldn't add them back
+    removed_node_grace_period = 60
+
+    # hinted mutations are replayed in batches of hint_batch_size,
+    # limited to hint_replay_rate mutations per second
+    hint_batch_size = 100
+    hint_replay_rate = 1000
+
     def __init__(self,
                  local_node,
                  partitioner,
                  seed_peers=None,
                  status=Status.INITIALIZING,
-                 replication_factor=3):
+                 replication_factor=3,
+                 checkpoint_path=None):
         """
         :param local_node:
         :type local_node:
@@ -74,6 +119,8 @@ class Cluster(object):
         :type status:
         :param replication_factor:
         :type replication_factor:
+        :param checkpoint_path: the file streaming progress is kept
+            in, so it can be resumed after a restart
         """
         super(Cluster, self).__init__()
         self.partitioner = partitioner
@@ -83,27 +130,42 @@ class Cluster(object):
         self.local_node = local_node
         self.nodes = {self.local_node.node_id: self.local_node}
 
+        # node_id -> the time it was removed from the cluster
+        self._removed_nodes = {}
+
         # this cluster's view of the token ring
         self.token_ring = None
+        """ :type: TokenRing """
 
         self.is_online = False
         self.status = status
+        self.metrics = Metrics()
+
+        # the nodes currently streaming data to this
+        # node, and the reason they're streaming, if any
+        self._streaming_session = None
+        """ :type: StreamingSession """
+
+        # the token ranges streamed to this node by streaming
+        # sessions that haven't finished, so they can be resumed
+        self._stream_checkpoint = StreamCheckpoint(checkpoint_path)
+
+        # throttles for data streamed from and to this node, and the
+        # number of nodes this node streams to at once
+        self._outbound_stream_bucket = TokenBucket(self.default_outbound_stream_throughput)
+        self._inbound_stream_bucket = TokenBucket(self.default_inbound_stream_throughput)
+        self._stream_sessions = ConcurrencyLimit(self.default_max_stream_sessions)
+        self._repair_bucket = TokenBucket(self.default_repair_throughput)
 
-        # the set of node ids currently streaming data to this
-        # node, if any
-        self._streaming_node = None
-        """ :type: RemoteNode """
+        # mutations that other nodes missed, to replay when they're back
+        self.hints = HintStore()
+        self._hint_bucket = TokenBucket(self.hint_replay_rate)
 
         # this cluster's view of the token ring
         # before the last token change, to help
         # coordinate reads while it's streaming
         self._previous_ring = None
 
-        # the reason this node is streaming,
-        # this will determing how queries are
-        # routed while it's streaming
-        self._streaming_reason = None
-
     def __contains__(self, item):
         return item in self.nodes
 
@@ -121,6 +183,10 @@ class Cluster(object):
     def token(self):
         return self.local_node.token
 
+    @property
+    def tokens(self):
+        return self.local_node.tokens
+
     @property
     def name(self):
         return self.local_node.name
@@ -130,6 +196,38 @@ class Cluster(object):
         """ :rtype: kickboxer.store.base.BaseStore """
         return self.local_node.store
 
+    @property
+    def outbound_stream_throughput(self):
+        return self._outbound_stream_bucket.rate
+
+    @outbound_stream_throughput.setter
+    def outbound_stream_throughput(self, rate):
+        self._outbound_stream_bucket.rate = rate
+
+    @property
+    def inbound_stream_throughput(self):
+        return self._inbound_stream_bucket.rate
+
+    @inbound_stream_throughput.setter
+    def inbound_stream_throughput(self, rate):
+        self._inbound_stream_bucket.rate = rate
+
+    @property
+    def repair_throughput(self):
+        return self._repair_bucket.rate
+
+    @repair_throughput.setter
+    def repair_throughput(self, rate):
+        self._repair_bucket.rate = rate
+
+    @property
+    def max_stream_sessions(self):
+        return self._stream_sessions.limit
+
+    @max_stream_sessions.setter
+    def max_stream_sessions(self, limit):
+        self._stream_sessions.limit = limit
+
     @property
     def is_initializing(self):
         return self.status == Cluster.Status.INITIALIZING
@@ -169,30 +267,38 @@ class Cluster(object):
 
     # ------------- node administration -------------
 
-    def add_node(self, node_id, address, token, name=None):
+    def add_node(self, node_id, address, tokens, name=None):
         """
         :param node_id:
         :param address:
-        :param token:
+        :param tokens:
         :param name:
 
+        :return: the node, or None if it was removed recently
         :rtype: RemoteNode
         """
         if node_id in self.nodes:
             return self.nodes[node_id]
+        removed_at = self._removed_nodes.get(node_id)
+        if removed_at is not None:
+            if time.time() - removed_at < self.removed_node_grace_period:
+                return None
+            del self._removed_nodes[node_id]
         #setdefault is threadsafe
         node = self.nodes.setdefault(
             node_id, RemoteNode(
                 address,
-                token=long(token),
+                tokens=[long(t) for t in tokens],
                 node_id=node_id,
                 name=name,
                 local_node=self.local_node
             )
         )
+        # the ring should match self.nodes while the connection is made,
+        # connecting yields to other greenlets
+        self._refresh_ring()
         node.connect()
         self.discover_peers(only=node)
-        self._refresh_ring()
         return node
 
     def get_node(self, node_id):
@@ -222,8 +328,9 @@ class Cluster(object):
             for entry in response.get_peer_data():
                 if entry.node_id == self.node_id:
                     continue
-                new_peer = self.add_node(entry.node_id, entry.address, entry.token, entry.name)
-                new_peer.connect()
+                new_peer = self.add_node(entry.node_id, entry.address, entry.tokens, entry.name)
+                if new_peer is not None:
+                    new_peer.connect()
 
     def connect_to_seeds(self):
         for address in self.seed_peers:
@@ -232,20 +339,23 @@ class Cluster(object):
                 messages.ConnectionRequest(
                     self.local_node.node_id,
                     self.local_node.address,
-                    self.local_node.token,
+                    self.local_node.tokens,
                     sender_name=self.local_node.name
                 ).send(conn)
                 response = messages.Message.read(conn)
 
                 assert isinstance(response, messages.ConnectionAcceptedResponse)
-                assert response.token is not None
+                assert response.tokens
 
                 peer = self.add_node(
                     response.sender,
                     address,
-                    response.token,
+                    response.get_tokens(),
                     name=response.name
                 )
+                if peer is None:
+                    conn.close()
+                    continue
                 peer.add_conn(conn)
                 return peer
 
@@ -253,8 +363,8 @@ class Cluster(object):
                 pass
 
     def _refresh_ring(self):
-        """ builds a view of the token ring """
-        self.token_ring = sortedset(self.nodes.values(), key=lambda n: n.token)
+        """ builds a new snapshot of the token ring """
+        self.token_ring = TokenRing(self.nodes.values(), self.replication_factor)
         if self.is_initializing:
             # if this is the only node, set it to normal
             # there are no nodes to stream data from
@@ -264,21 +374,11 @@ class Cluster(object):
                 return
 
             stream_nodes = [n for n in self.nodes.values() if n.node_id != self.node_id]
-            self._previous_ring = sortedset(stream_nodes, key=lambda n: n.token)
+            self._previous_ring = TokenRing(stream_nodes, self.replication_factor)
 
         else:
             self._previous_ring = None
 
-    def get_token_range(self):
-        """ find the range of tokens that this cluster's node owns or replicates """
-        idx = [n.node_id for n in self.token_ring].index(self.node_id)
-        if len(self.token_ring) <= self.replication_factor:
-            return 0, self.partitioner.max_token
-
-        max_token = self.token_ring[(idx + 1) % len(self.token_ring)].token - 1
-        min_token = self.token_ring[(idx - (self.replication_factor - 1)) % len(self.token_ring)].token
-        return min_token, max_token
-
     def join_cluster(self):
         """
         called when a node is first added to the cluster
@@ -292,13 +392,14 @@ class Cluster(object):
         [00][05][10    ][20    ][30    ][40    ][50    ][60    ][70    ][80    ][90    ]
         |--|->
 
-        N10 should stream data from the node to it's left, since it's taking control
-        of a portion of it's previous token space
+        N10 takes control of a portion of N0's token space, and starts replicating
+        N8's and N9's token spaces. It streams each of the token ranges it gains from
+        one of the nodes that replicated the range before it joined, spreading the
+        ranges across those nodes, and streaming from all of them at once. With
+        virtual nodes, the ranges are small, and spread across most of the cluster
         """
-        ring = [n.node_id for n in self.token_ring]
-        idx = ring.index(self.node_id)
-        from_node = self.nodes[ring[(idx - 1) % len(ring)]]
-        self._request_streamed_data(from_node, reason=Cluster.StreamingReason.JOINING_NODE)
+        token_ranges = self._get_gained_token_ranges(self._previous_ring, self.token_ring)
+        self._stream_token_ranges(token_ranges, reason=Cluster.StreamingReason.JOINING_NODE)
 
     def change_token(self, token, node_id=None, alert_cluster=True):
         """
@@ -326,7 +427,7 @@ class Cluster(object):
         will be a race condition that may prevent the correct data being streamed to the node
         if the node doing the streaming is not aware of the token when it receives the request.
 
-        :param token: the new token
+        :param token: the new token, which replaces all of the node's tokens
         :param node_id: the id of the node to move. If it's None, the local node will be moved
         :param alert_cluster: indicates that the other nodes in the cluster
             should be notified of the change
@@ -353,18 +454,22 @@ class Cluster(object):
             return
 
         # perform ring update
-        old_ring = [n.node_id for n in self.token_ring]
+        old_ring = self.token_ring
         changed_node.token = token
         self._refresh_ring()
-        new_ring = [n.node_id for n in self.token_ring]
+        new_ring = self.token_ring
 
         # alert other nodes of the change
         _alert_cluster()
 
-        # determine which, if any, node to stream data from
-        old_idx = old_ring.index(self.node_id)
-        new_idx = new_ring.index(self.node_id)
+        # with virtual nodes, the token ranges this node gained
+        # are pulled from the nodes that replicated them before
+        if old_ring.has_vnodes or new_ring.has_vnodes:
+            token_ranges = self._get_gained_token_ranges(old_ring, new_ring)
+            self._stream_token_ranges(token_ranges, reason=Cluster.StreamingReason.TOKEN_CHANGE)
+            return
 
+        # determine which, if any, node to stream data from
         def _stream_from_src(src_node):
             # guarantee that the src node is already
             # aware of the token change by blocking
@@ -377,22 +482,23 @@ class Cluster(object):
                 )
             )
             assert isinstance(response, messages.ChangedTokenResponse)
-            self._request_streamed_data(src_node, reason=Cluster.StreamingReason.TOKEN_CHANGE)
+            self._request_streamed_data(src_node)
 
         def _get_offset_nodes(offset):
-            old_node = old_ring[(old_idx + offset) % len(old_ring)]
-            new_node = new_ring[(new_idx + offset) % len(new_ring)]
+            old_node = old_ring.get_offset_node_id(self.node_id, offset)
+            new_node = new_ring.get_offset_node_id(self.node_id, offset)
             return old_node, new_node
 
-        old_left, new_left = _get_offset_nodes(-1)
-        if old_left != new_left:
-            src_node = self.nodes[new_left]
-            _stream_from_src(src_node)
+        src_node_ids = []
+        for offset in (-1, 1):
+            old_node, new_node = _get_offset_nodes(offset)
+            if old_node != new_node and new_node not in src_node_ids:
+                src_node_ids.append(new_node)
 
-        old_right, new_right = _get_offset_nodes(1)
-        if old_right != new_right:
-            src_node = self.nodes[new_right]
-            _stream_from_src(src_node)
+        # stream from both sides at once
+        if src_node_ids:
+            with self._streaming(Cluster.StreamingReason.TOKEN_CHANGE):
+                self._join_streams([gevent.spawn(_stream_from_src, self.nodes[n]) for n in src_node_ids])
 
     def remove_node(self, node_id=None, alert_cluster=True):
         """
@@ -455,33 +561,40 @@ class Cluster(object):
             _alert_cluster()
             return
 
-        old_ring = [n.node_id for n in self.token_ring]
+        old_ring = self.token_ring
         self.nodes.pop(removed_node.node_id)
+        self._removed_nodes[removed_node.node_id] = time.time()
         self._refresh_ring()
-        new_ring = [n.node_id for n in self.token_ring]
+        new_ring = self.token_ring
 
         _alert_cluster()
 
-        # determine which, if any, node to stream data from
-        old_idx = old_ring.index(self.node_id)
-        new_idx = new_ring.index(self.node_id)
+        # with virtual nodes, the token ranges this node gained are
+        # pulled from the nodes that replicated them before, including
+        # the removed node, if it's still reachable
+        if old_ring.has_vnodes:
+            token_ranges = self._get_gained_token_ranges(old_ring, new_ring)
+            self._stream_token_ranges(token_ranges, reason=Cluster.StreamingReason.REMOVED_NODE)
+            return
 
+        # determine which, if any, node to stream data from
         def _stream_from_src(src_node, reason):
             # guarantee that the src node is already
             # aware of the removed node by blocking
             # until it has acknowledged the token change
-            response = src_node.send_message(
-                messages.RemoveNodeRequest(
-                    self.node_id,
-                    removed_node.node_id
+            with self._streaming(reason):
+                response = src_node.send_message(
+                    messages.RemoveNodeRequest(
+                        self.node_id,
+                        removed_node.node_id
+                    )
                 )
-            )
-            assert isinstance(response, messages.RemoveNodeResponse)
-            self._request_streamed_data(src_node, reason=reason)
+                assert isinstance(response, messages.RemoveNodeResponse)
+                self._request_streamed_data(src_node)
 
         def _get_offset_nodes(offset):
-            old_node = old_ring[(old_idx + offset) % len(old_ring)]
-            new_node = new_ring[(new_idx + offset) % len(new_ring)]
+            old_node = old_ring.get_offset_node_id(self.node_id, offset)
+            new_node = new_ring.get_offset_node_id(self.node_id, offset)
             return old_node, new_node
 
         old_right, new_right = _get_offset_nodes(1)
@@ -492,81 +605,450 @@ class Cluster(object):
                 src_node = self.nodes[new_right]
                 _stream_from_src(src_node, Cluster.StreamingReason.DROPPED_NODE)
 
-    def stream_to_node(self, node_id):
+    def stream_to_node(self, node_id, token_ranges=None):
         """
         streams data contained on the local node to the given remote
-        node
+        node. The token ranges are paged through with the store's token
+        range scan, and sent in batches, with several batches in flight
+        at once
+
+        streams wait for a free session if max_stream_sessions are already
+        running, and are throttled to outbound_stream_throughput
 
         :param node_id: the id of the remote node to stream data to
         :type node_id: UUID
+        :param token_ranges: the (start, stop) token ranges to stream, all
+            of the keys the remote node replicates are streamed if omitted
         """
         node = self.nodes[node_id]
-        for key in self.store.all_keys():
-            if node in self.get_nodes_for_key(key):
-                response = node.send_message(messages.StreamDataRequest(
-                    self.node_id,
-                    [pickle.dumps((key, self.store.get_raw_value(key)))]
-                ))
-                assert isinstance(response, messages.StreamDataResponse)
+        if token_ranges is None:
+            token_ranges = merge_token_ranges(
+                (start_token, stop_token)
+                for start_token, stop_token, replicas in self.token_ring.get_token_ranges(self.partitioner.max_token)
+                if node in replicas
+            )
 
-        response = node.send_message(messages.StreamCompleteRequest(
-            self.node_id,
-        ))
-        assert isinstance(response, messages.StreamCompleteResponse)
+        def _send_batch(batch, covered):
+            response = node.send_message(messages.StreamDataRequest(self.node_id, batch, covered))
+            assert isinstance(response, messages.StreamDataResponse)
 
-    def _request_streamed_data(self, node, reason=None):
+        if self._stream_sessions.acquire():
+            self.metrics.incr('stream_sessions_queued')
+        self.metrics.set('stream_sessions', self._stream_sessions.active)
+        try:
+            # spawning blocks while the window is full
+            pool = Pool(self.stream_window)
+            failed = []
+            for batch, covered in self._iter_stream_batches(token_ranges):
+                if failed:
+                    break
+                batch_bytes = sum(codec.record_size(r) for r in batch)
+                self._throttle_stream(self._outbound_stream_bucket, batch_bytes, 'outbound')
+                pool.spawn(_send_batch, batch, covered).link_exception(failed.append)
+                self.metrics.incr('streamed_keys', len(batch))
+                self.metrics.incr('streamed_bytes', batch_bytes)
+            pool.join()
+            if failed:
+                raise failed[0].exception
+
+            response = node.send_message(messages.StreamCompleteRequest(
+                self.node_id,
+            ))
+            assert isinstance(response, messages.StreamCompleteResponse)
+        finally:
+            self._stream_sessions.release()
+            self.metrics.set('stream_sessions', self._stream_sessions.active)
+
+    def _throttle_stream(self, bucket, num_bytes, direction):
+        """ waits until the given bucket allows the bytes through, and records any delay """
+        delay = bucket.consume(num_bytes)
+        if delay:
+            self.metrics.incr('{}_stream_throttled'.format(direction))
+            self.metrics.incr('{}_stream_throttle_seconds'.format(direction), delay)
+
+    def _iter_stream_batches(self, token_ranges):
         """
-        requests a node to stream data to the requesting node
-        :param node:
+        yields (batch, covered) tuples, where the batch is a list of encoded
+        (key, value) records from the given token ranges, limited by
+        stream_batch_size and stream_batch_bytes, and covered is a list of the
+        (start, stop) token ranges the batch completes. Batches are only split
+        between tokens, so every key for a covered token is in the batch
+        """
+        batch = []
+        batch_bytes = 0
+        covered = []
+        last_token = None
+        for start_token, stop_token in token_ranges:
+            range_start = start_token
+            for token, key, value in self.store.scan_token_range(start_token, stop_token):
+                if token != last_token and (len(batch) >= self.stream_batch_size or
+                                            batch_bytes >= self.stream_batch_bytes):
+                    if token > range_start:
+                        covered.append((range_start, token - 1))
+                    yield batch, covered
+                    batch = []
+                    batch_bytes = 0
+                    covered = []
+                    range_start = token
+                record = codec.encode_record(key, value)
+                batch.append(record)
+                batch_bytes += codec.record_size(record)
+                last_token = token
+            covered.append((range_start, stop_token))
+        if batch:
+            yield batch, covered
+
+    @contextmanager
+    def _streaming(self, reason=None):
+        """
+        runs the body as part of this node's streaming session, starting one
+        if it isn't already streaming. The node stays in STREAMING until
+        everything using the session is done, and then returns to NORMAL, or
+        it's previous status if any of them failed
+
         :param reason: the reason streaming is requested
         """
+        session = self._streaming_session
+        if session is None:
+            session = self._streaming_session = StreamingSession(reason, self.status)
+            self.status = Cluster.Status.STREAMING
+        session.users += 1
+        try:
+            yield session
+        except Exception:
+            session.failed = True
+            raise
+        finally:
+            session.users -= 1
+            if session.users == 0 and self._streaming_session is session:
+                self._streaming_session = None
+                self.status = session.previous_status if session.failed else Cluster.Status.NORMAL
+                # failed sessions keep their checkpoint, and the
+                # next session picks up where they left off
+                if not session.failed:
+                    self._stream_checkpoint.clear()
+
+    @staticmethod
+    def _join_streams(greenlets):
+        """ waits for every stream to finish, and raises the first error, if any """
+        gevent.joinall(greenlets)
+        for greenlet in greenlets:
+            if not greenlet.successful():
+                raise greenlet.exception
+
+    def _request_streamed_data(self, node, token_ranges=None):
+        """
+        requests a node to stream data to the requesting node, as part
+        of the running streaming session. Token ranges that have already
+        been streamed, according to the streaming checkpoint, are skipped
+
+        :param node:
+        :param token_ranges: the (start, stop) token ranges to stream, every
+            key this node replicates is streamed if omitted
+        """
         if node.node_id == self.node_id: return
-        if self._streaming_node is not None:
-            raise ClusterStreamingException('already streaming from {}'.format(self._streaming_node))
+        session = self._streaming_session
+        assert session is not None, 'streams must be requested in a streaming session'
+
+        checkpoint = self._stream_checkpoint
+        if checkpoint:
+            if token_ranges is None:
+                token_ranges = [
+                    (start_token, stop_token)
+                    for start_token, stop_token, replicas in self.token_ring.get_token_ranges(self.partitioner.max_token)
+                    if self.local_node in replicas
+                ]
+            token_ranges = checkpoint.remaining(token_ranges)
+            if not token_ranges:
+                return
 
-        old_status = self.status
-        self._streaming_node = node
-        self.status = Cluster.Status.STREAMING
-        self._streaming_reason = reason
+        source = session.add_source(node, token_ranges)
         try:
-            response = node.send_message(messages.StreamRequest(self.node_id))
+            # the response comes once the whole stream is sent
+            response = node.send_message(messages.StreamRequest(self.node_id, token_ranges), wait=True)
             assert isinstance(response, messages.StreamResponse)
-        except Connection.ClosedException:
-            self._streaming_node = None
-            self.status = old_status
-            self._streaming_reason = None
+        except Exception:
+            # stop routing queries to the failed source
+            session.remove_source(source)
             raise
+        source.is_complete = True
+        if token_ranges is not None:
+            checkpoint.add(token_ranges, session.reason)
+
+    def _get_gained_token_ranges(self, old_ring, new_ring):
+        """
+        returns the token ranges this node replicates in the new ring, but
+        didn't in the old ring, as (start, stop, sources) tuples, where the
+        sources are the nodes that replicated the range in the old ring
+
+        :type old_ring: TokenRing
+        :type new_ring: TokenRing
+        """
+        if not old_ring or not new_ring:
+            return []
+
+        # replicas only change at the tokens in either ring
+        breakpoints = sorted(set(old_ring.tokens) | set(new_ring.tokens))
+        if breakpoints[0] > 0:
+            breakpoints.insert(0, 0)
+
+        is_local = lambda n: n.node_id == self.node_id
+        token_ranges = []
+        for i, start_token in enumerate(breakpoints):
+            if i + 1 < len(breakpoints):
+                stop_token = breakpoints[i + 1] - 1
+            else:
+                stop_token = self.partitioner.max_token
+            if not any(is_local(n) for n in new_ring.get_nodes_for_token(start_token)):
+                continue
+            sources = old_ring.get_nodes_for_token(start_token)
+            if any(is_local(n) for n in sources):
+                continue
+
+            if token_ranges and token_ranges[-1][1] + 1 == start_token and token_ranges[-1][2] == sources:
+                token_ranges[-1] = (token_ranges[-1][0], stop_token, sources)
+            else:
+                token_ranges.append((start_token, stop_token, sources))
+        return token_ranges
+
+    @staticmethod
+    def _assign_stream_sources(token_ranges, exclude=()):
+        """
+        spreads (start, stop, sources) token ranges across their sources, largest
+        ranges first, giving each range to the source with the fewest tokens
+        assigned to it so far. Sources that are known to be down, or are
+        excluded, are avoided, unless there aren't any others
+
+        :param exclude: ids of nodes that shouldn't be streamed from, if possible
+        :return: a dict of {node_id: (node, [(start, stop, sources), ...])}
+        """
+        assignments = {}
+        assigned_tokens = defaultdict(int)
+        for token_range in sorted(token_ranges, key=lambda r: r[0] - r[1]):
+            start_token, stop_token, sources = token_range
+            candidates = [n for n in sources if n.node_id not in exclude] or list(sources)
+            candidates = [n for n in candidates if getattr(n, 'status', None) != RemoteNode.Status.DOWN] or candidates
+            if not candidates:
+                raise ClusterStreamingException(
+                    'no nodes available to stream {} - {} from'.format(start_token, stop_token)
+                )
+            node = min(candidates, key=lambda n: assigned_tokens[n.node_id])
+            assigned_tokens[node.node_id] += (stop_token - start_token) + 1
+            assignments.setdefault(node.node_id, (node, []))[1].append(token_range)
+        return assignments
+
+    def _stream_token_ranges(self, token_ranges, reason=None):
+        """
+        streams the given (start, stop, sources) token ranges to this node. The
+        ranges are spread across their sources, and every source streams it's
+        ranges concurrently. If a source can't be reached, it's ranges are
+        streamed from the remaining sources, or from the same source again
+        if there aren't any others, resuming from the streaming checkpoint
+
+        :param reason: the reason streaming is requested
+        """
+        failed = set()
+        attempts = 0
+        with self._streaming(reason):
+            while token_ranges:
+                if attempts > self.stream_retries:
+                    raise ClusterStreamingException(
+                        'streaming failed after {} attempts'.format(attempts)
+                    )
+                attempts += 1
+                streams = [
+                    (node, merge_token_ranges((start, stop) for start, stop, _ in ranges), ranges)
+                    for node, ranges in self._assign_stream_sources(token_ranges, failed).values()
+                ]
+                greenlets = [gevent.spawn(self._request_streamed_data, node, merged) for node, merged, _ in streams]
+                gevent.joinall(greenlets)
+
+                token_ranges = []
+                for greenlet, (node, _, ranges) in zip(greenlets, streams):
+                    if greenlet.successful():
+                        continue
+                    if not isinstance(greenlet.exception, Connection.ClosedException):
+                        raise greenlet.exception
+                    failed.add(node.node_id)
+                    token_ranges.extend(ranges)
+
+    def _get_streaming_node(self, key):
+        """ returns the node streaming the given key to this node, if it's still being streamed """
+        session = self._streaming_session
+        if session is None:
+            return None
+        # full streams don't need the key's token
+        token = self.partitioner.get_key_token(key) if session.has_token_ranges else None
+        return session.get_source(token)
 
     def _end_streaming(self, node_id):
         """
         handles a notification that a node is finished streaming data to this node
         :param node_id:
         """
-        self._streaming_node = None
-        self._streaming_reason = None
-        self.status = Cluster.Status.NORMAL
+        if self._streaming_session is not None:
+            self._streaming_session.complete(node_id)
 
-    def _receive_streamed_values(self, data):
-        for d in data:
-            key, val = pickle.loads(d)
+    def _receive_streamed_values(self, data, token_ranges=None):
+        """
+        stores values streamed to this node, and checkpoints the token
+        ranges they complete, if they're part of a streaming session. Values
+        are throttled to inbound_stream_throughput, holding back the
+        response, so the streaming node slows down too
+        """
+        self._throttle_stream(self._inbound_stream_bucket, sum(codec.record_size(r) for r in data), 'inbound')
+        self._apply_records(data)
+        session = self._streaming_session
+        if token_ranges and session is not None:
+            self._stream_checkpoint.add(token_ranges, session.reason)
+
+    def _apply_records(self, data):
+        """ stores encoded records, unless the store has newer values for their keys """
+        for record in data:
+            key, val = codec.decode_record(record)
             self.store.set_and_reconcile_raw_value(key, val)
 
+    # ------------- anti-entropy repair -------------
+
+    def get_shared_token_ranges(self, node_id):
+        """
+        returns the (start, stop) token ranges that are replicated
+        by both this node and the given node, inclusively
+
+        :param node_id:
+        :type node_id: UUID
+        """
+        max_token = self.partitioner.max_token
+        if self.replication_factor == 0:
+            return [(0, max_token)]
+
+        ranges = []
+        for start_token, stop_token, replicas in self.token_ring.get_token_ranges(max_token):
+            replica_ids = [n.node_id for n in replicas]
+            if self.node_id in replica_ids and node_id in replica_ids:
+                ranges.append((start_token, stop_token))
+        return merge_token_ranges(ranges)
+
+    def _find_differing_ranges(self, node, start_token, stop_token):
+        """
+        walks down the merkle trees of the local and given node, only
+        descending into subtrees whose hashes differ, and returns the
+        token ranges of the differing leaves, with adjacent leaves merged
+        """
+        tree = self.store.merkle_tree
+        differing = []
+        tree_nodes = [[0, 0]]
+        while tree_nodes:
+            response = node.send_message(messages.MerkleTreeRequest(
+                self.node_id, start_token, stop_token, tree_nodes
+            ))
+            assert isinstance(response, messages.MerkleTreeResponse)
+
+            next_nodes = []
+            for (level, idx), remote_hash in zip(tree_nodes, response.hashes):
+                if self.store.get_merkle_hash(level, idx, start_token, stop_token) == remote_hash:
+                    continue
+                if level == tree.depth:
+                    node_start, node_stop = tree.node_range(level, idx)
+                    differing.append((max(start_token, node_start), min(stop_token, node_stop)))
+                    continue
+                for child in (idx * 2, (idx * 2) + 1):
+                    child_start, child_stop = tree.node_range(level + 1, child)
+                    if child_stop >= start_token and child_start <= stop_token:
+                        next_nodes.append([level + 1, child])
+            tree_nodes = next_nodes
+
+        merged = []
+        for diff_start, diff_stop in sorted(differing):
+            if merged and merged[-1][1] + 1 == diff_start:
+                merged[-1] = (merged[-1][0], diff_stop)
+            else:
+                merged.append((diff_start, diff_stop))
+        return merged
+
+    def _iter_repair_batches(self, start_token, stop_token):
+        """
+        yields (batch, (start, stop)) tuples for this node's values in the
+        given token range, batched like streamed values. The batches' ranges
+        cover the whole token range, even if it has no values
+        """
+        for batch, covered in self._iter_stream_batches([(start_token, stop_token)]):
+            yield batch, (covered[0][0], covered[-1][1])
+            start_token = covered[-1][1] + 1
+        if start_token <= stop_token:
+            yield [], (start_token, stop_token)
+
+    def _receive_repair_values(self, data):
+        """ stores values exchanged by a repair, throttled to repair_throughput """
+        self._throttle_stream(self._repair_bucket, sum(codec.record_size(r) for r in data), 'repair')
+        self._apply_records(data)
+
+    def _exchange_repair_data(self, start_token, stop_token, data):
+        """
+        handles a repair data request from another node, applying the
+        other node's values, and returning a batch of this node's values
+        from before they were applied, from the start of the range. If
+        the batch doesn't reach the end of the range, the token to request
+        the rest from is returned with it
+
+        :return: a (data, next token) tuple, next token is None once the range is done
+        """
+        local_data, (_, batch_stop) = next(self._iter_repair_batches(start_token, stop_token))
+        self._receive_repair_values(data)
+        return local_data, (batch_stop + 1 if batch_stop < stop_token else None)
+
+    def repair(self, node_id=None):
+        """
+        compares the data on this node with the other nodes that replicate
+        the same token ranges, and exchanges the values in any ranges that
+        differ, so both nodes end up with the newest value for every key
+
+        :param node_id: the node to repair against, all peers are repaired if omitted
+        :type node_id: UUID
+        :return: a list of the (start, stop) token ranges that were repaired
+        """
+        nodes = [self.nodes[node_id]] if node_id is not None else self.get_peers()
+        repaired = []
+        for node in nodes:
+            for start_token, stop_token in self.get_shared_token_ranges(node.node_id):
+                for diff_range in self._find_differing_ranges(node, start_token, stop_token):
+                    self._repair_range(node, *diff_range)
+                    repaired.append(diff_range)
+        return repaired
+
+    def _repair_range(self, node, start_token, stop_token):
+        """
+        exchanges the values in the given range with the given node, a
+        batch at a time. Each request sends a batch of this node's values,
+        and the response has a batch of the other node's values from the
+        start of the request's range. Requests for the rest of the range
+        are repeated until the other node has sent all of it's values
+        """
+        for batch, (batch_start, batch_stop) in self._iter_repair_batches(start_token, stop_token):
+            next_token = batch_start
+            while next_token is not None:
+                response = node.send_message(messages.RepairDataRequest(
+                    self.node_id, next_token, batch_stop, batch
+                ))
+                assert isinstance(response, messages.RepairDataResponse)
+                self._receive_repair_values(response.data)
+                next_token = response.next_token_long
+                batch = []
+
     # ------------- request handling -------------
 
     def get_nodes_for_token(self, token, ring=None):
         """
+        returns the owner and replica nodes for the given token. The
+        returned tuple is shared by the ring snapshot, and shouldn't
+        be modified
 
         :param token:
         :param ring:
+        :type ring: TokenRing
         :return:
         """
-        ring = ring or self.token_ring
-        # bisect returns the the insertion index for
-        # the given token, which is always 1 higher
-        # than the owning node, so we subtract 1 here,
-        # and wrap the value to the length of the ring
-        idx = (ring.bisect(_TokenContainer(token)) - 1) % len(ring)
-        return [ring[(idx + i) % len(ring)] for i in range(self.replication_factor)]
+        return (ring or self.token_ring).get_nodes_for_token(token)
 
     def get_nodes_for_key(self, key):
         """
@@ -575,11 +1057,16 @@ class Cluster(object):
         :param key:
         :return:
         """
-        if self.replication_factor == 0:
-            return self.nodes.values()
+        return self.token_ring.get_nodes_for_token(self.partitioner.get_key_token(key))
 
-        token = self.partitioner.get_key_token(key)
-        return self.get_nodes_for_token(token)
+    @staticmethod
+    def _get_num_replies(num_nodes, consistency):
+        """ returns the number of replies needed to satisfy the consistency level """
+        return {
+            Cluster.ConsistencyLevel.ONE: 1,
+            Cluster.ConsistencyLevel.QUORUM: (num_nodes / 2) + 1,
+            Cluster.ConsistencyLevel.ALL: num_nodes
+        }[consistency]
 
     def route_local_retrieval_instruction(self, instruction, key, args):
         """
@@ -596,9 +1083,10 @@ class Cluster(object):
             raise ClusterQueryException('cannot query an initializing node')
         elif self.status == Cluster.Status.STREAMING:
             # forward the query to the streaming node
-            return self._streaming_node.execute_retrieval_instruction(instruction, key, args)
-        else:
-            return getattr(self.store, instruction)(key, *args)
+            streaming_node = self._get_streaming_node(key)
+            if streaming_node is not None:
+                return streaming_node.execute_retrieval_instruction(instruction, key, args)
+        return getattr(self.store, instruction)(key, *args)
 
     def _finalize_retrieval(self, instruction, key, args, gpool, greenlets):
         """
@@ -616,6 +1104,8 @@ class Cluster(object):
 
         # do we want to do anything with the exception? (g.exception)
         result_map = {g.node.node_id: g.value for g in greenlets}
+        if not any(result_map.values()):
+            return
         instructions = getattr(self.store, 'resolve_{}_instructions'.format(instruction))(key, args, result_map)
         for node_id, instruction_set in instructions.items():
             node = self.nodes[node_id]
@@ -627,13 +1117,104 @@ class Cluster(object):
         executes a retrieval instruction against the cluster, and performs any
         reconciliation needed
 
+        if more than one reply is needed, the full value is only read from one
+        replica, and digests of the value are read from the rest. Full values
+        are only read from every replica if the digests don't match
+
         :param instruction:
         :param key:
         :param args:
         :return:gg
         """
-        results = Queue()
         nodes = self.get_nodes_for_key(key)
+        consistency = self.default_read_consistency if consistency is None else consistency
+        if self.digest_reads and self._get_num_replies(len(nodes), consistency) > 1:
+            try:
+                return self._execute_digest_retrieval(instruction, key, args, nodes, consistency, synchronous)
+            except _DigestMismatch:
+                self.metrics.incr('digest_mismatches')
+        return self._execute_full_retrieval(instruction, key, args, nodes, consistency, synchronous)
+
+    def _finalize_digest_retrieval(self, instruction, key, args, expected, consistency, synchronous, gpool, greenlets):
+        """
+        waits for the rest of the digests, and does a full read, with
+        read repair, if any of them don't match the value that was read.
+        The full read waits for as many replies as the original read, and
+        the read repair covers every replica that replies in time
+        """
+        gpool.join(timeout=self.response_timeout)
+        for greenlet in greenlets:
+            if greenlet.digest and greenlet.successful() and greenlet.value != expected:
+                self.metrics.incr('digest_mismatches')
+                nodes = self.get_nodes_for_key(key)
+                self._execute_full_retrieval(instruction, key, args, nodes, consistency, synchronous)
+                return
+
+    def _execute_digest_retrieval(self, instruction, key, args, nodes, consistency, synchronous):
+        """
+        reads the full value from one replica, the local node if it's one, and
+        digests from the rest
+
+        :raises _DigestMismatch: if the digests don't match the value, or the full value couldn't be read
+        """
+        results = Queue()
+        data_node = ([n for n in nodes if n.node_id == self.node_id] or nodes)[0]
+
+        def _execute(node, digest):
+            if node.node_id == self.node_id:
+                result = self.route_local_retrieval_instruction(instruction, key, args)
+                if digest:
+                    result = self.store.digest(result)
+            else:
+                result = node.execute_retrieval_instruction(instruction, key, args, digest=digest)
+            results.put((node, digest, result))
+            return result
+
+        def _failed(greenlet):
+            results.put((greenlet.node, None, None))
+
+        pool = Pool(50)
+        greenlets = []
+        for node in nodes:
+            greenlet = pool.spawn(_execute, node, node is not data_node)
+            greenlet.node = node
+            greenlet.digest = node is not data_node
+            greenlet.link_exception(_failed)
+            greenlets.append(greenlet)
+        num_replies = self._get_num_replies(len(nodes), consistency)
+
+        # wait for the full value, and enough digests to meet the consistency level
+        value = None
+        digests = []
+        received_value = False
+        while not received_value or len(digests) + 1 < num_replies:
+            node, digest, result = results.get(timeout=self.response_timeout)
+            if digest is None:
+                if node is data_node:
+                    raise _DigestMismatch
+            elif digest:
+                digests.append(result)
+            else:
+                value = result
+                received_value = True
+
+        expected = self.store.digest(value)
+        if any(d != expected for d in digests):
+            raise _DigestMismatch
+
+        reconciler = gevent.spawn(
+            self._finalize_digest_retrieval, instruction, key, args, expected, consistency, synchronous, pool, greenlets
+        )
+        if synchronous:
+            reconciler.join()
+
+        if value is None:
+            return None
+        return getattr(self.store, 'resolve_{}'.format(instruction))(key, args, [value]).data
+
+    def _execute_full_retrieval(self, instruction, key, args, nodes, consistency, synchronous):
+        """ reads full values from every replica, and resolves them """
+        results = Queue()
 
         def _execute(node):
             if node.node_id == self.node_id:
@@ -648,24 +1229,19 @@ class Cluster(object):
             greenlet = pool.spawn(_execute, node)
             greenlet.node = node
             greenlets.append(greenlet)
-        consistency = self.default_read_consistency if consistency is None else consistency
-
-        num_replies = {
-            Cluster.ConsistencyLevel.ONE: 1,
-            Cluster.ConsistencyLevel.QUORUM: (len(nodes) / 2) + 1,
-            Cluster.ConsistencyLevel.ALL: len(nodes)
-        }[consistency]
+        num_replies = self._get_num_replies(len(nodes), consistency)
 
         values = [results.get(timeout=self.response_timeout) for _ in range(num_replies)]
         # resolve any differences
-        result = getattr(self.store, 'resolve_{}'.format(instruction))(key, args, values)
+        values = filter(None, values)
+        result = getattr(self.store, 'resolve_{}'.format(instruction))(key, args, values) if values else None
 
         # spin up a greenlet to resolve any differences
         reconciler = gevent.spawn(self._finalize_retrieval, instruction, key, args, pool, greenlets)
         if synchronous:
             reconciler.join()
 
-        return result.data
+        return result.data if result is not None else None
 
     def route_local_mutation_instruction(self, instruction, key, args, timestamp):
         """
@@ -682,12 +1258,13 @@ class Cluster(object):
         if self.status == Cluster.Status.INITIALIZING:
             raise ClusterQueryException('cannot query an initializing node')
         elif self.status == Cluster.Status.STREAMING:
-            # execute write locally
-            getattr(self.store, instruction)(key, *args, timestamp=timestamp)
-            # then mirror to the streaming node
-            return self._streaming_node.execute_mutation_instruction(instruction, key, args, timestamp)
-        else:
-            return getattr(self.store, instruction)(key, *args, timestamp=timestamp)
+            streaming_node = self._get_streaming_node(key)
+            if streaming_node is not None:
+                # execute write locally
+                getattr(self.store, instruction)(key, *args, timestamp=timestamp)
+                # then mirror to the streaming node
+                return streaming_node.execute_mutation_instruction(instruction, key, args, timestamp)
+        return getattr(self.store, instruction)(key, *args, timestamp=timestamp)
 
     def _finalize_mutation(self, instruction, key, args, timestamp, gpool, greenlets):
         """
@@ -700,8 +1277,8 @@ class Cluster(object):
         :param greenlets:
         :type greenlets: list of Greenlet
         """
-        #TODO: distribute hints for nonresponsive nodes locally and to other nodes
         gpool.join(timeout=self.response_timeout)
+        self._store_hints(greenlets, lambda greenlet: [(instruction, key, args, timestamp)])
 
     def execute_mutation_instruction(self, instruction, key, args, timestamp=None, consistency=None, synchronous=False):
         """
@@ -713,7 +1290,7 @@ class Cluster(object):
         :param consistency:
         :return:
         """
-        timestamp = timestamp or datetime.utcnow()
+        timestamp = timestamp or now_timestamp()
         response_timeout = self.response_timeout
 
         results = Queue()
@@ -734,12 +1311,7 @@ class Cluster(object):
             greenlet.node = node
             greenlets.append(greenlet)
         consistency = self.default_read_consistency if consistency is None else consistency
-
-        num_replies = {
-            Cluster.ConsistencyLevel.ONE: 1,
-            Cluster.ConsistencyLevel.QUORUM: (len(nodes) / 2) + 1,
-            Cluster.ConsistencyLevel.ALL: len(nodes)
-        }[consistency]
+        num_replies = self._get_num_replies(len(nodes), consistency)
 
         values = [results.get(timeout=response_timeout) for _ in range(num_replies)]
         # resolve any differences
@@ -752,3 +1324,255 @@ class Cluster(object):
 
         return result.data
 
+    # ------------- batch request handling -------------
+
+    def _group_keys_by_node(self, keys):
+        """
+        groups the given keys by the nodes that replicate them
+
+        :return: a tuple of ({node_id: [key, ...]}, {key: [node, ...]})
+        """
+        node_keys = defaultdict(list)
+        key_nodes = {}
+        replica_sets = {}
+        for key in keys:
+            nodes = self.get_nodes_for_key(key)
+            key_nodes[key] = nodes
+            # keys with the same replica set share a key list per node,
+            # the ring returns the same tuple for each replica set
+            if nodes not in replica_sets:
+                replica_sets[nodes] = []
+            replica_sets[nodes].append(key)
+
+        for replica_set, set_keys in replica_sets.items():
+            for node in replica_set:
+                node_keys[node.node_id].extend(set_keys)
+        return node_keys, key_nodes
+
+    def _get_batch_replies(self, results, key_nodes, consistency):
+        """
+        reads per node results off the results queue until every key
+        has enough replies to satisfy the consistency level
+
+        :param results: a queue of {key: value} dicts, one per node
+        :return: a dict of key -> [value, ...]
+        """
+        replies = defaultdict(list)
+        remaining = {}
+        for key, nodes in key_nodes.items():
+            remaining[key] = self._get_num_replies(len(nodes), consistency)
+        pending = len(remaining)
+
+        while pending:
+            for key, value in results.get(timeout=self.response_timeout).items():
+                replies[key].append(value)
+                remaining[key] -= 1
+                if remaining[key] == 0:
+                    pending -= 1
+        return replies
+
+    def _spawn_batch(self, node_keys, execute):
+        pool = Pool(50)
+        greenlets = []
+        for node_id, keys in node_keys.items():
+            node = self.nodes[node_id]
+            greenlet = pool.spawn(execute, node, keys)
+            greenlet.node = node
+            greenlet.keys = keys
+            greenlets.append(greenlet)
+        return pool, greenlets
+
+    def route_local_batch_retrieval_instruction(self, instruction, keys, args):
+        """
+        routes a batch of local retrieval instructions to the store, or streaming nodes if applicable
+
+        :return: a list of values, in key order
+        """
+        if self.status == Cluster.Status.NORMAL and instruction in self.store.retrieval_instructions:
+            return self.local_node.execute_batch_retrieval_instruction(instruction, keys, args)
+        return [self.route_local_retrieval_instruction(instruction, key, args) for key in keys]
+
+    def _finalize_batch_retrieval(self, instruction, args, gpool, greenlets):
+        """
+        finalizes a batch retrieval, repairing any discrepancies in data
+        with a single batch of mutations per node
+        """
+        gpool.join(timeout=self.response_timeout)
+
+        key_results = defaultdict(dict)
+        for greenlet in greenlets:
+            for key, value in (greenlet.value or {}).items():
+                key_results[key][greenlet.node.node_id] = value
+
+        resolve_instructions = getattr(self.store, 'resolve_{}_instructions'.format(instruction))
+        node_mutations = defaultdict(list)
+        for key, result_map in key_results.items():
+            if not filter(None, result_map.values()):
+                continue
+            for node_id, instruction_set in resolve_instructions(key, args, result_map).items():
+                for instr in instruction_set:
+                    node_mutations[node_id].append((instr.instruction, instr.key, instr.args, instr.timestamp))
+
+        for node_id, mutations in node_mutations.items():
+            self.nodes[node_id].execute_batch_mutation_instruction(mutations)
+
+    def execute_batch_retrieval_instruction(self, instruction, keys, args, consistency=None, synchronous=False):
+        """
+        executes a retrieval instruction for several keys against the cluster,
+        sending one request per replica node, and performs any reconciliation
+        needed
+
+        :param instruction:
+        :param keys:
+        :param args: args applied to every key
+        :return: a dict of key -> data
+        """
+        results = Queue()
+        node_keys, key_nodes = self._group_keys_by_node(keys)
+
+        def _execute(node, node_keys):
+            if node.node_id == self.node_id:
+                values = self.route_local_batch_retrieval_instruction(instruction, node_keys, args)
+            else:
+                values = node.execute_batch_retrieval_instruction(instruction, node_keys, args)
+            result = dict(zip(node_keys, values))
+            results.put(result)
+            return result
+
+        pool, greenlets = self._spawn_batch(node_keys, _execute)
+        consistency = self.default_read_consistency if consistency is None else consistency
+        replies = self._get_batch_replies(results, key_nodes, consistency)
+
+        # resolve any differences
+        resolve = getattr(self.store, 'resolve_{}'.format(instruction))
+        data = {}
+        for key in key_nodes:
+            values = filter(None, replies[key])
+            data[key] = resolve(key, args, values).data if values else None
+
+        # spin up a greenlet to resolve any differences
+        reconciler = gevent.spawn(self._finalize_batch_retrieval, instruction, args, pool, greenlets)
+        if synchronous:
+            reconciler.join()
+
+        return data
+
+    def route_local_batch_mutation_instruction(self, mutations):
+        """
+        routes a batch of local mutation instructions to the store, or streaming nodes if applicable
+
+        :param mutations: a list of (instruction, key, args, timestamp) tuples
+        :return: a list of results, in mutation order
+        """
+        if self.status == Cluster.Status.NORMAL and all(m[0] in self.store.mutation_instructions for m in mutations):
+            return self.local_node.execute_batch_mutation_instruction(mutations)
+        return [self.route_local_mutation_instruction(*m) for m in mutations]
+
+    def execute_batch_mutation_instruction(self, instruction, items, timestamp=None, consistency=None, synchronous=False):
+        """
+        executes a mutation instruction for several keys against the cluster,
+        sending one request per replica node
+
+        :param instruction:
+        :param items: a list of (key, args) tuples
+        :param timestamp:
+        :param consistency:
+        :return: a dict of key -> result data
+        """
+        timestamp = timestamp or now_timestamp()
+        key_args = dict(items)
+
+        results = Queue()
+        node_keys, key_nodes = self._group_keys_by_node(key_args.keys())
+
+        def _execute(node, node_keys):
+            mutations = [(instruction, key, key_args[key], timestamp) for key in node_keys]
+            if node.node_id == self.node_id:
+                values = self.route_local_batch_mutation_instruction(mutations)
+            else:
+                values = node.execute_batch_mutation_instruction(mutations)
+            result = dict(zip(node_keys, values))
+            results.put(result)
+            return result
+
+        pool, greenlets = self._spawn_batch(node_keys, _execute)
+        consistency = self.default_write_consistency if consistency is None else consistency
+        replies = self._get_batch_replies(results, key_nodes, consistency)
+
+        resolve = getattr(self.store, 'resolve_{}'.format(instruction))
+        data = {key: resolve(key, key_args[key], timestamp, replies[key]).data for key in key_nodes}
+
+        reconciler = gevent.spawn(self._finalize_batch_mutation, instruction, key_args, timestamp, pool, greenlets)
+        if synchronous:
+            reconciler.join()
+
+        return data
+
+    def _finalize_batch_mutation(self, instruction, key_args, timestamp, gpool, greenlets):
+        gpool.join(timeout=self.response_timeout)
+        self._store_hints(
+            greenlets, lambda greenlet: [(instruction, key, key_args[key], timestamp) for key in greenlet.keys]
+        )
+
+    # ------------- hinted handoff -------------
+
+    def _store_hints(self, greenlets, get_mutations):
+        """
+        records hints for the mutations that remote nodes failed to
+        acknowledge, so they can be replayed when the nodes are back
+
+        :param greenlets: the finished mutation greenlets, with their target nodes
+        :param get_mutations: returns the (instruction, key, args, timestamp)
+            mutations that were sent by the given greenlet
+        """
+        for greenlet in greenlets:
+            node = greenlet.node
+            if node.node_id == self.node_id or greenlet.successful():
+                continue
+            for mutation in get_mutations(greenlet):
+                if self.hints.add(node.node_id, *mutation):
+                    self.metrics.incr('hints_stored')
+                else:
+                    self.metrics.incr('hints_dropped')
+
+    def replay_hints(self):
+        """
+        replays hinted mutations to the nodes that missed them. Nodes that
+        are down are pinged first, and skipped if they're still down
+        """
+        for node_id in self.hints.node_ids():
+            node = self.nodes.get(node_id)
+            if node is None:
+                # removed nodes don't need their hints
+                self.hints.discard(node_id)
+                continue
+
+            self.metrics.incr('hints_expired', self.hints.expire(node_id))
+            if not self.hints.count(node_id):
+                continue
+            if node.status == RemoteNode.Status.DOWN:
+                node.ping()
+                if node.status == RemoteNode.Status.DOWN:
+                    continue
+            self._replay_hints_to(node)
+
+    def _replay_hints_to(self, node):
+        """
+        sends the given node it's hints in throttled batches, until they're
+        gone, or it fails. Hints that fail are kept for the next replay, a
+        node that can't take them yet, like one that's still initializing,
+        answers with an error
+        """
+        while self.hints.count(node.node_id):
+            mutations = self.hints.peek(node.node_id, self.hint_batch_size)
+            self._hint_bucket.consume(len(mutations))
+            try:
+                node.execute_batch_mutation_instruction(mutations)
+            except Connection.ClosedException:
+                return
+            except Exception:
+                logger.exception('error replaying hints to %r', node)
+                self.metrics.incr('hint_replay_errors')
+                return
+            self.hints.remove(node.node_id, len(mutations))
+            self.metrics.incr('hints_replayed', len(mutations))
@@ -0,0 +1,59 @@
+"""
+encodes values for peer messages
+
+values and streamed records are encoded as plain lists, which msgpack
+serializes along with the rest of the message body, instead of being
+pickled, and sent as nested byte strings
+
+values are encoded as:
+    [<data>, <timestamp>]
+    [<data>, <timestamp>, <expires>]
+
+streamed records are encoded as:
+    [<key>, <data>, <timestamp>]
+    [<key>, <data>, <timestamp>, <expires>]
+
+missing values are encoded as None
+"""
+from kickboxer.store.redis import Value
+
+# msgpack's per field overhead, roughly, used when estimating record sizes
+_field_overhead = 9
+
+
+def encode_value(value):
+    """
+    :type value: Value
+    :rtype: list
+    """
+    if value is None:
+        return None
+    return list(value.serialize())
+
+
+def decode_value(data):
+    """ :rtype: Value """
+    if data is None:
+        return None
+    return Value.deserialize(data)
+
+
+def encode_record(key, value):
+    """ encodes a key and it's value, for streaming and repair """
+    record = [key]
+    record.extend(value.serialize())
+    return record
+
+
+def decode_record(record):
+    """ returns the (key, Value) pair for an encoded record """
+    return record[0], Value.deserialize(record[1:])
+
+
+def record_size(record):
+    """
+    returns the approximate number of bytes an encoded record takes up on
+    the wire, for batching and throttling streamed records
+    """
+    key, data = record[0], record[1]
+    return len(key) + (len(data) if isinstance(data, basestring) else 0) + (_field_overhead * len(record))
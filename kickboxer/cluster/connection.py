@@ -1,12 +1,37 @@
-from socket import error as socketerror
+from socket import error as socketerror, IPPROTO_TCP, TCP_NODELAY
+
+import gevent
 from gevent import socket
+from gevent.lock import Semaphore
 
 
 class Connection(object):
+    """
+    a socket connection, with a buffered reader and writer
+
+    incoming data is received into a reusable buffer, and reads are served
+    from it, so small messages arriving together are read with one recv.
+    read_buffer returns a read only view of the buffer, instead of copying
+    the bytes out of it. The buffer grows to fit messages larger than it
+
+    small writes are corked, and sent together by a greenlet that runs
+    once the writing greenlets yield, so writing many small messages at
+    once, like fanning a request out, costs one send. Nagle's algorithm
+    is turned off, since writes are already coalesced. Errors sending
+    corked writes close the connection, and show up on the next read
+    """
 
     class ClosedException(Exception):
         """ Called when the connection is closed """
 
+    # the initial size of the read buffer, buffers grown past
+    # max_read_buffer_size are shrunk once they're emptied
+    read_buffer_size = 64 * 1024
+    max_read_buffer_size = 1024 * 1024
+
+    # writes are corked until this many bytes are waiting to be sent
+    cork_size = 64 * 1024
+
     def __init__(self, sckt, timeout=None):
         assert isinstance(sckt, socket.socket)
         self.socket = sckt
@@ -14,32 +39,95 @@ class Connection(object):
         self.timeout = timeout
         self.socket.settimeout(self.timeout)
 
+        try:
+            self.socket.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        except socketerror:
+            # not a tcp socket
+            pass
+
+        # several greenlets can write to a pipelined connection,
+        # and their messages can't be interleaved
+        self._write_lock = Semaphore()
+        self._output = []
+        self._output_size = 0
+        self._flusher = None
+
+        # received data waiting to be read is _buffer[_start:_end]
+        self._set_buffer(bytearray(self.read_buffer_size))
+
     @classmethod
     def connect(cls, address, timeout=30.0):
         s = socket.socket()
-        s.connect(address)
+        try:
+            s.connect(address)
+        except socketerror:
+            # unreachable nodes are handled like closed connections
+            s.close()
+            raise Connection.ClosedException
         return Connection(s, timeout=timeout)
 
     def set_timeout(self, timeout):
         self.socket.settimeout(timeout)
 
-    def read(self, size):
-        if not self.is_open:
-            raise Connection.ClosedException
+    def _set_buffer(self, buf):
+        self._buffer = buf
+        self._view = memoryview(buf)
+        self._start = 0
+        self._end = 0
 
-        if size < 1: return
+    def _fill(self, size):
+        """ receives data until at least `size` bytes are buffered """
+        buffered = self._end - self._start
+        if buffered >= size:
+            return
 
-        try:
-            result = self.socket.recv(size)
-        except socketerror:
-            self.is_open = False
-            self.close()
-            raise Connection.ClosedException
+        # make room for the rest of the read at the end of the buffer
+        if self._start + size > len(self._buffer):
+            if size > len(self._buffer):
+                buf = bytearray(max(size, len(self._buffer) * 2))
+                buf[:buffered] = self._view[self._start:self._end]
+                self._set_buffer(buf)
+            else:
+                # slicing copies, so the ranges can overlap
+                self._buffer[:buffered] = self._buffer[self._start:self._end]
+                self._start = 0
+            self._end = buffered
+
+        while self._end - self._start < size:
+            try:
+                received = self.socket.recv_into(self._view[self._end:])
+            except socketerror:
+                self.is_open = False
+                self.close()
+                raise Connection.ClosedException
 
-        if not result:
-            self.is_open = False
+            if not received:
+                self.is_open = False
+                raise Connection.ClosedException
+            self._end += received
+
+    def read_buffer(self, size):
+        """
+        returns a read only buffer of the next `size` bytes. It's a view
+        of the connection's read buffer, and is only valid until the next
+        read from the connection
+        """
+        if not self.is_open:
             raise Connection.ClosedException
-        return result
+
+        self._fill(size)
+        data = buffer(self._buffer, self._start, size)
+        self._start += size
+        if self._start == self._end:
+            if len(self._buffer) > self.max_read_buffer_size:
+                self._set_buffer(bytearray(self.read_buffer_size))
+            else:
+                self._start = self._end = 0
+        return data
+
+    def read(self, size):
+        if size < 1: return
+        return str(self.read_buffer(size))
 
     def read_byte(self):
         return self.read(1)[0]
@@ -47,8 +135,43 @@ class Connection(object):
     def write(self, *data):
         if not self.is_open:
             raise self.ClosedException
-        self.socket.send(''.join(data))
+        self._output.extend(data)
+        self._output_size += sum(len(d) for d in data)
+        if self._output_size >= self.cork_size:
+            self.flush()
+        elif self._flusher is None:
+            self._flusher = gevent.spawn(self._flush_corked)
+
+    def _flush_corked(self):
+        self._flusher = None
+        try:
+            self.flush()
+        except Connection.ClosedException:
+            pass
+
+    def flush(self):
+        """ sends everything that's been written """
+        with self._write_lock:
+            if not self._output:
+                return
+            data = ''.join(self._output)
+            self._output = []
+            self._output_size = 0
+            try:
+                self.socket.sendall(data)
+            except socketerror:
+                self.is_open = False
+                self.socket.close()
+                raise Connection.ClosedException
 
     def close(self):
+        if self._flusher is not None:
+            self._flusher.kill(block=False)
+            self._flusher = None
+        if self.is_open and self._output:
+            try:
+                self.flush()
+            except Connection.ClosedException:
+                pass
         self.socket.close()
 
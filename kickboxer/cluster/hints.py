@@ -0,0 +1,85 @@
+from collections import deque
+import time
+
+
+class HintStore(object):
+    """
+    mutations that couldn't be delivered to a replica, kept by target node,
+    so they can be replayed when the node comes back, instead of waiting
+    for repair or streaming to catch it up
+
+    the store is bounded by the total number of hints, new hints are
+    dropped when it's full, and by age, old hints are dropped when
+    they're replayed. A node that's been gone longer than max_age
+    needs a repair anyway
+    """
+
+    def __init__(self, max_hints=100000, max_age=60 * 60 * 3):
+        """
+        :param max_hints: the most hints to keep, for all nodes
+        :param max_age: the number of seconds to keep hints for
+        """
+        super(HintStore, self).__init__()
+        self.max_hints = max_hints
+        self.max_age = max_age
+
+        # node_id -> deque of (created, (instruction, key, args, timestamp))
+        self._hints = {}
+        self._num_hints = 0
+
+    def __len__(self):
+        return self._num_hints
+
+    def __repr__(self):
+        return '<HintStore nodes={} hints={}>'.format(len(self._hints), self._num_hints)
+
+    def node_ids(self):
+        """ returns the ids of the nodes with hints """
+        return self._hints.keys()
+
+    def count(self, node_id):
+        return len(self._hints.get(node_id, ()))
+
+    def add(self, node_id, instruction, key, args, timestamp):
+        """ records a mutation missed by the given node, returns False if the store is full """
+        if self._num_hints >= self.max_hints:
+            return False
+        self._hints.setdefault(node_id, deque()).append((time.time(), (instruction, key, args, timestamp)))
+        self._num_hints += 1
+        return True
+
+    def expire(self, node_id, now=None):
+        """ drops the given node's hints that are older than max_age, and returns how many were dropped """
+        hints = self._hints.get(node_id)
+        if not hints:
+            return 0
+        cutoff = (now or time.time()) - self.max_age
+        num_expired = 0
+        while hints and hints[0][0] < cutoff:
+            hints.popleft()
+            num_expired += 1
+        self._num_hints -= num_expired
+        if not hints:
+            del self._hints[node_id]
+        return num_expired
+
+    def peek(self, node_id, count):
+        """ returns the given node's oldest hints, as (instruction, key, args, timestamp) mutations """
+        hints = self._hints.get(node_id, ())
+        return [mutation for _, mutation in list(hints)[:count]]
+
+    def remove(self, node_id, count):
+        """ drops the given node's oldest hints, once they've been replayed """
+        hints = self._hints.get(node_id)
+        if not hints:
+            return
+        count = min(count, len(hints))
+        for _ in range(count):
+            hints.popleft()
+        self._num_hints -= count
+        if not hints:
+            del self._hints[node_id]
+
+    def discard(self, node_id):
+        """ drops all of the given node's hints """
+        self._num_hints -= len(self._hints.pop(node_id, ()))
@@ -1,7 +1,8 @@
 from collections import namedtuple
 from datetime import datetime
 import inspect
-import pickle
+import itertools
+from operator import attrgetter
 import struct
 import uuid
 
@@ -11,6 +12,27 @@ from kickboxer.cluster.connection import Connection
 from kickboxer.utils import serialize_timestamp
 
 
+class MessageType(type):
+    """
+    builds the codec for each message class when it's defined, instead
+    of inspecting the class on every send and read
+
+    the encoder is an attrgetter for the constructor args, which returns
+    the message body values in order, and classes are registered by
+    message type, so read can look up the class to decode with
+    """
+
+    def __init__(cls, name, bases, attrs):
+        super(MessageType, cls).__init__(name, bases, attrs)
+        if cls.__message_type__ is None:
+            return
+        assert cls.__message_type__ not in cls.__klass_map__, \
+            'duplicate message type: {}'.format(cls.__message_type__)
+        cls.__arg_spec__ = [a for a in inspect.getargspec(cls.__init__).args if a != 'self']
+        cls._encode = staticmethod(attrgetter(*cls.__arg_spec__))
+        cls.__klass_map__[cls.__message_type__] = cls
+
+
 class Message(object):
     """
     Base class of messages sent between peers
@@ -29,31 +51,44 @@ class Message(object):
     ie:
     self.value = value # this works
     self.value = v # this won't work
+
+    message ids are only used to match responses to requests on a
+    connection, so they're taken from a counter, not uuids
     """
 
+    __metaclass__ = MessageType
+
     __message_type__ = None
-    __arg_spec__ = {}
+
+    # [message type (4b)][message size (4b)]
+    _header = struct.Struct('!2I')
+
+    # bulk messages, like streamed data, are sent on their own
+    # connections, so they don't hold up client queries
+    __bulk__ = False
+
+    # the constructor args, set on each message class by MessageType
+    __arg_spec__ = None
+
+    # message type -> message class
     __klass_map__ = {}
 
+    _message_ids = itertools.count(1)
+
     @staticmethod
     def _uuid_bytes(v):
         return v.bytes if isinstance(v, uuid.UUID) else v
 
     @classmethod
     def _get_argspec(cls):
-        if cls.__message_type__ not in Message.__arg_spec__:
-            args = inspect.getargspec(cls.__init__).args
-            arg_spec = [a for a in args if a != 'self']
-            Message.__arg_spec__[cls.__message_type__] = arg_spec
-        return Message.__arg_spec__[cls.__message_type__]
+        return cls.__arg_spec__
 
     def __init__(self, sender_id, message_id=None):
         super(Message, self).__init__()
         self.sender_id = Message._uuid_bytes(sender_id)
-        self.message_id = Message._uuid_bytes(message_id or uuid.uuid1())
+        self.message_id = next(Message._message_ids) if message_id is None else message_id
 
     def __repr__(self):
-        args = inspect.getargspec(self.__init__).args
         def maybe_get_uuid(k):
             v = getattr(self, k)
             if isinstance(v, basestring):
@@ -63,26 +98,34 @@ class Message(object):
                     except Exception:
                         pass
             return v
-        message_data = [maybe_get_uuid(a) for a in args if a != 'self']
+        message_data = [maybe_get_uuid(a) for a in self.__arg_spec__ or ()]
         return '<{} {}>'.format(self.__class__.__name__, message_data)
 
     @property
     def sender(self):
         return uuid.UUID(bytes=self.sender_id)
 
+    def encode(self):
+        """ returns the message's header and body bytes """
+        assert self.__message_type__ is not None
+        message_body = msgpack.dumps(self._encode(self))
+        return self._header.pack(self.__message_type__, len(message_body)), message_body
+
+    @classmethod
+    def decode(cls, message_type, body):
+        """
+        builds a message from it's type and body bytes
+
+        :rtype: Message
+        """
+        return Message.__klass_map__[message_type](*msgpack.loads(body))
+
     def send(self, conn):
         """
         sends this message's bytes over the given socket
         :type conn: Connection
         """
-        assert self.__message_type__ is not None
-        arg_spec = self._get_argspec()
-        message_data = [getattr(self, a) for a in arg_spec]
-        message_body = msgpack.dumps(message_data)
-        conn.write(
-            struct.pack('!2I', self.__message_type__, len(message_body)),
-            message_body
-        )
+        conn.write(*self.encode())
 
     @classmethod
     def read(cls, conn):
@@ -94,20 +137,9 @@ class Message(object):
         """
         # don't read from subclasses
         assert cls == Message
-        if not Message.__klass_map__:
-            def discover(baseklass):
-                assert isinstance(baseklass, type)
-                assert issubclass(baseklass, Message)
-                for klass in baseklass.__subclasses__():
-                    if klass.__message_type__ is not None:
-                        Message.__klass_map__[klass.__message_type__] = klass
-                    discover(klass)
-            discover(Message)
-
-        message_type, message_size = struct.unpack('!2I', conn.read(8))
-        message_args = msgpack.loads(conn.read(message_size))
-        message = Message.__klass_map__[message_type](*message_args)
-        return message
+        # the body is unpacked straight out of the connection's read buffer
+        message_type, message_size = Message._header.unpack_from(conn.read_buffer(Message._header.size))
+        return Message.decode(message_type, conn.read_buffer(message_size))
 
 
 # ----------- startup and connection -----------
@@ -118,21 +150,27 @@ class NoopMessage(Message):
 class ConnectionRequest(Message):
     __message_type__ = 101
 
-    def __init__(self, sender_id, sender_address, token, sender_name=None, message_id=None):
+    def __init__(self, sender_id, sender_address, tokens, sender_name=None, message_id=None):
         super(ConnectionRequest, self).__init__(sender_id, message_id)
         self.sender_address = tuple(sender_address)
         self.sender_name = sender_name
-        self.token = str(token) if token is not None else None
+        self.tokens = [str(t) for t in tokens]
+
+    def get_tokens(self):
+        return [long(t) for t in self.tokens]
 
 
 class ConnectionAcceptedResponse(Message):
     __message_type__ = 102
 
-    def __init__(self, sender_id, token, name, message_id=None):
+    def __init__(self, sender_id, tokens, name, message_id=None):
         super(ConnectionAcceptedResponse, self).__init__(sender_id, message_id)
-        self.token = token
+        self.tokens = [str(t) for t in tokens]
         self.name = name
 
+    def get_tokens(self):
+        return [long(t) for t in self.tokens]
+
 
 class ConnectionRefusedResponse(Message):
     __message_type__ = 103
@@ -152,12 +190,12 @@ class DiscoverPeersResponse(Message):
     includes data about all known peers
 
     peers will be a tuple of this format:
-        (<(address, port)>, <node_id>, <token>, <name>)
+        (<(address, port)>, <node_id>, <tokens>, <name>)
 
     """
     __message_type__ = 202
 
-    PeerData = namedtuple('PeerData', ['address', 'node_id', 'token', 'name'])
+    PeerData = namedtuple('PeerData', ['address', 'node_id', 'tokens', 'name'])
 
     def __init__(self, sender_id, peers_list, message_id=None):
         super(DiscoverPeersResponse, self).__init__(sender_id, message_id)
@@ -165,11 +203,11 @@ class DiscoverPeersResponse(Message):
 
         #post process peers list data
         for peer in peers_list:
-            address, node_id, token, name = peer
+            address, node_id, tokens, name = peer
             self.peers_list.append(DiscoverPeersResponse.PeerData(
                 tuple(address),
                 Message._uuid_bytes(node_id),
-                str(token) if token else  None,
+                [str(t) for t in tokens],
                 name
             ))
 
@@ -179,7 +217,7 @@ class DiscoverPeersResponse(Message):
             DiscoverPeersResponse.PeerData(
                 tuple(p.address),
                 uuid.UUID(bytes=p.node_id),
-                long(p.token) if p.token else None,
+                [long(t) for t in p.tokens],
                 p.name
             )
             for p in self.peers_list
@@ -257,14 +295,75 @@ class MutationOperationResponse(Message):
         self.result = result
 
 
+class BatchRetrievalRequest(Message):
+    """ executes a retrieval instruction against several keys """
+    __message_type__ = 308
+
+    def __init__(self, sender_id, instruction, keys, args, message_id=None):
+        super(BatchRetrievalRequest, self).__init__(sender_id, message_id)
+        self.instruction = instruction
+        self.keys = keys
+        self.args = args
+
+
+class BatchRetrievalResponse(Message):
+    """ data is the list of values for the requested keys, in order """
+    __message_type__ = 309
+
+    def __init__(self, sender_id, data, message_id=None):
+        super(BatchRetrievalResponse, self).__init__(sender_id, message_id)
+        self.data = data
+
+
+class BatchMutationRequest(Message):
+    """
+    executes several mutation instructions
+
+    mutations will be a list of this format:
+        [<instruction>, <key>, <args>, <timestamp>]
+    """
+    __message_type__ = 310
+
+    def __init__(self, sender_id, mutations, message_id=None):
+        super(BatchMutationRequest, self).__init__(sender_id, message_id)
+        self.mutations = []
+        for instruction, key, args, timestamp in mutations:
+            if isinstance(timestamp, datetime):
+                timestamp = serialize_timestamp(timestamp)
+            self.mutations.append([instruction, key, args, timestamp])
+
+
+class BatchMutationResponse(Message):
+    """ results is the list of results for the requested mutations, in order """
+    __message_type__ = 311
+
+    def __init__(self, sender_id, results, message_id=None):
+        super(BatchMutationResponse, self).__init__(sender_id, message_id)
+        self.results = results
+
+
 # ----------- data streaming -----------
 
 class StreamRequest(Message):
     """
     requests the destination node to stream keys replicated
     by the sending node to the sending node
+
+    if token ranges are given, only the keys in them are
+    streamed. They will be a list of this format:
+        [<start token>, <stop token>]
     """
     __message_type__ = 701
+    __bulk__ = True
+
+    def __init__(self, sender_id, token_ranges=None, message_id=None):
+        super(StreamRequest, self).__init__(sender_id, message_id)
+        self.token_ranges = [[str(start), str(stop)] for start, stop in token_ranges] if token_ranges else None
+
+    def get_token_ranges(self):
+        if self.token_ranges is None:
+            return None
+        return [(long(start), long(stop)) for start, stop in self.token_ranges]
 
 
 class StreamResponse(Message):
@@ -272,12 +371,26 @@ class StreamResponse(Message):
 
 
 class StreamDataRequest(Message):
-    """ sends 1 or more key/value pairs """
+    """
+    sends 1 or more key/value pairs
+
+    token ranges are the ranges that every key in was sent with this
+    request, so the receiving node can checkpoint it's progress. They
+    will be a list of this format:
+        [<start token>, <stop token>]
+    """
     __message_type__ = 703
+    __bulk__ = True
 
-    def __init__(self, sender_id, data, message_id=None):
+    def __init__(self, sender_id, data, token_ranges=None, message_id=None):
         super(StreamDataRequest, self).__init__(sender_id, message_id)
         self.data = data
+        self.token_ranges = [[str(start), str(stop)] for start, stop in token_ranges] if token_ranges else None
+
+    def get_token_ranges(self):
+        if self.token_ranges is None:
+            return None
+        return [(long(start), long(stop)) for start, stop in self.token_ranges]
 
 
 class StreamDataResponse(Message):
@@ -286,12 +399,83 @@ class StreamDataResponse(Message):
 class StreamCompleteRequest(Message):
     """ sent when a node has finished streaming data to another node """
     __message_type__ = 705
+    __bulk__ = True
 
 
 class StreamCompleteResponse(Message):
     __message_type__ = 716
 
 
+# ----------- anti-entropy repair -----------
+
+class MerkleTreeRequest(Message):
+    """
+    requests the hashes of merkle tree nodes, limited to the
+    given token range
+
+    nodes will be a list of this format:
+        [<level>, <index>]
+    """
+    __message_type__ = 721
+    __bulk__ = True
+
+    def __init__(self, sender_id, start_token, stop_token, nodes, message_id=None):
+        super(MerkleTreeRequest, self).__init__(sender_id, message_id)
+        self.start_token = str(start_token)
+        self.stop_token = str(stop_token)
+        self.nodes = nodes
+
+    @property
+    def token_range(self):
+        return long(self.start_token), long(self.stop_token)
+
+
+class MerkleTreeResponse(Message):
+    """ hashes is the list of hashes for the requested nodes, in order """
+    __message_type__ = 722
+
+    def __init__(self, sender_id, hashes, message_id=None):
+        super(MerkleTreeResponse, self).__init__(sender_id, message_id)
+        self.hashes = hashes
+
+
+class RepairDataRequest(Message):
+    """
+    sends the sender's key/value pairs for a token range that differs
+    between the nodes, and requests the receiver's pairs for that range
+    """
+    __message_type__ = 723
+    __bulk__ = True
+
+    def __init__(self, sender_id, start_token, stop_token, data, message_id=None):
+        super(RepairDataRequest, self).__init__(sender_id, message_id)
+        self.start_token = str(start_token)
+        self.stop_token = str(stop_token)
+        self.data = data
+
+    @property
+    def token_range(self):
+        return long(self.start_token), long(self.stop_token)
+
+
+class RepairDataResponse(Message):
+    """
+    data is a batch of the receiver's key/value pairs from the start of
+    the requested range. If it doesn't cover the whole range, next token
+    is the token the rest of the range should be requested from
+    """
+    __message_type__ = 724
+
+    def __init__(self, sender_id, data, next_token=None, message_id=None):
+        super(RepairDataResponse, self).__init__(sender_id, message_id)
+        self.data = data
+        self.next_token = str(next_token) if next_token is not None else None
+
+    @property
+    def next_token_long(self):
+        return long(self.next_token) if self.next_token is not None else None
+
+
 # ----------- token discovery / communication -----------
 
 class AnnounceTokenRequest(Message):
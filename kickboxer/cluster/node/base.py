@@ -3,11 +3,17 @@ import uuid
 
 class BaseNode(object):
 
-    def __init__(self, node_id=None, name=None, token=None):
+    def __init__(self, node_id=None, name=None, token=None, tokens=None):
+        """
+        :param token: the node's token, for nodes with a single token
+        :param tokens: the node's tokens, for nodes with virtual nodes
+        """
         super(BaseNode, self).__init__()
         self.node_id = node_id or uuid.uuid4()
         self.name = name
-        self.token = token
+        self.tokens = tuple(tokens) if tokens else ()
+        if token is not None:
+            self.token = token
 
         # status tracking
         self.last_ping = None
@@ -16,14 +22,38 @@ class BaseNode(object):
     def __hash__(self):
         return hash(self.node_id)
 
+    @property
+    def token(self):
+        """ the node's first token """
+        return self.tokens[0] if self.tokens else None
+
+    @token.setter
+    def token(self, token):
+        """ replaces all of the node's tokens with the given token """
+        self.tokens = (token,) if token is not None else ()
+
     def ping(self):
         raise NotImplementedError
 
     def execute_retrieval_instruction(self, instruction, key, args, digest=False):
+        """
+        :param digest: return a digest of the result, instead of the result
+        """
         raise NotImplementedError
 
     def execute_mutation_instruction(self, instruction, key, args, timestamp):
         raise NotImplementedError
 
+    def execute_batch_retrieval_instruction(self, instruction, keys, args):
+        """ returns a list of the values for the given keys, in order """
+        raise NotImplementedError
+
+    def execute_batch_mutation_instruction(self, mutations):
+        """
+        :param mutations: a list of (instruction, key, args, timestamp) tuples
+        :return: a list of the results for the given mutations, in order
+        """
+        raise NotImplementedError
+
 
 
@@ -1,12 +1,11 @@
 from datetime import datetime
 
 from kickboxer.cluster.node.base import BaseNode
-from kickboxer.utils import deserialize_timestamp
 
 
 class LocalNode(BaseNode):
 
-    def __init__(self, store, address=None, node_id=None, name=None, token=None):
+    def __init__(self, store, address=None, node_id=None, name=None, token=None, tokens=None, num_tokens=1):
         """
         :param store:
         :param store: kickboxer.store.redis.RedisStore
@@ -18,26 +17,36 @@ class LocalNode(BaseNode):
         :param name:
         :param token:
         :param token:
+        :param tokens:
+        :param tokens:
+        :param num_tokens: the number of random tokens to use, if no tokens are given
+        :type num_tokens: int
         """
-        super(LocalNode, self).__init__(node_id, name, token)
+        super(LocalNode, self).__init__(node_id, name, token, tokens)
         self.address = address
 
         # storage
         self.store = store
-        self.token = self.token if self.token is not None else self.store.get_random_token()
+        if not self.tokens:
+            self.tokens = tuple(self.store.get_random_token() for _ in range(max(1, num_tokens)))
 
     def ping(self):
         self.last_ping = datetime.utcnow()
         self.ping_time = 0
 
     def execute_retrieval_instruction(self, instruction, key, args, digest=False):
-        return getattr(self.store, instruction)(key, *args)
+        result = getattr(self.store, instruction)(key, *args)
+        return self.store.digest(result) if digest else result
 
     def execute_mutation_instruction(self, instruction, key, args, timestamp):
-        if isinstance(timestamp, (int, long)):
-            timestamp = deserialize_timestamp(timestamp)
         return getattr(self.store, instruction)(key, *args, timestamp=timestamp)
 
+    def execute_batch_retrieval_instruction(self, instruction, keys, args):
+        return self.store.execute_batch_retrieval(instruction, keys, args)
+
+    def execute_batch_mutation_instruction(self, mutations):
+        return self.store.execute_batch_mutation(mutations)
+
 
 
 
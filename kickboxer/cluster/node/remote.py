@@ -1,13 +1,15 @@
 from contextlib import contextmanager
 from datetime import datetime
-import pickle
 import time
 
-from gevent.queue import Queue, Empty
+from gevent.lock import Semaphore
 
 from kickboxer.cluster.node.base import BaseNode
 from kickboxer.cluster.connection import Connection
-from kickboxer.cluster import messages
+from kickboxer.cluster import codec, messages
+from kickboxer.cluster.pipeline import PipelinedConnection
+from kickboxer.cluster.throttle import ConcurrencyLimit
+from kickboxer.metrics import Metrics
 
 
 class RemoteNode(BaseNode):
@@ -22,116 +24,139 @@ class RemoteNode(BaseNode):
         CLOSED      = 4
         REFUSED     = 5
 
-    def __init__(self, address, node_id=None, name=None, token=None, local_node=None):
-        super(RemoteNode, self).__init__(node_id, name, token)
+    class Lane(object):
+        """
+        classes of traffic sent to a remote node, each lane has it's own
+        connections, so bulk traffic, like streaming and repair, never
+        queues up ahead of client queries
+        """
+        QUERY   = 'query'
+        BULK    = 'bulk'
+
+    # the most requests in flight on each lane, None is unlimited.
+    # Bulk requests over the limit wait, without holding up queries
+    max_lane_requests = {Lane.QUERY: None, Lane.BULK: 8}
+
+    # the number of connections opened for each lane. Requests are
+    # pipelined over them, so this doesn't need to grow with load
+    connections_per_lane = 1
+
+    def __init__(self, address, node_id=None, name=None, token=None, local_node=None, tokens=None):
+        super(RemoteNode, self).__init__(node_id, name, token, tokens)
         self.address = address
 
         from kickboxer.cluster.node.local import LocalNode
         assert isinstance(local_node, LocalNode)
         self.local_node = local_node
-        self.pool = Queue()
+        self.connections = {lane: [] for lane in self.max_lane_requests}
+        self._connect_locks = {lane: Semaphore() for lane in self.max_lane_requests}
+        self._lane_limits = {lane: ConcurrencyLimit(limit) for lane, limit in self.max_lane_requests.items()}
+        self.metrics = Metrics()
 
         self.status = RemoteNode.Status.INITIALIZED
-        self.message_queue = Queue()
-        self.connection_set = set()
 
         self._stopping = False
 
     @property
     def peer_data(self):
-        return self.address, self.node_id, self.token, self.name
+        return self.address, self.node_id, self.tokens, self.name
+
+    def _open_connection(self):
+        """ connects to the remote node, and introduces the local node """
+        conn = Connection.connect(self.address)
+        messages.ConnectionRequest(
+            self.local_node.node_id,
+            self.local_node.address,
+            self.local_node.tokens,
+            sender_name=self.local_node.name
+        ).send(conn)
+        response = messages.Message.read(conn)
+        if not isinstance(response, messages.ConnectionAcceptedResponse):
+            raise RemoteNode.ConnectionError
+        self.metrics.incr('connections_opened')
+        return PipelinedConnection(conn)
+
+    def _get_connection(self, lane=Lane.QUERY):
+        """
+        returns the lane's least busy connection, opening a new one if
+        the lane has less than connections_per_lane open
 
-    def _get_connection(self):
-        """ returns a connection, either from the pool, or a new connection """
+        :rtype: PipelinedConnection
+        """
         if self._stopping:
             raise RemoteNode.ConnectionError('can\'t create connections while node is shutting down')
-        try:
-            # get a connection
-            conn = self.pool.get(block=False)
-        except Empty:
-            # or create a new one
-            conn = Connection.connect(self.address)
-            messages.ConnectionRequest(
-                self.local_node.node_id,
-                self.local_node.address,
-                self.local_node.token,
-                sender_name=self.local_node.name
-            ).send(conn)
-            response = messages.Message.read(conn)
-            if not isinstance(response, messages.ConnectionAcceptedResponse):
-                raise RemoteNode.ConnectionError
-
-        self.connection_set.add(conn)
-        return conn
-
-    def _return_connection(self, conn):
-        assert isinstance(conn, Connection)
-        if conn.is_open:
-            self.pool.put(conn)
+        with self._connect_locks[lane]:
+            conns = self.connections[lane] = [c for c in self.connections[lane] if c.is_open]
+            if len(conns) < self.connections_per_lane:
+                conns.append(self._open_connection())
+        return min(conns, key=lambda c: c.num_pending)
 
     @contextmanager
-    def _connection(self):
+    def _lane(self, lane):
         """
-        context manager that pulls a connection from this remote node's connection
-        pool, and returns it to the pool when it's done being used
+        context manager that waits until the lane has room for another request.
+        The number of requests queued and in flight on each lane are kept in
+        this node's metrics
         """
-        conn = self._get_connection()
-        yield conn
-        self._return_connection(conn)
+        limit = self._lane_limits[lane]
+        self.metrics.incr('{}_lane_queued'.format(lane))
+        try:
+            if limit.acquire():
+                self.metrics.incr('{}_lane_waits'.format(lane))
+        finally:
+            self.metrics.decr('{}_lane_queued'.format(lane))
+        self.metrics.set('{}_lane_in_flight'.format(lane), limit.active)
+        try:
+            yield
+        finally:
+            limit.release()
+            self.metrics.set('{}_lane_in_flight'.format(lane), limit.active)
 
     def add_conn(self, conn):
+        """ adds a connection that's finished the connection handshake to the query lane """
         assert isinstance(conn, Connection)
-        self.connection_set.add(conn)
-        self.pool.put(conn)
+        self.connections[RemoteNode.Lane.QUERY].append(PipelinedConnection(conn))
 
     def connect(self):
         """ establishes a connection with this remote node """
-        with self._connection() as _: pass
+        self._get_connection()
         self.status = RemoteNode.Status.UP
 
-    def send_message(self, request, save=False, retries=3):
+    def send_message(self, request, retries=3, wait=False):
         """
         Sends a messages to a remote node and returns it's reply. If there is
-        an error sending a message, it will be retried, and saved if the save
-        parameter is set to True
+        an error sending a message, it will be retried, and the node is
+        considered down if it keeps failing, until it replies to something
+        again. Bulk messages are sent on the bulk lane
 
         :param request:
         :type request: messages.Message
-        :param save: indicates that the message should be saved if it can't be delivered
         :param retries: the number of times to attempt to send a messages before
             considering this node down
+        :param wait: wait for the reply without timing out, for requests that
+            can take a long time to complete, like streams
         """
         assert isinstance(request, messages.Message)
-        for i in range(retries):
-            try:
-                with self._connection() as conn:
-                    request.send(conn)
-                    return messages.Message.read(conn)
-            except Connection.ClosedException:
-                if i + 1 >= retries:
-                    self.status = RemoteNode.Status.DOWN
-                    if save:
-                        self.message_queue.put(request)
-                    raise
+        lane = RemoteNode.Lane.BULK if request.__bulk__ else RemoteNode.Lane.QUERY
+        with self._lane(lane):
+            for i in range(retries):
+                try:
+                    response = self._get_connection(lane).request(request, wait=wait)
+                except Connection.ClosedException:
+                    if i + 1 >= retries:
+                        self.status = RemoteNode.Status.DOWN
+                        raise
+                else:
+                    self.status = RemoteNode.Status.UP
+                    return response
 
     def stop(self):
         self._stopping = True
         try:
-
-            while True:
-                try:
-                    conn = self.pool.get(block=False)
+            for lane, conns in self.connections.items():
+                self.connections[lane] = []
+                for conn in conns:
                     conn.close()
-                except Empty:
-                    break
-
-            while True:
-                try:
-                    conn = self.connection_set.pop()
-                    conn.close()
-                except KeyError:
-                    break
-
         finally:
             self._stopping = False
 
@@ -148,6 +173,18 @@ class RemoteNode(BaseNode):
         self.ping_time = end_time - start_time
 
     def execute_retrieval_instruction(self, instruction, key, args, digest=False):
+        if digest:
+            response = self.send_message(
+                messages.RetrievalDigestRequest(
+                    self.local_node.node_id,
+                    instruction,
+                    key,
+                    args
+                )
+            )
+            assert isinstance(response, messages.RetrievalDigestResponse)
+            return response.digest
+
         response = self.send_message(
             messages.RetrievalValueRequest(
                 self.local_node.node_id,
@@ -156,8 +193,10 @@ class RemoteNode(BaseNode):
                 args
             )
         )
+        if isinstance(response, messages.UnknownKeyResponse):
+            return None
         assert isinstance(response, messages.RetrievalValueResponse)
-        return pickle.loads(response.data)
+        return codec.decode_value(response.data)
 
     def execute_mutation_instruction(self, instruction, key, args, timestamp):
         response = self.send_message(
@@ -169,6 +208,28 @@ class RemoteNode(BaseNode):
         assert isinstance(response, messages.MutationOperationResponse)
         return response.result
 
+    def execute_batch_retrieval_instruction(self, instruction, keys, args):
+        response = self.send_message(
+            messages.BatchRetrievalRequest(
+                self.local_node.node_id,
+                instruction,
+                keys,
+                args
+            )
+        )
+        assert isinstance(response, messages.BatchRetrievalResponse)
+        return [codec.decode_value(d) for d in response.data]
+
+    def execute_batch_mutation_instruction(self, mutations):
+        response = self.send_message(
+            messages.BatchMutationRequest(
+                self.local_node.node_id,
+                mutations
+            )
+        )
+        assert isinstance(response, messages.BatchMutationResponse)
+        return response.results
+
 
 
 
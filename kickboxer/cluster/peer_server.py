@@ -1,18 +1,30 @@
-import pickle
+import logging
 import uuid
 
 from gevent.event import Event
+from gevent.pool import Pool
 from gevent.server import StreamServer
 
 from kickboxer.cluster.cluster import Cluster
 from kickboxer.cluster.connection import Connection
-from kickboxer.cluster import messages
+from kickboxer.cluster import codec, messages
 
-from kickboxer.utils import deserialize_timestamp
+logger = logging.getLogger(__name__)
 
 
 class PeerServer(StreamServer):
-    """ handles incoming requests from other nodes in the cluster """
+    """
+    handles incoming requests from other nodes in the cluster
+
+    requests on a connection are handled concurrently, and each response
+    is sent as soon as it's ready, with the message id of it's request,
+    so the requesting node can match them up. A request that fails gets
+    an ErrorResponse, and the connection stays open
+    """
+
+    # the most requests handled at once for each connection, reading
+    # more requests from the connection waits once it's reached
+    max_concurrent_requests = 128
 
     def __init__(self, listener, cluster, backlog=None, spawn='default', **ssl_args):
         listener = listener or ('', 4379)
@@ -31,6 +43,10 @@ class PeerServer(StreamServer):
     def token(self):
         return self.cluster.token
 
+    @property
+    def tokens(self):
+        return self.cluster.tokens
+
     @property
     def name(self):
         return self.cluster.name
@@ -51,18 +67,20 @@ class PeerServer(StreamServer):
         # accept response and identify
         messages.ConnectionAcceptedResponse(
             self.node_id,
-            str(self.token),
+            self.tokens,
             self.name
         ).send(conn)
 
-        assert response.token is not None
+        assert response.tokens
         peer = self.cluster.add_node(
             node_id,
             response.sender_address,
-            long(response.token),
+            response.get_tokens(),
             name=response.sender_name
         )
-        peer.connect()
+        # recently removed nodes aren't added back
+        if peer is not None:
+            peer.connect()
         return peer
 
     def _execute_request(self, request, peer):
@@ -93,19 +111,23 @@ class PeerServer(StreamServer):
             if val is None:
                 return messages.UnknownKeyResponse(self.node_id)
             else:
-                return messages.RetrievalValueResponse(
-                    self.node_id,
-                    pickle.dumps(val, protocol=pickle.HIGHEST_PROTOCOL)
-                )
+                return messages.RetrievalValueResponse(self.node_id, codec.encode_value(val))
+
+        elif isinstance(request, messages.RetrievalDigestRequest):
+            val = self.cluster.route_local_retrieval_instruction(
+                request.instruction,
+                request.key,
+                request.args
+            )
+            return messages.RetrievalDigestResponse(self.node_id, self.cluster.store.digest(val))
 
         elif isinstance(request, messages.MutationOperationRequest):
             try:
-                timestamp = deserialize_timestamp(request.timestamp) if request.timestamp else request.timestamp
                 result = self.cluster.route_local_mutation_instruction(
                     request.instruction,
                     request.key,
                     request.args,
-                    timestamp
+                    request.timestamp
                 )
                 return messages.MutationOperationResponse(self.node_id, result)
             except Exception as ex:
@@ -113,6 +135,23 @@ class PeerServer(StreamServer):
                     self.node_id, 'error processing request: {} \n {}'.format(request, ex)
                 )
 
+        elif isinstance(request, messages.BatchRetrievalRequest):
+            values = self.cluster.route_local_batch_retrieval_instruction(
+                request.instruction,
+                request.keys,
+                request.args
+            )
+            return messages.BatchRetrievalResponse(self.node_id, [codec.encode_value(v) for v in values])
+
+        elif isinstance(request, messages.BatchMutationRequest):
+            try:
+                results = self.cluster.route_local_batch_mutation_instruction(request.mutations)
+                return messages.BatchMutationResponse(self.node_id, results)
+            except Exception as ex:
+                return messages.ErrorResponse(
+                    self.node_id, 'error processing request: {} \n {}'.format(request, ex)
+                )
+
         elif isinstance(request, messages.ChangedTokenRequest):
             self.cluster.change_token(request.new_token_long, request.node_uuid, alert_cluster=False)
             return messages.ChangedTokenResponse(self.node_id)
@@ -122,17 +161,28 @@ class PeerServer(StreamServer):
             return messages.RemoveNodeResponse(self.node_id)
 
         elif isinstance(request, messages.StreamRequest):
-            self.cluster.stream_to_node(request.sender)
+            self.cluster.stream_to_node(request.sender, request.get_token_ranges())
             return messages.StreamResponse(self.node_id)
 
         elif isinstance(request, messages.StreamDataRequest):
-            self.cluster._receive_streamed_values(request.data)
+            self.cluster._receive_streamed_values(request.data, request.get_token_ranges())
             return messages.StreamDataResponse(self.node_id)
 
         elif isinstance(request, messages.StreamCompleteRequest):
             self.cluster._end_streaming(request.sender)
             return messages.StreamCompleteResponse(self.node_id)
 
+        elif isinstance(request, messages.MerkleTreeRequest):
+            start_token, stop_token = request.token_range
+            store = self.cluster.store
+            hashes = [store.get_merkle_hash(level, idx, start_token, stop_token) for level, idx in request.nodes]
+            return messages.MerkleTreeResponse(self.node_id, hashes)
+
+        elif isinstance(request, messages.RepairDataRequest):
+            start_token, stop_token = request.token_range
+            data, next_token = self.cluster._exchange_repair_data(start_token, stop_token, request.data)
+            return messages.RepairDataResponse(self.node_id, data, next_token)
+
         else:
             return messages.ErrorResponse(self.node_id, 'unexpected message: {}'.format(request))
 
@@ -148,10 +198,10 @@ class PeerServer(StreamServer):
         self.connections[connection_id] = conn
         try:
             peer = self._accept_connection(conn)
+            pool = Pool(self.max_concurrent_requests)
             while True:
                 request = messages.Message.read(conn)
-                response = self._execute_request(request, peer)
-                response.send(conn)
+                pool.spawn(self._respond, conn, request, peer)
         except Connection.ClosedException:
             pass
         finally:
@@ -161,6 +211,19 @@ class PeerServer(StreamServer):
             except KeyError:
                 pass
 
+    def _respond(self, conn, request, peer):
+        try:
+            try:
+                response = self._execute_request(request, peer)
+            except Exception as ex:
+                # only this request fails, the others on the connection carry on
+                logger.exception('error handling request: %r', request)
+                response = messages.ErrorResponse(self.node_id, str(ex))
+            response.message_id = request.message_id
+            response.send(conn)
+        except Connection.ClosedException:
+            pass
+
     def start_accepting(self):
         super(PeerServer, self).start_accepting()
         self.start_event.set()
@@ -0,0 +1,87 @@
+import gevent
+from gevent.event import AsyncResult
+
+from kickboxer.cluster.connection import Connection
+from kickboxer.cluster import messages
+
+
+class PipelinedConnection(object):
+    """
+    sends requests over a connection without waiting for the responses to
+    earlier requests, and matches responses to their requests by message id.
+    The peer server handles requests concurrently, and responses can come
+    back in any order
+
+    responses are read by a greenlet for as long as the connection is open,
+    and requests time out on their own, instead of with the socket timeout.
+    Requests that are waiting when the connection closes fail with
+    Connection.ClosedException
+    """
+
+    def __init__(self, conn, timeout=None):
+        """
+        :param conn: a connection that's finished the connection handshake
+        :type conn: Connection
+        :param timeout: seconds to wait for each response, defaults to the connection's timeout
+        """
+        super(PipelinedConnection, self).__init__()
+        self.conn = conn
+        self.timeout = conn.timeout if timeout is None else timeout
+        self.conn.set_timeout(None)
+
+        # message_id -> AsyncResult for requests waiting on a response
+        self._pending = {}
+        self._reader = gevent.spawn(self._read_responses)
+
+    def __repr__(self):
+        return '<PipelinedConnection pending={}>'.format(len(self._pending))
+
+    @property
+    def is_open(self):
+        return self.conn.is_open
+
+    @property
+    def num_pending(self):
+        return len(self._pending)
+
+    def _read_responses(self):
+        try:
+            while True:
+                response = messages.Message.read(self.conn)
+                result = self._pending.pop(response.message_id, None)
+                # responses to requests that timed out are dropped
+                if result is not None:
+                    result.set(response)
+        except Connection.ClosedException:
+            pass
+        finally:
+            self.conn.is_open = False
+            self.conn.close()
+            pending, self._pending = self._pending, {}
+            for result in pending.values():
+                result.set_exception(Connection.ClosedException())
+
+    def request(self, message, wait=False):
+        """
+        sends the request, and waits for it's response
+
+        :param message:
+        :type message: messages.Message
+        :param wait: wait for the response without timing out
+        :rtype: messages.Message
+        """
+        if not self.is_open:
+            raise Connection.ClosedException
+        result = AsyncResult()
+        self._pending[message.message_id] = result
+        try:
+            message.send(self.conn)
+            return result.get(timeout=None if wait else self.timeout)
+        except gevent.Timeout:
+            raise Connection.ClosedException
+        finally:
+            self._pending.pop(message.message_id, None)
+
+    def close(self):
+        self.conn.close()
+        self._reader.kill()
@@ -0,0 +1,143 @@
+from bisect import bisect_right
+
+
+def merge_token_ranges(ranges):
+    """ sorts the given (start, stop) token ranges, and merges adjacent and overlapping ranges """
+    merged = []
+    for start, stop in sorted(ranges):
+        if merged and merged[-1][1] + 1 >= start:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def subtract_token_ranges(ranges, removed):
+    """ returns the parts of the given (start, stop) token ranges that aren't in any of the removed ranges """
+    removed = merge_token_ranges(removed)
+    remaining = []
+    for start, stop in merge_token_ranges(ranges):
+        for removed_start, removed_stop in removed:
+            if removed_stop < start or removed_start > stop:
+                continue
+            if removed_start > start:
+                remaining.append((start, removed_start - 1))
+            start = removed_stop + 1
+            if start > stop:
+                break
+        if start <= stop:
+            remaining.append((start, stop))
+    return remaining
+
+
+class TokenRing(object):
+    """
+    an immutable snapshot of the token ring
+
+    each of a node's tokens is a position on the ring, and nodes with
+    more than one token (virtual nodes) appear at several positions.
+    Positions are kept in token order, along with a flat array of their
+    tokens, and the replica nodes for each position are worked out when
+    the snapshot is built. Finding the replicas for a token is a single
+    bisect of the token array, and returns a tuple shared by every
+    position with the same replicas
+
+    when the ring changes, a new snapshot is built, instead of this
+    one being updated, so a request routed against a snapshot sees
+    a consistent view of the ring
+    """
+
+    __slots__ = ('nodes', 'tokens', 'node_ids', 'replicas', 'num_nodes', '_positions')
+
+    def __init__(self, nodes, replication_factor):
+        """
+        :param nodes: the nodes in the ring
+        :param replication_factor: the number of replicas for each token,
+            0 replicates every token on every node
+        """
+        super(TokenRing, self).__init__()
+        positions = sorted(((t, n) for n in nodes for t in n.tokens), key=lambda p: p[0])
+        self.nodes = tuple(n for _, n in positions)
+        self.tokens = [t for t, _ in positions]
+        self.node_ids = tuple(n.node_id for n in self.nodes)
+        self._positions = {}
+        for i, node_id in enumerate(self.node_ids):
+            self._positions.setdefault(node_id, []).append(i)
+        self.num_nodes = len(self._positions)
+
+        num_positions = len(self.nodes)
+        num_replicas = self.num_nodes if replication_factor == 0 else min(replication_factor, self.num_nodes)
+        # replicas are the distinct nodes found walking clockwise from each
+        # position, equal replica lists share a tuple
+        shared = {}
+        replicas = []
+        for i in range(num_positions):
+            position_replicas = []
+            j = i
+            while len(position_replicas) < num_replicas:
+                node = self.nodes[j % num_positions]
+                if node not in position_replicas:
+                    position_replicas.append(node)
+                j += 1
+            position_replicas = tuple(position_replicas)
+            replicas.append(shared.setdefault(position_replicas, position_replicas))
+        self.replicas = tuple(replicas)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def __getitem__(self, idx):
+        return self.nodes[idx]
+
+    def __contains__(self, node_id):
+        return node_id in self._positions
+
+    def __repr__(self):
+        return '<TokenRing nodes={} positions={}>'.format(self.num_nodes, len(self.nodes))
+
+    @property
+    def has_vnodes(self):
+        """ indicates that some nodes have more than one token """
+        return len(self.nodes) > self.num_nodes
+
+    def index(self, node_id):
+        """ returns the first ring position of the given node """
+        return self._positions[node_id][0]
+
+    def positions(self, node_id):
+        """ returns all of the ring positions of the given node """
+        return self._positions[node_id]
+
+    def get_nodes_for_token(self, token):
+        """ returns a tuple of the owner and replica nodes for the given token """
+        # bisect returns the insertion index for the token,
+        # which is 1 higher than the owning node, and tokens
+        # before the first node wrap around to the last one
+        return self.replicas[bisect_right(self.tokens, token) - 1]
+
+    def get_offset_node_id(self, node_id, offset):
+        """ returns the id of the node `offset` positions away from the given node's first position """
+        return self.node_ids[(self.index(node_id) + offset) % len(self.node_ids)]
+
+    def get_token_ranges(self, max_token):
+        """
+        returns a list of (start, stop, replicas) tuples for the token range
+        each position owns, inclusively. The last position's range wraps
+        around to the start of the token space, and is split in two
+        """
+        ranges = []
+        num_positions = len(self.tokens)
+        for i, start_token in enumerate(self.tokens):
+            if i + 1 < num_positions:
+                stop_token = self.tokens[i + 1] - 1
+                # positions with the same token own nothing
+                if stop_token >= start_token:
+                    ranges.append((start_token, stop_token, self.replicas[i]))
+            else:
+                ranges.append((start_token, max_token, self.replicas[i]))
+                if self.tokens[0] > 0:
+                    ranges.append((0, self.tokens[0] - 1, self.replicas[i]))
+        return ranges
@@ -0,0 +1,164 @@
+import os
+
+import msgpack
+
+from kickboxer.cluster.ring import merge_token_ranges, subtract_token_ranges
+
+
+class StreamSource(object):
+    """ a node streaming data to the local node, and the token ranges it's streaming """
+
+    __slots__ = ('node', 'token_ranges', 'is_complete')
+
+    def __init__(self, node, token_ranges=None):
+        """
+        :param node: the node streaming the data
+        :param token_ranges: the (start, stop) token ranges being streamed, or
+            None if the node is streaming every key the local node replicates
+        """
+        super(StreamSource, self).__init__()
+        self.node = node
+        self.token_ranges = token_ranges
+        self.is_complete = False
+
+    def __repr__(self):
+        return '<StreamSource node={} ranges={}>'.format(
+            self.node.node_id, len(self.token_ranges) if self.token_ranges is not None else 'all'
+        )
+
+    def covers(self, token):
+        if self.token_ranges is None:
+            return True
+        return any(start_token <= token <= stop_token for start_token, stop_token in self.token_ranges)
+
+
+class StreamingSession(object):
+    """
+    tracks the nodes streaming data to the local node. Sources stream
+    concurrently, and can be added while the session is running, the
+    session is complete once every source has finished
+
+    queries for keys that are still being streamed are routed to the
+    source streaming them
+    """
+
+    def __init__(self, reason, previous_status):
+        """
+        :param reason: the reason the session was started
+        :param previous_status: the cluster's status before the session
+            started, it's restored if the session fails
+        """
+        super(StreamingSession, self).__init__()
+        self.reason = reason
+        self.previous_status = previous_status
+        self.sources = []
+
+        # the number of callers using the session, it ends when they're all done
+        self.users = 0
+        self.failed = False
+
+    def __repr__(self):
+        return '<StreamingSession reason={} sources={}>'.format(self.reason, self.sources)
+
+    def add_source(self, node, token_ranges=None):
+        source = StreamSource(node, token_ranges)
+        self.sources.append(source)
+        return source
+
+    def remove_source(self, source):
+        if source in self.sources:
+            self.sources.remove(source)
+
+    def complete(self, node_id):
+        """ marks the oldest unfinished stream from the given node as complete """
+        for source in self.sources:
+            if not source.is_complete and source.node.node_id == node_id:
+                source.is_complete = True
+                return
+
+    @property
+    def pending(self):
+        return [s for s in self.sources if not s.is_complete]
+
+    @property
+    def is_complete(self):
+        return not self.pending
+
+    @property
+    def has_token_ranges(self):
+        """ indicates that some of the unfinished sources are only streaming token ranges """
+        return any(s.token_ranges is not None for s in self.pending)
+
+    def get_source(self, token=None):
+        """
+        returns the node that's streaming the given token, if it's still being
+        streamed. Sources streaming the token's range are preferred over sources
+        streaming every key. The token can be omitted if there are no range sources
+        """
+        full_source = None
+        for source in self.pending:
+            if source.token_ranges is None:
+                full_source = full_source or source.node
+            elif source.covers(token):
+                return source.node
+        return full_source
+
+
+class StreamCheckpoint(object):
+    """
+    the token ranges that have been streamed to the local node by streaming
+    sessions that haven't finished yet, so a stream that breaks partway
+    through is resumed, instead of starting over
+
+    if a path is given, the checkpoint is kept on disk, and a node that's
+    restarted can resume the streams it was running. The file is a msgpack
+    encoded [<reason>, [[<start token>, <stop token>], ...]] list, and is
+    removed once streaming finishes
+    """
+
+    def __init__(self, path=None):
+        """
+        :param path: the file to keep the checkpoint in, or None to keep it in memory
+        """
+        super(StreamCheckpoint, self).__init__()
+        self.path = path
+        self.reason = None
+        self.token_ranges = []
+        if self.path and os.path.exists(self.path):
+            self._load()
+
+    def __repr__(self):
+        return '<StreamCheckpoint reason={} ranges={}>'.format(self.reason, len(self.token_ranges))
+
+    def __nonzero__(self):
+        return bool(self.token_ranges)
+
+    def _load(self):
+        with open(self.path, 'rb') as f:
+            reason, token_ranges = msgpack.loads(f.read())
+        self.reason = reason
+        self.token_ranges = [(long(start), long(stop)) for start, stop in token_ranges]
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(msgpack.dumps([self.reason, [[str(start), str(stop)] for start, stop in self.token_ranges]]))
+        os.rename(tmp_path, self.path)
+
+    def add(self, token_ranges, reason=None):
+        """ records that the given (start, stop) token ranges have been streamed """
+        self.reason = self.reason or reason
+        self.token_ranges = merge_token_ranges(self.token_ranges + list(token_ranges))
+        self._save()
+
+    def remaining(self, token_ranges):
+        """ returns the parts of the given (start, stop) token ranges that haven't been streamed """
+        return subtract_token_ranges(token_ranges, self.token_ranges)
+
+    def clear(self):
+        self.reason = None
+        self.token_ranges = []
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,28 @@
+from unittest.case import TestCase
+
+import msgpack
+
+from kickboxer.cluster import codec
+from kickboxer.store.redis import Value
+from kickboxer.utils import now_timestamp
+
+
+class CodecTest(TestCase):
+
+    def test_values(self):
+        ts = now_timestamp()
+        for value in (Value('a', ts), Value(None, ts), Value('a', ts, ts + 1000), None):
+            data = msgpack.loads(msgpack.dumps(codec.encode_value(value)))
+            self.assertEqual(codec.decode_value(data), value)
+
+    def test_records(self):
+        ts = now_timestamp()
+        for value in (Value('a', ts), Value(None, ts), Value('a', ts, ts + 1000)):
+            data = msgpack.loads(msgpack.dumps(codec.encode_record('k', value)))
+            self.assertEqual(codec.decode_record(data), ('k', value))
+
+    def test_record_size(self):
+        """ the estimated size should be close to the encoded size """
+        record = codec.encode_record('k' * 10, Value('v' * 1000, now_timestamp()))
+        size = len(msgpack.dumps(record))
+        self.assertAlmostEqual(codec.record_size(record), size, delta=size * 0.05)
@@ -0,0 +1,113 @@
+from unittest.case import TestCase
+import uuid
+
+import gevent
+from gevent import socket
+from mock import patch
+
+from kickboxer.cluster import messages
+from kickboxer.cluster.connection import Connection
+
+
+class BufferedReadTest(TestCase):
+    """ tests reading messages through the connection's read buffer """
+
+    def setUp(self):
+        super(BufferedReadTest, self).setUp()
+        self.sender, receiver = socket.socketpair()
+        self.conn = Connection(receiver)
+
+    def tearDown(self):
+        super(BufferedReadTest, self).tearDown()
+        self.sender.close()
+        self.conn.close()
+
+    def _message_bytes(self, message):
+        sender = Connection(self.sender)
+        sent = []
+        sender.write = lambda *data: sent.append(''.join(data))
+        message.send(sender)
+        return sent[0]
+
+    def test_several_messages_per_recv(self):
+        """ messages that arrive together should be read with a single recv """
+        sender_id = uuid.uuid4()
+        data = self._message_bytes(messages.PingRequest(sender_id))
+        self.sender.sendall(data * 10)
+
+        self.assertIsInstance(messages.Message.read(self.conn), messages.PingRequest)
+        # the rest of the messages were received along with the first one
+        self.assertEqual(self.conn._end - self.conn._start, len(data) * 9)
+        for _ in range(9):
+            message = messages.Message.read(self.conn)
+            self.assertIsInstance(message, messages.PingRequest)
+            self.assertEqual(message.sender, sender_id)
+        self.assertEqual(self.conn._end, 0)
+
+    def test_partial_reads(self):
+        """ messages that arrive a few bytes at a time should be put back together """
+        data = self._message_bytes(messages.StreamDataRequest(uuid.uuid4(), ['x' * 100] * 10))
+
+        def _send():
+            for i in range(0, len(data), 7):
+                self.sender.sendall(data[i:i + 7])
+                gevent.sleep(0)
+        gevent.spawn(_send)
+
+        message = messages.Message.read(self.conn)
+        self.assertEqual(message.data, ['x' * 100] * 10)
+
+    def test_large_messages(self):
+        """ the buffer should grow to fit large messages, and shrink again afterwards """
+        batch = ['x' * 1000] * 2000
+        data = self._message_bytes(messages.StreamDataRequest(uuid.uuid4(), batch))
+        data += self._message_bytes(messages.PingRequest(uuid.uuid4()))
+        gevent.spawn(self.sender.sendall, data)
+
+        self.assertEqual(messages.Message.read(self.conn).data, batch)
+        self.assertIsInstance(messages.Message.read(self.conn), messages.PingRequest)
+        self.assertEqual(len(self.conn._buffer), Connection.read_buffer_size)
+
+    def test_closed_connection(self):
+        self.sender.close()
+        with self.assertRaises(Connection.ClosedException):
+            messages.Message.read(self.conn)
+        self.assertFalse(self.conn.is_open)
+
+
+class CorkedWriteTest(TestCase):
+    """ tests coalescing small writes """
+
+    def setUp(self):
+        super(CorkedWriteTest, self).setUp()
+        sender, self.receiver = socket.socketpair()
+        self.conn = Connection(sender)
+
+    def tearDown(self):
+        super(CorkedWriteTest, self).tearDown()
+        self.receiver.close()
+        self.conn.close()
+
+    def test_small_writes_are_sent_together(self):
+        """ messages written before yielding should go out with one send """
+        with patch.object(Connection, 'flush', autospec=True, side_effect=Connection.flush) as flush:
+            for _ in range(10):
+                messages.PingRequest(uuid.uuid4()).send(self.conn)
+            self.assertEqual(flush.call_count, 0)
+            gevent.sleep(0)
+            self.assertEqual(flush.call_count, 1)
+
+        reader = Connection(self.receiver)
+        for _ in range(10):
+            self.assertIsInstance(messages.Message.read(reader), messages.PingRequest)
+
+    def test_large_writes_are_sent_immediately(self):
+        with patch.object(Connection, 'flush', autospec=True, side_effect=Connection.flush) as flush:
+            gevent.spawn(self.conn.write, 'x' * Connection.cork_size)
+            gevent.sleep(0)
+            self.assertEqual(flush.call_count, 1)
+
+    def test_pending_writes_are_sent_on_close(self):
+        messages.PingRequest(uuid.uuid4()).send(self.conn)
+        self.conn.close()
+        self.assertIsInstance(messages.Message.read(Connection(self.receiver)), messages.PingRequest)
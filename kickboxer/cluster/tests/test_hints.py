@@ -0,0 +1,96 @@
+from unittest.case import TestCase
+
+from mock import patch
+
+from kickboxer.cluster.cluster import Cluster
+from kickboxer.cluster.connection import Connection
+from kickboxer.cluster.hints import HintStore
+from kickboxer.cluster.node.remote import RemoteNode
+from kickboxer.tests.base import BaseNodeTestCase
+
+
+class HintStoreTest(TestCase):
+
+    def test_hints_are_bounded(self):
+        """ new hints should be dropped once the store is full """
+        hints = HintStore(max_hints=2)
+        self.assertTrue(hints.add(1, 'set', 'a', ['b'], 1))
+        self.assertTrue(hints.add(2, 'set', 'a', ['b'], 1))
+        self.assertFalse(hints.add(1, 'set', 'c', ['d'], 2))
+        self.assertEqual(len(hints), 2)
+        self.assertEqual(hints.peek(1, 10), [('set', 'a', ['b'], 1)])
+
+    def test_old_hints_expire(self):
+        hints = HintStore(max_age=10)
+        hints.add(1, 'set', 'a', ['b'], 1)
+        self.assertEqual(hints.expire(1), 0)
+
+        hints.add(1, 'set', 'c', ['d'], 2)
+        with patch('time.time', return_value=hints._hints[1][0][0] + 11):
+            hints.add(1, 'set', 'e', ['f'], 3)
+            self.assertEqual(hints.expire(1), 2)
+        self.assertEqual(hints.peek(1, 10), [('set', 'e', ['f'], 3)])
+        self.assertEqual(len(hints), 1)
+
+    def test_replayed_hints_are_removed_in_order(self):
+        hints = HintStore()
+        for i in range(5):
+            hints.add(1, 'set', str(i), [str(i)], i)
+        self.assertEqual([m[1] for m in hints.peek(1, 2)], ['0', '1'])
+        hints.remove(1, 2)
+        self.assertEqual([m[1] for m in hints.peek(1, 10)], ['2', '3', '4'])
+        hints.remove(1, 10)
+        self.assertEqual(hints.node_ids(), [])
+        self.assertEqual(len(hints), 0)
+
+
+class HintedHandoffTest(BaseNodeTestCase):
+
+    def setUp(self):
+        super(HintedHandoffTest, self).setUp()
+        self.node0, self.node1, self.node2 = self.create_nodes(3)
+        self.start_cluster()
+        self.peer = self.node0.cluster.get_node(self.node2.node_id)
+
+    def test_missed_mutations_are_replayed(self):
+        """ mutations a node missed while it was down should be replayed when it's back """
+        with patch.object(self.peer, 'execute_mutation_instruction', side_effect=Connection.ClosedException):
+            self.node0.cluster.execute_mutation_instruction(
+                'set', 'a', ['b'], consistency=Cluster.ConsistencyLevel.ONE, synchronous=True
+            )
+        self.assertEqual(self.node0.cluster.hints.count(self.node2.node_id), 1)
+        self.assertNotIn('a', set(self.node2.store.all_keys()))
+
+        # the node is pinged before it's hints are replayed
+        self.peer.status = RemoteNode.Status.DOWN
+        self.node0.cluster.replay_hints()
+        self.assertEqual(self.peer.status, RemoteNode.Status.UP)
+        self.assertEqual(self.node2.store.get('a').data, 'b')
+        self.assertEqual(len(self.node0.cluster.hints), 0)
+        self.assertEqual(self.node0.cluster.metrics['hints_replayed'], 1)
+
+    def test_missed_batch_mutations_are_replayed(self):
+        items = [(str(i), [str(i)]) for i in range(250)]
+        with patch.object(self.peer, 'execute_batch_mutation_instruction', side_effect=Connection.ClosedException):
+            self.node0.cluster.execute_batch_mutation_instruction(
+                'set', items, consistency=Cluster.ConsistencyLevel.ONE, synchronous=True
+            )
+        self.assertEqual(self.node0.cluster.hints.count(self.node2.node_id), 250)
+
+        with patch.object(self.peer, 'execute_batch_mutation_instruction',
+                          wraps=self.peer.execute_batch_mutation_instruction) as execute:
+            self.node0.cluster.replay_hints()
+        self.assertEqual(execute.call_count, 3)
+        self.assertEqual(set(self.node2.store.all_keys()), {key for key, _ in items})
+
+    def test_failed_replays_keep_their_hints(self):
+        """ a node that errors should keep it's hints, without stopping replay to the other nodes """
+        other = self.node0.cluster.get_node(self.node1.node_id)
+        for peer in (self.peer, other):
+            self.node0.cluster.hints.add(peer.node_id, 'set', 'a', ['b'], 1)
+
+        with patch.object(self.peer, 'execute_batch_mutation_instruction', side_effect=AssertionError):
+            self.node0.cluster.replay_hints()
+        self.assertEqual(self.node0.cluster.hints.count(self.peer.node_id), 1)
+        self.assertEqual(self.node0.cluster.hints.count(other.node_id), 0)
+        self.assertEqual(self.node0.cluster.metrics['hint_replay_errors'], 1)
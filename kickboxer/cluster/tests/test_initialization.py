@@ -1,10 +1,14 @@
 import random
 import string
+from unittest.case import TestCase
 
 import gevent
+from mock import patch
 
 from kickboxer.cluster.cluster import Cluster
 from kickboxer.cluster.tests.base import BaseClusterModificationTest
+from kickboxer.server import Kickboxer
+from kickboxer.store.redis import RedisStore
 from kickboxer.tests.base import LiteralPartitioner, BaseNodeTestCase
 
 
@@ -70,3 +74,48 @@ class MD5InitializationTests(BaseNodeTestCase):
             actual = store_data[key]
             self.assertEqual(expected, actual.data)
 
+
+class VirtualNodeInitializationTests(BaseNodeTestCase):
+
+    def test_data_is_streamed_from_many_nodes(self):
+        """
+        Tests that a node with virtual nodes joining a cluster streams
+        small token ranges from many nodes, and ends up with the data
+        it replicates
+        """
+        self.create_nodes(6, num_tokens=16)
+        for node in self.nodes:
+            node.start()
+        gevent.sleep(0)
+
+        total_data = {}
+        for i in range(500):
+            node = self.nodes[i % len(self.nodes)]
+            key = random_string()
+            val = random_string()
+            node.cluster.execute_mutation_instruction('set', key, [val], synchronous=True)
+            total_data[key] = val
+
+        new_node = self.create_node(cluster_status=Cluster.Status.INITIALIZING, num_tokens=16)
+        with patch.object(Cluster, '_request_streamed_data', autospec=True,
+                          side_effect=Cluster._request_streamed_data) as request_streamed_data:
+            new_node.start()
+        self.assertEqual(new_node.cluster.status, Cluster.Status.NORMAL)
+
+        sources = {call[0][1].node_id for call in request_streamed_data.call_args_list}
+        self.assertTrue(len(sources) > 1)
+
+        expected_data = {k: v for k, v in total_data.items() if new_node.replicates_key(k)}
+        store_data = new_node.store._data
+        self.assertEquals(set(store_data.keys()), set(expected_data.keys()))
+        for key in expected_data.keys():
+            self.assertEqual(expected_data[key], store_data[key].data)
+
+
+class ServerOptionsTest(TestCase):
+
+    def test_eviction_isnt_allowed_with_a_data_dir(self):
+        """ a durable store shouldn't quietly ignore it's memory limit """
+        for kwargs in ({'maxmemory': 1000}, {'eviction_policy': RedisStore.EvictionPolicy.LRU}):
+            with self.assertRaises(ValueError):
+                Kickboxer(client_address=None, peer_address=('localhost', 0), data_dir='/tmp/unused', **kwargs)
@@ -0,0 +1,58 @@
+import gevent
+from mock import patch
+
+from kickboxer.cluster import messages
+from kickboxer.cluster.node.remote import RemoteNode
+from kickboxer.tests.base import BaseNodeTestCase
+from kickboxer.utils import now_timestamp
+
+
+class ConnectionLaneTest(BaseNodeTestCase):
+    """ tests that bulk traffic is kept apart from queries """
+
+    def setUp(self):
+        super(ConnectionLaneTest, self).setUp()
+        self.node0, self.node1 = self.create_nodes(2)
+        self.start_cluster()
+        self.peer = self.node0.cluster.get_node(self.node1.node_id)
+
+    def test_bulk_messages_use_their_own_connections(self):
+        """ streamed data and queries should never share a connection """
+        ts = now_timestamp()
+        for i in range(10):
+            self.node0.store.set(str(i), str(i), ts)
+
+        used = {}
+        get_connection = RemoteNode._get_connection
+
+        def _get_connection(node, lane=RemoteNode.Lane.QUERY):
+            conn = get_connection(node, lane)
+            used.setdefault(lane, set()).add(conn)
+            return conn
+
+        with patch.object(RemoteNode, '_get_connection', _get_connection):
+            self.node0.cluster.stream_to_node(self.node1.node_id)
+            self.node0.cluster.execute_retrieval_instruction('get', '1', [], synchronous=True)
+
+        self.assertTrue(used[RemoteNode.Lane.BULK])
+        self.assertTrue(used[RemoteNode.Lane.QUERY])
+        self.assertFalse(used[RemoteNode.Lane.BULK] & used[RemoteNode.Lane.QUERY])
+
+    def test_queries_dont_wait_behind_bulk_requests(self):
+        """ a full bulk lane should hold up bulk requests, but not queries """
+        self.peer._lane_limits[RemoteNode.Lane.BULK].limit = 1
+        self.peer._lane_limits[RemoteNode.Lane.BULK].acquire()
+
+        bulk = gevent.spawn(self.peer.send_message, messages.StreamCompleteRequest(self.node0.node_id))
+        gevent.sleep(0.01)
+        self.assertFalse(bulk.ready())
+        self.assertEqual(self.peer.metrics['bulk_lane_queued'], 1)
+
+        response = self.peer.send_message(messages.PingRequest(self.node0.node_id))
+        self.assertIsInstance(response, messages.PingResponse)
+
+        self.peer._lane_limits[RemoteNode.Lane.BULK].release()
+        self.assertIsInstance(bulk.get(timeout=1), messages.StreamCompleteResponse)
+        self.assertEqual(self.peer.metrics['bulk_lane_queued'], 0)
+        self.assertEqual(self.peer.metrics['bulk_lane_waits'], 1)
+        self.assertEqual(self.peer.metrics['bulk_lane_in_flight'], 0)
@@ -0,0 +1,36 @@
+from unittest.case import TestCase
+import uuid
+
+from kickboxer.cluster import messages
+
+
+class MessageCodecTest(TestCase):
+
+    def test_round_trip(self):
+        sender_id = uuid.uuid4()
+        request = messages.ChangedTokenRequest(sender_id, uuid.uuid4(), 10 ** 30)
+        header, body = request.encode()
+        message_type, size = messages.Message._header.unpack(header)
+        self.assertEqual(size, len(body))
+
+        message = messages.Message.decode(message_type, body)
+        self.assertIsInstance(message, messages.ChangedTokenRequest)
+        self.assertEqual(message.sender, sender_id)
+        self.assertEqual(message.message_id, request.message_id)
+        self.assertEqual(message.node_uuid, request.node_uuid)
+        self.assertEqual(message.new_token_long, 10 ** 30)
+
+    def test_every_message_type_is_registered(self):
+        klass_map = messages.Message.__klass_map__
+        self.assertIs(klass_map[messages.PingRequest.__message_type__], messages.PingRequest)
+        self.assertEqual(
+            messages.MutationOperationRequest.__arg_spec__,
+            ['sender_id', 'instruction', 'key', 'args', 'timestamp', 'message_id']
+        )
+        for message_type, klass in klass_map.items():
+            self.assertEqual(klass.__message_type__, message_type)
+
+    def test_message_ids_increase(self):
+        sender_id = uuid.uuid4()
+        ids = [messages.PingRequest(sender_id).message_id for _ in range(10)]
+        self.assertEqual(ids, sorted(set(ids)))
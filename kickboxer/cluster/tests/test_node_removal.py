@@ -2,7 +2,9 @@ import gevent
 
 from mock import patch
 
+from kickboxer.cluster.cluster import Cluster
 from kickboxer.cluster.tests.base import BaseClusterModificationTest
+from kickboxer.tests.base import BaseNodeTestCase
 
 
 class NodeRemovalIntegrationTest(BaseClusterModificationTest):
@@ -67,3 +69,28 @@ class NodeRemovalIntegrationTest(BaseClusterModificationTest):
         all_keys = self.n1.store.all_keys()
         for key in expected:
             self.assertIn(str(key), all_keys)
+
+
+class VirtualNodeRemovalTest(BaseNodeTestCase):
+
+    def test_node_removal(self):
+        """ the remaining nodes should pull the ranges they gain from a removed node with virtual nodes """
+        self.create_nodes(6, num_tokens=16)
+        self.start_cluster()
+
+        keys = [str(i) for i in range(300)]
+        for key in keys:
+            self.nodes[0].cluster.execute_mutation_instruction(
+                'set', key, [key], consistency=Cluster.ConsistencyLevel.ALL, synchronous=True
+            )
+
+        removed = self.nodes[-1]
+        removed.cluster.remove_node()
+        self.block_while_streaming()
+
+        for node in self.nodes[:-1]:
+            self.assertNotIn(removed.node_id, node.cluster.nodes)
+            all_keys = set(node.store.all_keys())
+            for key in keys:
+                if node.replicates_key(key):
+                    self.assertIn(key, all_keys)
@@ -0,0 +1,75 @@
+import gevent
+from mock import patch
+
+from kickboxer.cluster import messages
+from kickboxer.cluster.connection import Connection
+from kickboxer.cluster.node.remote import RemoteNode
+from kickboxer.tests.base import BaseNodeTestCase
+
+
+class PipelinedConnectionTest(BaseNodeTestCase):
+    """ tests sending many requests at once over a single connection """
+
+    def setUp(self):
+        super(PipelinedConnectionTest, self).setUp()
+        self.node0, self.node1 = self.create_nodes(2)
+        self.start_cluster()
+        self.peer = self.node0.cluster.get_node(self.node1.node_id)
+
+    def test_concurrent_requests_share_a_connection(self):
+        pings = [gevent.spawn(self.peer.send_message, messages.PingRequest(self.node0.node_id)) for _ in range(50)]
+        gevent.joinall(pings, timeout=5)
+        for ping in pings:
+            self.assertIsInstance(ping.value, messages.PingResponse)
+        self.assertEqual(len(self.peer.connections[RemoteNode.Lane.QUERY]), 1)
+
+    def test_responses_can_come_back_out_of_order(self):
+        """ a slow request shouldn't hold up the requests sent after it """
+        route = self.node1.cluster.route_local_retrieval_instruction
+
+        def _route(instruction, key, args):
+            if key == 'slow':
+                gevent.sleep(0.1)
+            return route(instruction, key, args)
+
+        with patch.object(self.node1.cluster, 'route_local_retrieval_instruction', _route):
+            slow = gevent.spawn(self.peer.execute_retrieval_instruction, 'get', 'slow', [])
+            gevent.sleep(0)
+            self.peer.execute_retrieval_instruction('get', 'fast', [])
+            self.assertFalse(slow.ready())
+            slow.get(timeout=1)
+        self.assertEqual(len(self.peer.connections[RemoteNode.Lane.QUERY]), 1)
+
+    def test_closing_fails_waiting_requests(self):
+        """ requests waiting on a response should fail when the connection closes """
+        conn = self.peer._get_connection()
+        with patch.object(self.node1.peer_server, '_execute_request', side_effect=lambda *args: gevent.sleep(1)):
+            waiting = gevent.spawn(conn.request, messages.PingRequest(self.node0.node_id))
+            gevent.sleep(0.01)
+            conn.close()
+            with self.assertRaises(Connection.ClosedException):
+                waiting.get(timeout=1)
+        self.assertFalse(conn.is_open)
+        self.assertEqual(conn.num_pending, 0)
+
+    def test_failed_request_doesnt_close_the_connection(self):
+        """ a request that raises should get an error, without failing the others on the connection """
+        conn = self.peer._get_connection()
+        route = self.node1.cluster.route_local_retrieval_instruction
+
+        def _route(instruction, key, args):
+            gevent.sleep(0.01)
+            if key == 'bad':
+                raise Exception('bad request')
+            return route(instruction, key, args)
+
+        with patch.object(self.node1.cluster, 'route_local_retrieval_instruction', _route):
+            bad = gevent.spawn(conn.request, messages.RetrievalValueRequest(self.node0.node_id, 'get', 'bad', []))
+            good = gevent.spawn(conn.request, messages.RetrievalValueRequest(self.node0.node_id, 'get', 'good', []))
+            gevent.joinall([bad, good], timeout=1)
+
+        self.assertIsInstance(bad.value, messages.ErrorResponse)
+        self.assertIn('bad request', bad.value.reason)
+        self.assertIsInstance(good.value, messages.UnknownKeyResponse)
+        self.assertTrue(conn.is_open)
+        self.assertIs(self.peer._get_connection(), conn)
@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta
+import time
+
+from mock import patch
+
+from kickboxer.cluster import messages
+from kickboxer.cluster.cluster import Cluster
+from kickboxer.cluster.node.remote import RemoteNode
+from kickboxer.tests.base import BaseNodeTestCase
+
+
+class RepairTest(BaseNodeTestCase):
+
+    def setUp(self):
+        super(RepairTest, self).setUp()
+        self.create_nodes(5)
+        self.start_cluster()
+        time.sleep(0.01)
+        self.ts = datetime.utcnow()
+
+        # write the same data to every replica
+        self.keys = [str(i) for i in range(500)]
+        for key in self.keys:
+            for node in self.nodes:
+                if node.replicates_key(key):
+                    node.cluster.store.set(key, 'a', self.ts)
+
+    def test_shared_token_ranges(self):
+        """ every key replicated by 2 nodes should fall in one of their shared ranges """
+        node0, node1 = self.nodes[:2]
+        ranges = node0.cluster.get_shared_token_ranges(node1.node_id)
+        for key in self.keys:
+            token = node0.cluster.partitioner.get_key_token(key)
+            shared = node0.replicates_key(key) and node1.replicates_key(key)
+            self.assertEqual(shared, any(start <= token <= stop for start, stop in ranges))
+
+    def test_in_sync_replicas(self):
+        """ repairing replicas with the same data shouldn't send any values """
+        sent = []
+        send_message = RemoteNode.send_message
+
+        def _send_message(node, message, *args, **kwargs):
+            sent.append(type(message))
+            return send_message(node, message, *args, **kwargs)
+
+        with patch.object(RemoteNode, 'send_message', _send_message):
+            self.assertEqual(self.nodes[0].repair(), [])
+        self.assertNotIn(messages.RepairDataRequest, sent)
+
+    def test_differing_values_are_exchanged(self):
+        """ both nodes should end up with the newest values for the keys that differ """
+        node0 = self.nodes[0]
+        # tokens are random, so use the peer that shares the most keys
+        peer, keys = max(
+            ((n, [k for k in self.keys if node0.replicates_key(k) and n.replicates_key(k)]) for n in self.nodes[1:]),
+            key=lambda p: len(p[1])
+        )
+        stale_key, missing_key = keys[:2]
+
+        node0.cluster.store.set(stale_key, 'b', self.ts + timedelta(seconds=1))
+        peer.cluster.store._pop(missing_key)
+
+        repaired = node0.repair(peer.node_id)
+        self.assertTrue(0 < len(repaired) <= 2)
+
+        self.assertEqual(peer.cluster.store.get(stale_key).data, 'b')
+        self.assertEqual(peer.cluster.store.get(missing_key).data, 'a')
+        for start, stop in node0.cluster.get_shared_token_ranges(peer.node_id):
+            self.assertEqual(
+                node0.cluster.store.get_merkle_hash(0, 0, start, stop),
+                peer.cluster.store.get_merkle_hash(0, 0, start, stop)
+            )
+
+    def test_repair_data_is_batched(self):
+        """ both nodes' values should be exchanged in batches, and throttled apart from streaming """
+        node0 = self.nodes[0]
+        peer, keys = max(
+            ((n, [k for k in self.keys if node0.replicates_key(k) and n.replicates_key(k)]) for n in self.nodes[1:]),
+            key=lambda p: len(p[1])
+        )
+        # the peer is missing half of the keys, and has newer values for the rest
+        for key in keys[::2]:
+            peer.cluster.store._pop(key)
+        for key in keys[1::2]:
+            peer.cluster.store.set(key, 'b', self.ts + timedelta(seconds=1))
+
+        sent = []
+        send_message = RemoteNode.send_message
+
+        def _send_message(node, message, *args, **kwargs):
+            response = send_message(node, message, *args, **kwargs)
+            if isinstance(message, messages.RepairDataRequest):
+                sent.append((len(message.data), len(response.data)))
+            return response
+
+        throttled = []
+        throttle_stream = Cluster._throttle_stream
+
+        def _throttle_stream(cluster, bucket, num_bytes, direction):
+            throttled.append(direction)
+            return throttle_stream(cluster, bucket, num_bytes, direction)
+
+        for node in (node0, peer):
+            node.cluster.stream_batch_size = 10
+        with patch.object(RemoteNode, 'send_message', _send_message), \
+                patch.object(Cluster, '_throttle_stream', _throttle_stream):
+            node0.repair(peer.node_id)
+
+        self.assertTrue(len(sent) > 2)
+        self.assertTrue(all(sent_values <= 10 and received <= 10 for sent_values, received in sent))
+        for key in keys:
+            expected = 'a' if key in keys[::2] else 'b'
+            self.assertEqual(peer.cluster.store.get(key).data, expected)
+            self.assertEqual(node0.cluster.store.get(key).data, expected)
+        self.assertEqual(set(throttled), {'repair'})
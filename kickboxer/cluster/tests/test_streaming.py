@@ -1,5 +1,20 @@
-from kickboxer.cluster.cluster import Cluster
+from functools import partial
+import os
+import shutil
+import tempfile
+import uuid
+
+import gevent
+from mock import patch
+
+from kickboxer.cluster import messages
+from kickboxer.cluster.cluster import Cluster, ClusterStreamingException
+from kickboxer.cluster.connection import Connection
+from kickboxer.cluster.node.remote import RemoteNode
+from kickboxer.cluster.ring import merge_token_ranges
+from kickboxer.cluster.streaming import StreamCheckpoint, StreamingSession
 from kickboxer.tests.base import BaseNodeTestCase, LiteralPartitioner, MockLocalNode, MockRemoteNode
+from kickboxer.utils import now_timestamp
 
 
 class StreamingQueryTest(BaseNodeTestCase):
@@ -14,7 +29,8 @@ class StreamingQueryTest(BaseNodeTestCase):
         self.remote_node = MockRemoteNode()
         self.cluster = Cluster(self.local_node, LiteralPartitioner())
         self.cluster.status = Cluster.Status.STREAMING
-        self.cluster._streaming_node = self.remote_node
+        self.cluster._streaming_session = StreamingSession(Cluster.StreamingReason.JOINING_NODE, Cluster.Status.NORMAL)
+        self.cluster._streaming_session.add_source(self.remote_node)
 
     def test_read_routing(self):
         """ reads should be routed directly to the streaming nodes """
@@ -35,4 +51,166 @@ class StreamingTest(StreamingQueryTest):
     """
 
     def test_data_from_non_src_node_fails(self):
-        """ data should not be accepted from nodes we're not streaming from  """
\ No newline at end of file
+        """ data should not be accepted from nodes we're not streaming from  """
+
+class StreamingSessionTest(BaseNodeTestCase):
+    """
+    tests streaming from several sources at once
+    """
+
+    def setUp(self):
+        super(StreamingSessionTest, self).setUp()
+        self.local_node = MockLocalNode()
+        self.cluster = Cluster(self.local_node, LiteralPartitioner(), status=Cluster.Status.NORMAL)
+
+    def test_range_routing(self):
+        """ queries should be routed to the source streaming the key's token range """
+        low, high = MockRemoteNode(), MockRemoteNode()
+        with self.cluster._streaming(Cluster.StreamingReason.JOINING_NODE) as session:
+            session.add_source(low, [(0, 99)])
+            session.add_source(high, [(100, 199)])
+            self.cluster.route_local_retrieval_instruction('get', '150', [])
+            self.cluster.route_local_retrieval_instruction('get', '500', [])
+        assert low.execute_retrieval_instruction.call_count == 0
+        assert high.execute_retrieval_instruction.call_count == 1
+        assert self.local_node.store.get.call_count == 1
+
+    def test_overlapping_streams(self):
+        """ the cluster should stay in STREAMING until everything streaming is done """
+        with self.cluster._streaming(Cluster.StreamingReason.JOINING_NODE) as outer:
+            with self.cluster._streaming(Cluster.StreamingReason.TOKEN_CHANGE) as inner:
+                self.assertIs(outer, inner)
+            self.assertEqual(self.cluster.status, Cluster.Status.STREAMING)
+        self.assertEqual(self.cluster.status, Cluster.Status.NORMAL)
+        self.assertIsNone(self.cluster._streaming_session)
+
+    def test_failed_streams_restore_status(self):
+        self.cluster.status = Cluster.Status.INITIALIZING
+        with self.assertRaises(Connection.ClosedException):
+            with self.cluster._streaming(Cluster.StreamingReason.JOINING_NODE):
+                raise Connection.ClosedException
+        self.assertEqual(self.cluster.status, Cluster.Status.INITIALIZING)
+
+    def test_sources_stream_concurrently(self):
+        """ every source should be streaming before any of them finish """
+        events = []
+
+        def _send_message(node, request, **kwargs):
+            events.append(('start', node))
+            gevent.sleep(0.01)
+            events.append(('end', node))
+            return messages.StreamResponse(uuid.uuid4())
+
+        nodes = []
+        for i in range(3):
+            node = MockRemoteNode()
+            node.node_id = i
+            node.send_message.side_effect = partial(_send_message, i)
+            nodes.append(node)
+
+        with self.cluster._streaming(Cluster.StreamingReason.JOINING_NODE) as session:
+            self.cluster._join_streams([
+                gevent.spawn(self.cluster._request_streamed_data, node, [(i, i)]) for i, node in enumerate(nodes)
+            ])
+            self.assertTrue(session.is_complete)
+        self.assertEqual([e[0] for e in events], ['start'] * 3 + ['end'] * 3)
+
+    def test_failed_streams_resume_from_checkpoint(self):
+        """ streams that break partway through should only be asked for the ranges they hadn't sent """
+        requests = []
+        node = MockRemoteNode()
+        node.node_id = uuid.uuid4()
+
+        def _send_message(request, **kwargs):
+            requests.append(request.get_token_ranges())
+            if len(requests) == 1:
+                self.cluster._receive_streamed_values([], [(0, 49)])
+                raise Connection.ClosedException
+            return messages.StreamResponse(uuid.uuid4())
+        node.send_message.side_effect = _send_message
+
+        self.cluster._stream_token_ranges([(0, 99, (node,))], Cluster.StreamingReason.JOINING_NODE)
+        self.assertEqual(requests, [[(0, 99)], [(50, 99)]])
+        self.assertEqual(self.cluster.status, Cluster.Status.NORMAL)
+        self.assertFalse(self.cluster._stream_checkpoint)
+
+    def test_streaming_gives_up_after_retries(self):
+        node = MockRemoteNode()
+        node.node_id = uuid.uuid4()
+        node.send_message.side_effect = Connection.ClosedException
+        self.cluster.status = Cluster.Status.INITIALIZING
+
+        with self.assertRaises(ClusterStreamingException):
+            self.cluster._stream_token_ranges([(0, 99, (node,))], Cluster.StreamingReason.JOINING_NODE)
+        self.assertEqual(node.send_message.call_count, Cluster.stream_retries + 1)
+        self.assertEqual(self.cluster.status, Cluster.Status.INITIALIZING)
+
+
+class StreamCheckpointTest(BaseNodeTestCase):
+
+    def test_remaining_ranges(self):
+        checkpoint = StreamCheckpoint()
+        checkpoint.add([(0, 99), (200, 299)])
+        self.assertEqual(checkpoint.remaining([(50, 250), (400, 499)]), [(100, 199), (400, 499)])
+        self.assertEqual(checkpoint.remaining([(0, 99)]), [])
+
+    def test_checkpoint_is_persisted(self):
+        """ checkpoints with a path should be reloaded, and removed when they're cleared """
+        data_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(data_dir, 'streaming.checkpoint')
+            StreamCheckpoint(path).add([(0, 99), (2 ** 100, 2 ** 101)], Cluster.StreamingReason.JOINING_NODE)
+
+            checkpoint = StreamCheckpoint(path)
+            self.assertEqual(checkpoint.reason, Cluster.StreamingReason.JOINING_NODE)
+            self.assertEqual(checkpoint.token_ranges, [(0, 99), (2 ** 100, 2 ** 101)])
+
+            checkpoint.clear()
+            self.assertFalse(os.path.exists(path))
+            self.assertFalse(StreamCheckpoint(path))
+        finally:
+            shutil.rmtree(data_dir)
+
+
+class StreamToNodeTest(BaseNodeTestCase):
+
+    def test_values_are_streamed_in_batches(self):
+        """ values should be paged out of the store, and sent in batches """
+        node0, node1 = self.create_nodes(2)
+        self.start_cluster()
+        ts = now_timestamp()
+        for i in range(250):
+            node0.store.set(str(i), str(i), ts)
+
+        sent = []
+        send_message = RemoteNode.send_message
+
+        def _send_message(node, message, *args, **kwargs):
+            sent.append(message)
+            return send_message(node, message, *args, **kwargs)
+
+        node0.cluster.stream_batch_size = 100
+        with patch.object(RemoteNode, 'send_message', _send_message):
+            node0.cluster.stream_to_node(node1.node_id)
+
+        batches = [m for m in sent if isinstance(m, messages.StreamDataRequest)]
+        self.assertEqual(sorted(len(m.data) for m in batches), [50, 100, 100])
+        self.assertEqual(set(node1.store.all_keys()), {str(i) for i in range(250)})
+        self.assertEqual(node0.cluster.metrics['streamed_keys'], 250)
+
+    def test_batches_cover_their_token_ranges(self):
+        """ each batch should report the token ranges it completes, which should add up to the streamed ranges """
+        node0, node1 = self.create_nodes(2)
+        ts = now_timestamp()
+        for i in range(250):
+            node0.store.set(str(i), str(i), ts)
+
+        node0.cluster.stream_batch_size = 100
+        max_token = node0.partitioner.max_token
+        covered_ranges = []
+        for batch, covered in node0.cluster._iter_stream_batches([(0, max_token)]):
+            covered_ranges.extend(covered)
+            for record in batch:
+                token = node0.partitioner.get_key_token(record[0])
+                self.assertTrue(any(start <= token <= stop for start, stop in covered))
+        self.assertEqual(merge_token_ranges(covered_ranges), [(0, max_token)])
@@ -0,0 +1,118 @@
+import time
+from unittest.case import TestCase
+
+import gevent
+from mock import patch
+
+from kickboxer.cluster import codec
+from kickboxer.cluster.cluster import Cluster
+from kickboxer.cluster.throttle import ConcurrencyLimit, TokenBucket
+from kickboxer.store.redis import Value
+from kickboxer.tests.base import BaseNodeTestCase, LiteralPartitioner, MockLocalNode
+from kickboxer.utils import now_timestamp
+
+
+class TokenBucketTest(TestCase):
+
+    def test_unlimited(self):
+        bucket = TokenBucket()
+        self.assertEqual(bucket.consume(10 ** 9), 0)
+
+    def test_bursts_then_waits(self):
+        """ the burst should go through immediately, and anything after it should wait for the rate """
+        bucket = TokenBucket(rate=1000, burst=100)
+        self.assertEqual(bucket.consume(100), 0)
+
+        start = time.time()
+        delay = bucket.consume(50)
+        self.assertAlmostEqual(delay, 0.05, delta=0.01)
+        self.assertTrue(time.time() - start >= 0.04)
+
+    def test_changing_the_rate(self):
+        bucket = TokenBucket(rate=1000, burst=100)
+        bucket.consume(100)
+        bucket.rate = None
+        self.assertEqual(bucket.consume(10 ** 9), 0)
+
+        # limiting an unlimited bucket starts it full
+        bucket.rate = 1000
+        self.assertEqual(bucket.consume(100), 0)
+
+
+class ConcurrencyLimitTest(TestCase):
+
+    def test_waits_for_a_free_slot(self):
+        limit = ConcurrencyLimit(1)
+        self.assertFalse(limit.acquire())
+
+        waiter = gevent.spawn(limit.acquire)
+        gevent.sleep(0)
+        self.assertFalse(waiter.ready())
+
+        limit.release()
+        self.assertTrue(waiter.get(timeout=1))
+        self.assertEqual(limit.active, 1)
+
+    def test_raising_the_limit_wakes_waiters(self):
+        limit = ConcurrencyLimit(1)
+        limit.acquire()
+        waiter = gevent.spawn(limit.acquire)
+        gevent.sleep(0)
+
+        limit.limit = 2
+        self.assertTrue(waiter.get(timeout=1))
+        self.assertEqual(limit.active, 2)
+
+
+class StreamThrottleTest(BaseNodeTestCase):
+
+    def test_inbound_throttling_is_recorded(self):
+        """ throttled streams should show up in the cluster's metrics """
+        cluster = Cluster(MockLocalNode(), LiteralPartitioner())
+        cluster.inbound_stream_throughput = 10000
+        data = [codec.encode_record(str(i), Value('v' * 4000, 1)) for i in range(3)]
+
+        cluster._receive_streamed_values(data)
+        self.assertEqual(cluster.metrics['inbound_stream_throttled'], 1)
+        self.assertTrue(cluster.metrics['inbound_stream_throttle_seconds'] > 0.1)
+        self.assertEqual(cluster.store.set_and_reconcile_raw_value.call_count, 3)
+
+    def test_outbound_throttling_is_charged_the_record_size(self):
+        """ the outbound bucket should be charged the encoded size of each streamed batch """
+        node0, node1 = self.create_nodes(2)
+        self.start_cluster()
+        ts = now_timestamp()
+        for i in range(20):
+            node0.store.set(str(i), 'v' * 1000, ts)
+
+        charged = []
+
+        def _throttle_stream(cluster, bucket, num_bytes, direction):
+            if direction == 'outbound':
+                self.assertIs(bucket, cluster._outbound_stream_bucket)
+                charged.append(num_bytes)
+
+        batches = list(node0.cluster._iter_stream_batches([(0, node0.partitioner.max_token)]))
+        expected = sum(codec.record_size(r) for batch, covered in batches for r in batch)
+        with patch.object(Cluster, '_throttle_stream', _throttle_stream):
+            node0.cluster.stream_to_node(node1.node_id)
+
+        self.assertEqual(sum(charged), expected)
+        self.assertTrue(expected > 20 * 1000)
+        self.assertEqual(node0.cluster.metrics['streamed_bytes'], expected)
+
+    def test_stream_sessions_are_limited(self):
+        """ nodes should only stream to max_stream_sessions nodes at once """
+        node0, node1, node2 = self.create_nodes(3)
+        self.start_cluster()
+        node0.cluster.max_stream_sessions = 1
+
+        node0.cluster._stream_sessions.acquire()
+        stream = gevent.spawn(node0.cluster.stream_to_node, node1.node_id)
+        gevent.sleep(0.01)
+        self.assertFalse(stream.ready())
+
+        node0.cluster._stream_sessions.release()
+        stream.get(timeout=5)
+        self.assertEqual(node0.cluster.metrics['stream_sessions_queued'], 1)
+        self.assertEqual(node0.cluster.metrics['stream_sessions'], 0)
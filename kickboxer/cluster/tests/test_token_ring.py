@@ -1,7 +1,77 @@
 from unittest.case import TestCase
 
+from kickboxer.cluster.node.base import BaseNode
+from kickboxer.cluster.ring import TokenRing
+
 
 class TokenRingTest(TestCase):
 
+    def setUp(self):
+        super(TokenRingTest, self).setUp()
+        # nodes are given out of token order
+        self.nodes = [BaseNode(token=1000 * i) for i in (3, 0, 4, 1, 2)]
+        self.ring = TokenRing(self.nodes, 3)
+
     def test_proper_token_ring_setup(self):
         """ Tests that a cluster's token ring view is accurate """
+        self.assertEqual(self.ring.tokens, [0, 1000, 2000, 3000, 4000])
+        self.assertEqual([n.token for n in self.ring], self.ring.tokens)
+        self.assertEqual(self.ring.index(self.nodes[0].node_id), 3)
+        self.assertEqual(self.ring.get_offset_node_id(self.nodes[0].node_id, 2), self.ring[0].node_id)
+
+    def test_replica_lookups(self):
+        """ tokens should be routed to their owner, and the next nodes in the ring """
+        ring = self.ring
+        self.assertEqual(ring.get_nodes_for_token(0), ring.nodes[0:3])
+        self.assertEqual(ring.get_nodes_for_token(1999), ring.nodes[1:4])
+        self.assertEqual(ring.get_nodes_for_token(4500), (ring[4], ring[0], ring[1]))
+
+        # every token a position owns should get the same tuple
+        self.assertIs(ring.get_nodes_for_token(1000), ring.get_nodes_for_token(1999))
+
+    def test_tokens_before_the_first_node(self):
+        """ tokens below the lowest node token should wrap around to the last node """
+        ring = TokenRing([BaseNode(token=t) for t in (100, 200, 300)], 2)
+        self.assertEqual(ring.get_nodes_for_token(50), (ring[2], ring[0]))
+
+    def test_small_rings(self):
+        """ nodes shouldn't be repeated when there are fewer nodes than replicas """
+        ring = TokenRing(self.nodes[:2], 3)
+        self.assertEqual(len(ring.get_nodes_for_token(0)), 2)
+
+        ring = TokenRing(self.nodes, 0)
+        self.assertEqual(len(ring.get_nodes_for_token(0)), len(self.nodes))
+
+
+class VirtualNodeRingTest(TestCase):
+
+    def setUp(self):
+        super(VirtualNodeRingTest, self).setUp()
+        self.nodes = [BaseNode(tokens=[i + (100 * j) for j in range(4)]) for i in range(0, 50, 10)]
+        self.ring = TokenRing(self.nodes, 3)
+
+    def test_positions(self):
+        """ each token should be a ring position """
+        self.assertEqual(len(self.ring), 20)
+        self.assertEqual(self.ring.num_nodes, 5)
+        self.assertTrue(self.ring.has_vnodes)
+        self.assertEqual(self.ring.positions(self.nodes[1].node_id), [1, 6, 11, 16])
+
+    def test_replicas_are_distinct_nodes(self):
+        """ replicas should skip over positions belonging to nodes that are already replicas """
+        ring = TokenRing([BaseNode(tokens=[0, 10]), BaseNode(tokens=[20, 30]), BaseNode(tokens=[40])], 2)
+        replicas = ring.get_nodes_for_token(5)
+        self.assertEqual(replicas, (ring[0], ring[2]))
+        self.assertIs(ring.get_nodes_for_token(25), ring.get_nodes_for_token(35))
+
+    def test_token_ranges(self):
+        """ every token should fall in exactly one position's range """
+        ring = TokenRing([BaseNode(tokens=[10, 60]), BaseNode(tokens=[30, 80])], 1)
+        ranges = ring.get_token_ranges(99)
+        self.assertEqual(
+            [(start, stop) for start, stop, _ in ranges],
+            [(10, 29), (30, 59), (60, 79), (80, 99), (0, 9)]
+        )
+        for start, stop, replicas in ranges:
+            self.assertEqual(replicas, ring.get_nodes_for_token(start))
+            self.assertEqual(replicas, ring.get_nodes_for_token(stop))
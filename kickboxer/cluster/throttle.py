@@ -0,0 +1,108 @@
+import time
+
+import gevent
+from gevent.event import Event
+
+
+class TokenBucket(object):
+    """
+    limits the rate of something, like bytes streamed, to `rate` units a
+    second, allowing bursts of up to `burst` units. Callers that take more
+    than the bucket holds go into debt, and wait for it to be paid back,
+    so amounts larger than the burst size still work
+
+    a rate of None is unlimited, the rate can be changed while the
+    bucket is in use
+    """
+
+    def __init__(self, rate=None, burst=None):
+        """
+        :param rate: units per second, or None for no limit
+        :param burst: the most units that can be taken without waiting,
+            defaults to a second's worth
+        """
+        super(TokenBucket, self).__init__()
+        self._rate = rate
+        self._burst = burst
+        self._tokens = self.capacity
+        self._last = time.time()
+
+    def __repr__(self):
+        return '<TokenBucket rate={} tokens={}>'.format(self._rate, self._tokens)
+
+    @property
+    def capacity(self):
+        return self._burst or self._rate or 0
+
+    @property
+    def rate(self):
+        return self._rate
+
+    @rate.setter
+    def rate(self, rate):
+        self._refill()
+        was_limited = bool(self._rate)
+        self._rate = rate
+        if not was_limited:
+            self._tokens = self.capacity
+
+    def _refill(self):
+        now = time.time()
+        if self._rate:
+            self._tokens = min(self.capacity, self._tokens + ((now - self._last) * self._rate))
+        self._last = now
+
+    def consume(self, amount):
+        """
+        takes the given amount from the bucket, waiting for it to refill if it's
+        empty, and returns the number of seconds waited
+        """
+        if not self._rate:
+            return 0
+        self._refill()
+        self._tokens -= amount
+        if self._tokens >= 0:
+            return 0
+        delay = -self._tokens / float(self._rate)
+        gevent.sleep(delay)
+        return delay
+
+
+class ConcurrencyLimit(object):
+    """
+    limits the number of things, like streaming sessions, running at once.
+    A limit of None is unlimited, the limit can be changed while it's in use
+    """
+
+    def __init__(self, limit=None):
+        super(ConcurrencyLimit, self).__init__()
+        self._limit = limit
+        self.active = 0
+        self._released = Event()
+
+    def __repr__(self):
+        return '<ConcurrencyLimit limit={} active={}>'.format(self._limit, self.active)
+
+    @property
+    def limit(self):
+        return self._limit
+
+    @limit.setter
+    def limit(self, limit):
+        self._limit = limit
+        # waiters check the new limit
+        self._released.set()
+
+    def acquire(self):
+        """ waits for a free slot, and takes it, returns True if it had to wait """
+        waited = False
+        while self._limit is not None and self.active >= self._limit:
+            waited = True
+            self._released.clear()
+            self._released.wait()
+        self.active += 1
+        return waited
+
+    def release(self):
+        self.active -= 1
+        self._released.set()
@@ -0,0 +1,28 @@
+from collections import defaultdict
+
+
+class Metrics(object):
+    """
+    named counters and gauges, kept by components that want
+    to report what they're doing
+    """
+
+    def __init__(self):
+        super(Metrics, self).__init__()
+        self._values = defaultdict(int)
+
+    def __getitem__(self, name):
+        return self._values[name]
+
+    def incr(self, name, amount=1):
+        self._values[name] += amount
+
+    def decr(self, name, amount=1):
+        self._values[name] -= amount
+
+    def set(self, name, value):
+        self._values[name] = value
+
+    def snapshot(self):
+        """ returns a copy of the current values """
+        return dict(self._values)
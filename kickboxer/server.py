@@ -1,28 +1,104 @@
+import logging
+import os
+
+import gevent
+
 from kickboxer.cluster.node.local import LocalNode
 from kickboxer.cluster.cluster import Cluster
 from kickboxer.cluster.peer_server import PeerServer
 from kickboxer.cluster.client_server import RedisClientServer
 from kickboxer.partitioner.md5 import MD5Partitioner
+from kickboxer.store.lsm import LogStructuredStore
 from kickboxer.store.redis import RedisStore
+from kickboxer.store.sharded import ShardedStore
+
+logger = logging.getLogger(__name__)
 
 
 class Kickboxer(object):
     """ punisher server """
 
+    # seconds between purges of expired tombstones
+    tombstone_gc_interval = 60
+
+    # seconds between advancing the store's expiry timing wheel
+    expiry_interval = 1
+
+    # seconds between attempts to replay hinted mutations
+    hint_replay_interval = 10
+
+    # the file in the data dir streaming progress is kept in
+    checkpoint_name = 'streaming.checkpoint'
+
     def __init__(self,
                  client_address=('', 6379),
                  peer_address=('', 4379),
                  token=None,
+                 num_tokens=1,
                  seed_peers=None,
                  name=None,
                  node_id=None,
                  replication_factor=3,
                  cluster_status=Cluster.Status.INITIALIZING,
-                 partitioner=None):
+                 partitioner=None,
+                 data_dir=None,
+                 snapshot_path=None,
+                 tombstone_grace_period=None,
+                 maxmemory=None,
+                 eviction_policy=None,
+                 store_workers=None,
+                 outbound_stream_throughput=None,
+                 inbound_stream_throughput=None,
+                 max_stream_sessions=None,
+                 repair_throughput=None):
         super(Kickboxer, self).__init__()
 
         self.partitioner = partitioner or MD5Partitioner()
-        self.store = RedisStore(self.partitioner)
+
+        # nodes with a data dir keep their data on disk, and don't
+        # need to stream it back from their peers after a restart
+        self.data_dir = data_dir
+        if self.data_dir:
+            # evicting keys from a durable store would throw data away
+            if maxmemory is not None or eviction_policy is not None:
+                raise ValueError('maxmemory and eviction_policy can\'t be used with a data_dir')
+            store_class = LogStructuredStore
+            store_kwargs = {'data_dir': self.data_dir, 'tombstone_grace_period': tombstone_grace_period}
+        else:
+            store_class = RedisStore
+            store_kwargs = {
+                'tombstone_grace_period': tombstone_grace_period,
+                'maxmemory': maxmemory,
+                'eviction_policy': eviction_policy,
+            }
+
+        # the store can be split across worker processes, to use more
+        # than one core. The number of workers can't be changed once a
+        # node has written data to disk, since it determines which
+        # worker each snapshot or data dir belongs to
+        if store_workers and store_workers > 1:
+            self.store = ShardedStore(self.partitioner, store_workers, store_class, **store_kwargs)
+        else:
+            self.store = store_class(self.partitioner, **store_kwargs)
+
+        # streaming progress is checkpointed in the data dir, and a node
+        # that was stopped while streaming finishes when it's restarted
+        self.checkpoint_path = os.path.join(self.data_dir, self.checkpoint_name) if self.data_dir else None
+        is_streaming = self.checkpoint_path and os.path.exists(self.checkpoint_path)
+
+        if self.data_dir and self.store.recovered and cluster_status == Cluster.Status.INITIALIZING and not is_streaming:
+            cluster_status = Cluster.Status.NORMAL
+
+        # in memory stores are written to the snapshot path when the
+        # node is stopped, and restarted nodes serve reads from it
+        # while it's loaded in the background
+        self.snapshot_path = snapshot_path
+        if self.snapshot_path and not self.data_dir:
+            # sharded stores load whichever worker snapshots exist
+            if isinstance(self.store, ShardedStore) or os.path.exists(self.snapshot_path):
+                self.store.load_snapshot(self.snapshot_path)
+            if self.store.is_loading_snapshot and cluster_status == Cluster.Status.INITIALIZING:
+                cluster_status = Cluster.Status.NORMAL
 
         self.client_address = client_address
         self.peer_address = peer_address
@@ -34,6 +110,7 @@ class Kickboxer(object):
             node_id=node_id,
             name=name,
             token=token,
+            num_tokens=num_tokens,
         )
 
         self.seed_peers = seed_peers
@@ -43,8 +120,13 @@ class Kickboxer(object):
             self.partitioner,
             seed_peers=self.seed_peers,
             replication_factor=self.replication_factor,
-            status=cluster_status
+            status=cluster_status,
+            checkpoint_path=self.checkpoint_path
         )
+        self.cluster.outbound_stream_throughput = outbound_stream_throughput
+        self.cluster.inbound_stream_throughput = inbound_stream_throughput
+        self.cluster.max_stream_sessions = max_stream_sessions
+        self.cluster.repair_throughput = repair_throughput
 
         self.peer_server = PeerServer(
             self.peer_address,
@@ -55,6 +137,9 @@ class Kickboxer(object):
             self.client_address,
             cluster=self.cluster) if self.client_address else None
 
+        # greenlets doing periodic maintenance while the node is running
+        self._background_tasks = []
+
     def __repr__(self):
         return '<Kickboxer name={} token={}>'.format(self.name, self.token)
 
@@ -67,21 +152,65 @@ class Kickboxer(object):
         return self.local_node.token
 
     def start(self):
+        if self.store.is_loading_snapshot:
+            gevent.spawn(self.store.rebuild_from_snapshot)
         self.peer_server.start()
         self.peer_server.start_event.wait(timeout=1)
         self.cluster.start()
         if self.client_server: self.client_server.start()
+        self._background_tasks.append(gevent.spawn(self._purge_tombstones))
+        self._background_tasks.append(gevent.spawn(self._expire_keys))
+        self._background_tasks.append(gevent.spawn(self._replay_hints))
+
+    def _stop_background_tasks(self):
+        gevent.killall(self._background_tasks)
+        self._background_tasks = []
+
+    # background tasks log errors and carry on, one failed run
+    # shouldn't stop the task for the life of the process
+
+    def _purge_tombstones(self):
+        while True:
+            gevent.sleep(self.tombstone_gc_interval)
+            try:
+                self.store.purge_tombstones()
+            except Exception:
+                logger.exception('error purging tombstones')
+
+    def _expire_keys(self):
+        while True:
+            gevent.sleep(self.expiry_interval)
+            try:
+                self.store.expire_keys()
+            except Exception:
+                logger.exception('error expiring keys')
+
+    def _replay_hints(self):
+        while True:
+            gevent.sleep(self.hint_replay_interval)
+            try:
+                self.cluster.replay_hints()
+            except Exception:
+                logger.exception('error replaying hints')
 
     def stop(self):
+        self._stop_background_tasks()
         if self.client_server: self.client_server.stop()
         self.peer_server.stop()
         self.cluster.stop()
+        if self.snapshot_path and not self.data_dir:
+            self.store.write_snapshot(self.snapshot_path)
 
     def kill(self):
+        self._stop_background_tasks()
         if self.client_server: self.client_server.stop()
         self.peer_server.stop()
         self.cluster.kill()
 
+    def repair(self, node_id=None):
+        """ see Cluster.repair """
+        return self.cluster.repair(node_id)
+
     def replicates_key(self, key):
         return self.local_node in self.cluster.get_nodes_for_key(key)
 
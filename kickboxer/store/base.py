@@ -1,3 +1,40 @@
+from collections import namedtuple
+
+
+class ScanCursor(namedtuple('ScanCursor', ['token', 'key'])):
+    """
+    the position of the last item returned by a token range scan,
+    scans started with a cursor resume with the item following it
+    """
+
+
+class TokenRangeScan(object):
+    """
+    lazily iterates over the (token, key, value) tuples in a token
+    range, sorted by token, then by key (for collisions)
+
+    the cursor attribute is updated as items are yielded, and can
+    be passed back into scan_token_range to resume the scan later
+    """
+
+    def __init__(self, iterator, cursor=None):
+        self._iterator = iterator
+        self.cursor = cursor
+        self.exhausted = False
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        try:
+            token, key, value = next(self._iterator)
+        except StopIteration:
+            self.exhausted = True
+            raise
+        self.cursor = ScanCursor(token, key)
+        return token, key, value
+
+
 class BaseStore(object):
 
     retrieval_instructions = frozenset()
@@ -15,9 +52,62 @@ class BaseStore(object):
         :param count:
         :return:
         """
+        assert count > 1
+        rdata = []
+        num_tokens = 0
+        last_token = None
+        for token, key, value in self.scan_token_range(start_token, max_token):
+            if token != last_token:
+                num_tokens += 1
+                if num_tokens > count:
+                    break
+                last_token = token
+            rdata.append((key, value))
+        return rdata
+
+    def scan_token_range(self, start_token, max_token, cursor=None):
+        """
+        returns a TokenRangeScan over the raw values in the given token
+        range, inclusively. Values are read as the scan is iterated, so
+        writes made during the scan may or may not be included
+
+        :param start_token:
+        :param max_token:
+        :param cursor: the cursor of a previous scan over this range to resume from
+        :type cursor: ScanCursor
+        :rtype: TokenRangeScan
+        """
+        return TokenRangeScan(self._iter_token_range(start_token, max_token, cursor), cursor)
+
+    def _iter_token_range(self, start_token, max_token, cursor=None):
+        """ yields (token, key, value) tuples for scan_token_range """
         raise NotImplementedError
 
+    def execute_batch_retrieval(self, instruction, keys, args):
+        """ executes a retrieval instruction for each key, and returns a list of the results """
+        method = getattr(self, instruction)
+        return [method(key, *args) for key in keys]
+
+    def execute_batch_mutation(self, mutations):
+        """
+        :param mutations: a list of (instruction, key, args, timestamp) tuples
+        :return: a list of the results for the given mutations, in order
+        """
+        return [getattr(self, instruction)(key, *args, timestamp=timestamp)
+                for instruction, key, args, timestamp in mutations]
+
     def set_and_reconcile_raw_value(self, key, value):
+        """ stores the value, unless the store has a newer value for the key """
+        raise NotImplementedError
+
+    def get_merkle_hash(self, level, idx, start_token=0, stop_token=None):
+        """
+        returns the hash of the values in the given merkle tree node,
+        limited to the given token range
+
+        :param level: the tree level, the root is 0
+        :param idx: the index of the node in it's level
+        """
         raise NotImplementedError
 
     def all_keys(self):
@@ -0,0 +1,442 @@
+from bisect import bisect_right
+import heapq
+import mmap
+import os
+import re
+
+from blist import sorteddict
+
+from kickboxer.store.base import BaseStore
+from kickboxer.store.records import record_header, write_record, read_records
+from kickboxer.store.redis import RedisStore, Value, approximate_size
+from kickboxer.utils import now_timestamp
+
+
+class Segment(object):
+    """
+    an immutable file of values, sorted by token, then by key
+    (for collisions). Records are [key, data, timestamp, expires]
+
+    segment files are memory mapped, and a sparse index of every
+    `index_interval` records is kept in memory. Lookups bisect
+    the sparse index, then read forward from the closest entry
+    """
+
+    index_interval = 64
+
+    def __init__(self, path, partitioner, sequence):
+        """
+        :param path:
+        :param partitioner:
+        :type partitioner: kickboxer.partitioner.base.BasePartitioner
+        :param sequence: the order the segment was written in, segments
+            with higher sequence numbers have more recent values
+        """
+        super(Segment, self).__init__()
+        self.path = path
+        self.partitioner = partitioner
+        self.sequence = sequence
+
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # [(token, key), ...] and the offsets of the records they point to
+        self._index = []
+        self._offsets = []
+        self.num_records = 0
+        for i, (offset, record) in enumerate(read_records(self._map)):
+            if i % self.index_interval == 0:
+                key = record[0]
+                self._index.append((self.partitioner.get_key_token(key), key))
+                self._offsets.append(offset)
+            self.num_records += 1
+
+    def __repr__(self):
+        return '<Segment {} records={}>'.format(os.path.basename(self.path), self.num_records)
+
+    @classmethod
+    def write(cls, path, partitioner, sequence, items):
+        """
+        writes a new segment file, and returns the segment
+
+        :param items: (token, key, value) tuples, sorted by token, then key
+        :rtype: Segment
+        """
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            for _, key, value in items:
+                write_record(f, [key, value.data, value.timestamp, value.expires])
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, path)
+        return cls(path, partitioner, sequence)
+
+    def iter_from(self, token, key=None):
+        """
+        yields (token, key, value) tuples for the records at or
+        after the given position. If key is None, all keys for
+        the given token are included
+        """
+        position = (token, key) if key is not None else (token,)
+        idx = max(bisect_right(self._index, position) - 1, 0)
+        offset = self._offsets[idx] if self._offsets else 0
+        get_key_token = self.partitioner.get_key_token
+        for _, record in read_records(self._map, offset):
+            rkey = record[0]
+            rtoken = get_key_token(rkey)
+            if (rtoken, rkey) < position:
+                continue
+            yield rtoken, rkey, Value(*record[1:])
+
+    def get(self, key):
+        """ :rtype: Value """
+        token = self.partitioner.get_key_token(key)
+        for rtoken, rkey, value in self.iter_from(token, key):
+            if rkey == key:
+                return value
+            return None
+
+    def keys(self):
+        return [record[0] for _, record in read_records(self._map)]
+
+
+class LogStructuredStore(RedisStore):
+    """
+    Durable RedisStore. Writes are appended to a commit log, and then
+    applied to the memtable, which is the inherited RedisStore data
+    and token index.
+
+    When the memtable holds `memtable_size` keys, it's written out as an
+    immutable, token sorted segment file, and the commit log is started
+    over. Once there are `compaction_threshold` segments, they're merged
+    into a single segment.
+
+    On startup, existing segments are loaded, and the commit log is
+    replayed into the memtable, so a restarted node comes back with
+    the data it had when it went down.
+
+    Values are resolved newest first, memtable, then segments in
+    reverse sequence order
+
+    Expired tombstones are dropped when segments are compacted. They
+    aren't purged from the memtable, since older values for the same
+    key may still be in a segment
+
+    Removing a token range drops it from the memtable, and records a
+    range tombstone for the segments written before the removal. Reads
+    skip the keys it covers, and they're dropped from disk by the next
+    compaction, instead of rewriting every segment for each removal
+    """
+
+    memtable_size = 100000
+    compaction_threshold = 4
+
+    commit_log_name = 'commit.log'
+    removed_ranges_name = 'removed_ranges.db'
+    segment_name = re.compile(r'^segment-(\d+)\.db$')
+
+    class Record(object):
+        PUT             = 0
+        REMOVE_RANGE    = 1
+
+    def __init__(self, partitioner, data_dir, memtable_size=None, compaction_threshold=None, sync=False,
+                 tombstone_grace_period=None):
+        """
+        :param partitioner:
+        :type partitioner: kickboxer.partitioner.base.BasePartitioner
+        :param data_dir: the directory the commit log and segments are kept in
+        :param memtable_size: the number of keys to hold in memory before flushing
+        :param compaction_threshold: the number of segments that will trigger a compaction
+        :param sync: fsync the commit log after every write
+        :param tombstone_grace_period: seconds to keep deleted values for
+        """
+        super(LogStructuredStore, self).__init__(partitioner, tombstone_grace_period)
+        self.data_dir = data_dir
+        self.memtable_size = memtable_size or self.memtable_size
+        self.compaction_threshold = compaction_threshold or self.compaction_threshold
+        self.sync = sync
+
+        # segments, newest first
+        self._segments = []
+        self._replaying = False
+
+        # range tombstones, as (start_token, stop_token, sequence) tuples,
+        # keys in the range are removed from segments older than sequence
+        self._removed_ranges = []
+
+        if not os.path.isdir(self.data_dir):
+            os.makedirs(self.data_dir)
+
+        self._load_segments()
+        self._load_removed_ranges()
+        self._load_segment_values()
+        self._replay_commit_log()
+        self._commit_log = open(self.commit_log_path, 'ab')
+
+    @property
+    def commit_log_path(self):
+        return os.path.join(self.data_dir, self.commit_log_name)
+
+    @property
+    def removed_ranges_path(self):
+        return os.path.join(self.data_dir, self.removed_ranges_name)
+
+    @property
+    def recovered(self):
+        """ indicates that data was loaded from disk when the store was opened """
+        return bool(self._segments or self._data)
+
+    def close(self):
+        self._commit_log.close()
+
+    # ------------- persistence -------------
+
+    def _segment_path(self, sequence):
+        return os.path.join(self.data_dir, 'segment-{:010d}.db'.format(sequence))
+
+    def _next_sequence(self):
+        return (self._segments[0].sequence + 1) if self._segments else 0
+
+    def _load_segments(self):
+        segments = []
+        for name in os.listdir(self.data_dir):
+            match = self.segment_name.match(name)
+            if match is None:
+                continue
+            path = os.path.join(self.data_dir, name)
+            segments.append(Segment(path, self.partitioner, int(match.group(1))))
+        self._segments = sorted(segments, key=lambda s: s.sequence, reverse=True)
+
+    def _load_removed_ranges(self):
+        if not os.path.exists(self.removed_ranges_path):
+            return
+        with open(self.removed_ranges_path, 'rb') as f:
+            buf = f.read()
+        self._removed_ranges = [(long(start), long(stop), sequence)
+                                for _, (start, stop, sequence) in read_records(buf)]
+
+    def _save_removed_ranges(self):
+        """ writes the range tombstones out, they outlive the commit log records that created them """
+        path = self.removed_ranges_path
+        if not self._removed_ranges:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            for start_token, stop_token, sequence in self._removed_ranges:
+                write_record(f, [str(start_token), str(stop_token), sequence])
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, path)
+
+    def _segment_removed_ranges(self, segment):
+        """ returns the (start_token, stop_token) ranges removed from the given segment """
+        return [(start, stop) for start, stop, sequence in self._removed_ranges if segment.sequence < sequence]
+
+    def _iter_segment(self, segment, token, key=None):
+        """ iterates over a segment from the given position, skipping removed token ranges """
+        items = segment.iter_from(token, key)
+        removed = self._segment_removed_ranges(segment)
+        if not removed:
+            return items
+        return (i for i in items if not any(start <= i[0] <= stop for start, stop in removed))
+
+    def _load_segment_values(self):
+        """ adds the values loaded from segments to the merkle tree, and schedules their expiry """
+        for token, key, value in self._iter_token_range(0, self.partitioner.max_token):
+            self.merkle_tree.update(token, key, None, value)
+            if value.expires is not None and value.data is not None:
+                self._expirations.schedule(key, value.expires)
+
+    def _replay_commit_log(self):
+        if not os.path.exists(self.commit_log_path):
+            return
+        with open(self.commit_log_path, 'rb') as f:
+            buf = f.read()
+
+        # the end of the last complete record
+        end = 0
+        self._replaying = True
+        try:
+            for offset, record in read_records(buf):
+                end = offset + record_header.size + record_header.unpack_from(buf, offset)[0]
+                if record[0] == LogStructuredStore.Record.PUT:
+                    self._put(record[1], Value(*record[2:]))
+                elif record[0] == LogStructuredStore.Record.REMOVE_RANGE:
+                    start_token, stop_token = long(record[1]), long(record[2])
+                    # records from before range tombstones don't have a sequence
+                    sequence = record[3] if len(record) > 3 else self._next_sequence()
+                    self._remove_token_range(start_token, stop_token, sequence)
+        finally:
+            self._replaying = False
+
+        if end < len(buf):
+            # a record torn by a crash, new records appended after
+            # it would be lost the next time the log is replayed
+            with open(self.commit_log_path, 'r+b') as f:
+                f.truncate(end)
+
+    def _log(self, record):
+        if self._replaying:
+            return
+        write_record(self._commit_log, record)
+        self._commit_log.flush()
+        if self.sync:
+            os.fsync(self._commit_log.fileno())
+
+    def flush(self):
+        """ writes the memtable out to a new segment, and starts a new commit log """
+        if self._data:
+            segment = Segment.write(
+                self._segment_path(self._next_sequence()),
+                self.partitioner,
+                self._next_sequence(),
+                RedisStore._iter_token_range(self, 0, self.partitioner.max_token)
+            )
+            self._segments.insert(0, segment)
+            # open scans keep iterating over the old memtable
+            self._data = {}
+            self._token_map = sorteddict()
+            self._tombstones = []
+            self.used_memory = 0
+            self._range_memory = [0] * self.merkle_tree.num_leaves
+
+        # range removals in the commit log are about to be dropped
+        self._save_removed_ranges()
+        self._commit_log.close()
+        self._commit_log = open(self.commit_log_path, 'wb')
+
+        if len(self._segments) >= self.compaction_threshold:
+            self.compact()
+
+    def compact(self):
+        """
+        merges all segments into a single segment, dropping the keys
+        in removed token ranges
+        """
+        if not self._segments:
+            return
+        old_segments = self._segments
+        items = self._merge([self._iter_segment(s, 0) for s in old_segments])
+
+        # every older value for a key is merged away here, so
+        # expired tombstones can be dropped without resurrecting them
+        expiration = now_timestamp() - (self.tombstone_grace_period * 1000000)
+        items = self._drop_expired_tombstones(items, expiration)
+
+        sequence = self._next_sequence()
+        path = self._segment_path(sequence)
+        items = list(items)
+        self._segments = [Segment.write(path, self.partitioner, sequence, items)] if items else []
+
+        # open scans keep working against the mapped files after they're unlinked
+        for segment in old_segments:
+            os.remove(segment.path)
+
+        # the merged segment is newer than every range tombstone
+        self._removed_ranges = []
+        self._save_removed_ranges()
+
+    def _drop_expired_tombstones(self, items, expiration):
+        for token, key, value in items:
+            if value.data is None and value.timestamp <= expiration:
+                if key not in self._data:
+                    self.merkle_tree.update(token, key, value, None)
+                self.metrics.incr('tombstones_purged')
+                self.metrics.incr('tombstone_bytes_reclaimed', approximate_size(key, value))
+                continue
+            yield token, key, value
+
+    @staticmethod
+    def _merge(iterators):
+        """
+        merges (token, key, value) iterators, ordered newest first,
+        into a single sorted iterator, keeping the newest value for
+        each key
+        """
+        def _prioritize(priority, iterator):
+            for token, key, value in iterator:
+                yield token, key, priority, value
+
+        merged = heapq.merge(*[_prioritize(p, i) for p, i in enumerate(iterators)])
+        last = None
+        for token, key, _, value in merged:
+            if (token, key) == last:
+                continue
+            last = token, key
+            yield token, key, value
+
+    # ------------- storage -------------
+
+    def __contains__(self, item):
+        return self.get_raw_value(item) is not None
+
+    def _current_value(self, key):
+        return self.get_raw_value(key)
+
+    def _put(self, key, value):
+        self._log([LogStructuredStore.Record.PUT, key, value.data, value.timestamp, value.expires])
+        super(LogStructuredStore, self)._put(key, value)
+        if not self._replaying and len(self._data) >= self.memtable_size:
+            self.flush()
+
+    def purge_tombstones(self, now=None, batch_size=1000):
+        """ tombstones are purged by compaction """
+        return 0
+
+    def get_raw_value(self, key):
+        value = self._data.get(key)
+        if value is not None:
+            return value
+        for segment in self._segments:
+            value = segment.get(key)
+            if value is not None:
+                if self._removed_ranges and self._is_removed(segment, self.partitioner.get_key_token(key)):
+                    # older segments are older than the removal too
+                    return None
+                return value
+        return None
+
+    def _is_removed(self, segment, token):
+        return any(start <= token <= stop for start, stop in self._segment_removed_ranges(segment))
+
+    def all_keys(self):
+        keys = set(self._data.keys())
+        for segment in self._segments:
+            if self._segment_removed_ranges(segment):
+                get_key_token = self.partitioner.get_key_token
+                keys.update(k for k in segment.keys() if not self._is_removed(segment, get_key_token(k)))
+            else:
+                keys.update(segment.keys())
+        return list(keys)
+
+    def get_token_range(self, start_token, max_token, count):
+        return BaseStore.get_token_range(self, start_token, max_token, count)
+
+    def _iter_token_range(self, start_token, max_token, cursor=None):
+        memtable = super(LogStructuredStore, self)._iter_token_range(start_token, max_token, cursor)
+        if cursor is not None:
+            # segments are read from the cursor key onwards, so skip the key itself
+            token, key = cursor
+            segments = [(i for i in self._iter_segment(s, token, key) if (i[0], i[1]) != (token, key))
+                        for s in self._segments]
+        else:
+            segments = [self._iter_segment(s, start_token) for s in self._segments]
+
+        for token, key, value in self._merge([memtable] + segments):
+            if token > max_token:
+                break
+            yield token, key, value
+
+    def remove_token_range(self, start_token, stop_token):
+        self._remove_token_range(start_token, stop_token, self._next_sequence())
+
+    def _remove_token_range(self, start_token, stop_token, sequence):
+        """ removes the range from the memtable, and from segments older than the given sequence """
+        self._log([LogStructuredStore.Record.REMOVE_RANGE, str(start_token), str(stop_token), sequence])
+        super(LogStructuredStore, self).remove_token_range(start_token, stop_token)
+        removed = (start_token, stop_token, sequence)
+        if removed not in self._removed_ranges and any(s.sequence < sequence for s in self._segments):
+            self._removed_ranges.append(removed)
+        self._rehash_token_range(start_token, stop_token)
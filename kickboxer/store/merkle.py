@@ -0,0 +1,79 @@
+import hashlib
+import struct
+
+
+class MerkleTree(object):
+    """
+    a hash tree over the token space of a store, used to find the
+    token ranges that differ between replicas without comparing
+    every value
+
+    the token space is split into 2 ** depth leaves of equal width.
+    A leaf's hash is the xor of the hashes of every (key, value) in
+    it's token range, and an inner node's hash is the xor of it's
+    children's hashes. Using xor means a change to a single value
+    can be applied in place, by xoring the difference up the tree,
+    without rehashing the rest of the leaf
+
+    nodes are addressed by (level, index), the root is (0, 0), and
+    the leaves are (depth, 0) through (depth, 2 ** depth - 1)
+    """
+
+    depth = 12
+
+    _hash_struct = struct.Struct('!Q')
+
+    def __init__(self, max_token, depth=None):
+        """
+        :param max_token: the largest token in the token space
+        :param depth: the number of levels below the root
+        """
+        super(MerkleTree, self).__init__()
+        self.max_token = max_token
+        self.depth = depth or self.depth
+        self.num_leaves = 1 << self.depth
+        self._levels = [[0] * (1 << level) for level in range(self.depth + 1)]
+
+    @classmethod
+    def hash_value(cls, key, value):
+        """ returns a 64 bit hash of the given key and value """
+        digest = hashlib.md5('{!r}:{!r}:{!r}:{!r}'.format(key, value.data, value.timestamp, value.expires)).digest()
+        return cls._hash_struct.unpack_from(digest)[0]
+
+    def leaf_for_token(self, token):
+        return (token * self.num_leaves) // (self.max_token + 1)
+
+    def node_range(self, level, idx):
+        """ returns the (start, stop) tokens covered by the given node, inclusively """
+        span = self.max_token + 1
+        width = 1 << level
+        # rounds up, so each token falls in exactly one node per level
+        start = -((-idx * span) // width)
+        stop = -((-(idx + 1) * span) // width) - 1
+        return start, stop
+
+    def get_hash(self, level, idx):
+        return self._levels[level][idx]
+
+    def _apply(self, leaf, delta):
+        idx = leaf
+        for level in range(self.depth, -1, -1):
+            self._levels[level][idx] ^= delta
+            idx >>= 1
+
+    def update(self, token, key, old_value, new_value):
+        """
+        replaces the old value of a key with the new one. Either
+        value can be None, for keys that are being added or removed
+        """
+        delta = 0
+        if old_value is not None:
+            delta ^= self.hash_value(key, old_value)
+        if new_value is not None:
+            delta ^= self.hash_value(key, new_value)
+        if delta:
+            self._apply(self.leaf_for_token(token), delta)
+
+    def reset_leaf(self, leaf):
+        """ clears the hash of the given leaf """
+        self._apply(leaf, self._levels[self.depth][leaf])
@@ -0,0 +1,35 @@
+"""
+length prefixed records, used by the on disk store formats
+
+[record size (4b)][record body]
+record bodies are lists serialized by msgpack
+"""
+import struct
+
+import msgpack
+
+record_header = struct.Struct('!I')
+
+
+def write_record(f, record):
+    body = msgpack.dumps(record)
+    f.write(record_header.pack(len(body)))
+    f.write(body)
+    return record_header.size + len(body)
+
+
+def read_records(buf, offset=0, stop=None):
+    """
+    yields (offset, record) tuples for each complete record in
+    the buffer, starting at the given offset. A partially written
+    record at the end of the buffer is ignored
+    """
+    size = len(buf) if stop is None else stop
+    while offset + record_header.size <= size:
+        body_size, = record_header.unpack_from(buf, offset)
+        start = offset + record_header.size
+        end = start + body_size
+        if end > size:
+            return
+        yield offset, msgpack.loads(buf[start:end])
+        offset = end
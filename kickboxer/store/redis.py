@@ -1,10 +1,23 @@
-from collections import defaultdict
+from collections import OrderedDict
 from datetime import datetime
+import hashlib
+import heapq
+import random
+import sys
+import time
 
 from blist import sorteddict
+import gevent
+from gevent.event import Event
+import msgpack
+
+from kickboxer.metrics import Metrics
 from kickboxer.store.base import BaseStore
+from kickboxer.store.merkle import MerkleTree
+from kickboxer.store.snapshot import Snapshot
+from kickboxer.store.timing_wheel import TimingWheel
 
-from kickboxer.utils import serialize_timestamp, deserialize_timestamp
+from kickboxer.utils import serialize_timestamp, now_timestamp
 
 # checkout the multiprocessing module
 # http://cython.org/
@@ -17,39 +30,77 @@ class Value(object):
     most recent one wins
 
     deleting a value results in a Value with a None value
+
+    timestamps are kept as microseconds since the epoch, which
+    is also how they're sent over the wire, and values are
+    slotted, since there's one of these for every key
     """
 
-    def __init__(self, value, timestamp=None):
+    __slots__ = ('data', 'timestamp', 'expires', 'access')
+
+    def __init__(self, value, timestamp=None, expires=None):
         """
         :param value:
         :type value: str
-        :param timestamp: the time this value was added
-        :type timestamp: datetime
+        :param timestamp: the time this value was added, datetimes
+            are converted to microseconds since the epoch
+        :type timestamp: long
+        :param expires: the time this value expires, in microseconds
+            since the epoch, or None if it doesn't expire
+        :type expires: long
         :return:
         """
         self.data = value
+        if isinstance(timestamp, datetime):
+            timestamp = serialize_timestamp(timestamp)
         self.timestamp = timestamp
-        if isinstance(self.timestamp, (int, long)):
-            self.timestamp = self._deserialize_timestamp(self.timestamp)
+        self.expires = expires
+
+        # when the value was last read or written, for eviction. This
+        # is local to each node, so it's not compared or serialized
+        self.access = 0
 
     def __repr__(self):
+        if self.expires is not None:
+            return '<Value data={} ts={} expires={}>'.format(self.data, self.timestamp, self.expires)
         return '<Value data={} ts={}>'.format(self.data, self.timestamp)
 
     def __eq__(self, other):
         if isinstance(other, Value):
-            return other.data == self.data and other.timestamp == self.timestamp
+            return (other.data == self.data and
+                    other.timestamp == self.timestamp and
+                    other.expires == self.expires)
         return False
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __reduce__(self):
+        # slotted classes can't be pickled with the
+        # default protocol without some help
+        return Value, (self.data, self.timestamp, self.expires)
+
+    def is_expired(self, now=None):
+        if self.expires is None:
+            return False
+        return self.expires <= (now or now_timestamp())
+
     def serialize(self):
-        return self.data, serialize_timestamp(self.timestamp)
+        if self.expires is None:
+            return self.data, self.timestamp
+        return self.data, self.timestamp, self.expires
 
     @classmethod
     def deserialize(cls, data):
-        val, ts = data
-        return Value(val, deserialize_timestamp(ts))
+        return cls(*data)
+
+
+def approximate_size(key, value):
+    """ the approximate number of bytes used to store the given key and value """
+    return (sys.getsizeof(key) +
+            sys.getsizeof(value) +
+            sys.getsizeof(value.data) +
+            sys.getsizeof(value.timestamp))
 
 
 class Instruction(object):
@@ -69,22 +120,106 @@ class RedisStore(BaseStore):
     added
 
     deleting a value results in a Value with a None value
+
+    values can be given an expiry time with setex and expire. Once
+    it passes, the value is replaced with a tombstone timestamped at
+    the expiry time, so every replica expires it the same way. Values
+    are expired when they're read, or when the timing wheel reaches
+    their expiry time in expire_keys, whichever comes first
+
+    if maxmemory is set, keys are evicted when the approximate size
+    of the store's keys and values goes over it. Like redis, keys
+    are chosen by sampling a few keys at random, and evicting the
+    least recently used, or least frequently used one, depending on
+    the eviction policy. Evicted keys are remembered for a while,
+    so they aren't brought back by read repair or streaming
     """
 
+    class EvictionPolicy(object):
+        LRU = 'allkeys-lru'
+        LFU = 'allkeys-lfu'
+
     retrieval_instructions = frozenset(['get'])
-    mutation_instructions = frozenset(['set', 'delete'])
+    mutation_instructions = frozenset(['set', 'delete', 'setex', 'expire'])
+
+    # the number of seconds deleted values are kept around
+    # before they can be purged. This needs to be long enough
+    # for the delete to reach every replica, or the deleted
+    # value could be brought back by read repair or streaming
+    tombstone_grace_period = 60 * 60 * 24 * 10
 
-    def __init__(self, partitioner):
+    eviction_policy = EvictionPolicy.LRU
+
+    # the number of keys sampled for each eviction
+    eviction_samples = 5
+
+    # the number of evicted keys that are remembered, writes for these
+    # keys that are older than the evicted value are ignored
+    max_evicted_keys = 100000
+
+    # lfu counters are logarithmic, and decay by one every
+    # `lfu_decay_time` minutes that a key isn't accessed
+    lfu_log_factor = 10
+    lfu_decay_time = 1
+    lfu_init_value = 5
+
+    def __init__(self, partitioner, tombstone_grace_period=None, maxmemory=None, eviction_policy=None):
         """
         :param partitioner:
         :type partitioner: kickboxer.partitioner.base.BasePartitioner
+        :param tombstone_grace_period: seconds to keep deleted values for
+        :param maxmemory: the approximate number of bytes to store before
+            evicting keys, or None to never evict keys
+        :param eviction_policy: one of RedisStore.EvictionPolicy
         """
         super(RedisStore, self).__init__()
         self.partitioner = partitioner
         self._data = {}
+        self.metrics = Metrics()
+        if tombstone_grace_period is not None:
+            self.tombstone_grace_period = tombstone_grace_period
+        self.maxmemory = maxmemory
+        if eviction_policy is not None:
+            assert eviction_policy in (RedisStore.EvictionPolicy.LRU, RedisStore.EvictionPolicy.LFU)
+            self.eviction_policy = eviction_policy
+
+        # a heap of (timestamp, key) tuples for deleted values, so
+        # expired tombstones can be found without scanning the store.
+        # Entries for keys that have been written since are skipped
+        self._tombstones = []
+
+        # token -> {key[1], ...key[n]}, updated as keys are
+        # added and removed, so range lookups don't need to
+        # rehash every key in the store. Values are sets in
+        # case there are token collisions
+        self._token_map = sorteddict()
+
+        # (expiry time, key) entries for values with an expiry time,
+        # entries for keys that have been written since are skipped
+        self._expirations = TimingWheel(now_timestamp())
+
+        # hashes of the store's values by token range, updated as
+        # values are written, for comparing data with other replicas
+        self.merkle_tree = MerkleTree(partitioner.max_token)
+
+        # the approximate size of the stored keys and values, in
+        # total, and for each of the merkle tree's leaf token ranges
+        self.used_memory = 0
+        self._range_memory = [0] * self.merkle_tree.num_leaves
+
+        # key -> timestamp of the evicted value, oldest first
+        self._evicted = OrderedDict()
+
+        # a snapshot that's being loaded into the store. Reads for
+        # keys that haven't been loaded yet are served from it, and
+        # anything that needs the whole store waits for it to load
+        self._snapshot = None
+        self._snapshot_removed_ranges = []
+        self._snapshot_loaded = Event()
+        self._snapshot_loaded.set()
 
     def __contains__(self, item):
-        return item in self._data
+        return item in self._data or self._get_snapshot_value(item) is not None
 
     @property
     def token_map(self):
@@ -92,13 +227,55 @@ class RedisStore(BaseStore):
         returns a map of token -> {key[1], ...key[n]}
         :return:
         """
-        #TODO: keep track of this during normal storage operation
-        # using a set in case there are token collisions
-        token_map = defaultdict(set)
-        for key in self._data.keys():
-            token_map[self.partitioner.get_key_token(key)].add(key)
-        token_map = sorteddict(token_map)
-        return token_map
+        return self._token_map
+
+    def _current_value(self, key):
+        """ returns the value for the key that's included in the merkle tree """
+        return self._data.get(key)
+
+    def _account(self, token, size):
+        self.used_memory += size
+        self._range_memory[self.merkle_tree.leaf_for_token(token)] += size
+
+    def _put(self, key, value):
+        """ stores the value, indexing the key's token if it's new to the store """
+        token = self.partitioner.get_key_token(key)
+        self.merkle_tree.update(token, key, self._current_value(key), value)
+        previous = self._data.get(key)
+        if previous is None:
+            keys = self._token_map.get(token)
+            if keys is None:
+                keys = self._token_map[token] = set()
+            keys.add(key)
+            self._account(token, approximate_size(key, value))
+        else:
+            self._account(token, approximate_size(key, value) - approximate_size(key, previous))
+        self._data[key] = value
+        if value.data is None:
+            heapq.heappush(self._tombstones, (value.timestamp, key))
+        elif value.expires is not None:
+            self._expirations.schedule(key, value.expires)
+
+        if self._evicted:
+            self._evicted.pop(key, None)
+        if self.maxmemory is not None:
+            self._touch(value)
+            while self.used_memory > self.maxmemory and self._evict(exclude=key):
+                pass
+
+    def _pop(self, key):
+        """ removes the key from the store, and from the token index """
+        value = self._data.pop(key, None)
+        if value is not None:
+            token = self.partitioner.get_key_token(key)
+            self.merkle_tree.update(token, key, value, None)
+            self._account(token, -approximate_size(key, value))
+            keys = self._token_map.get(token)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._token_map[token]
+        return value
 
     def get_token_range(self, start_token, max_token, count):
         """
@@ -109,7 +286,8 @@ class RedisStore(BaseStore):
         :return:
         """
         assert count > 1
-        token_map = self.token_map
+        self._snapshot_loaded.wait()
+        token_map = self._token_map
 
         rdata = []
         key_view = token_map.viewkeys()
@@ -118,10 +296,48 @@ class RedisStore(BaseStore):
         for token in key_view[start_idx: stop_idx]:
             if token > max_token:
                 break
-            for key in sorted(list(token_map[token])):
+            for key in sorted(token_map[token]):
                 rdata.append((key, self._data.get(key)))
         return rdata
 
+    def _iter_token_range(self, start_token, max_token, cursor=None):
+        """
+        yields (token, key, value) tuples for scan_token_range. The
+        store can change between yields, so the position in the token
+        index is found again with a bisect after every token, unless
+        the last token is still where it was
+        """
+        self._snapshot_loaded.wait()
+        # subclasses can swap in new containers, like the lsm store
+        # flushing it's memtable, and the scan keeps the ones it started with
+        data = self._data
+        token_map = self._token_map
+        key_view = token_map.viewkeys()
+
+        if cursor is not None:
+            # finish the cursor's token, then move on
+            token, last_key = cursor
+            for key in sorted(token_map.get(token, ())):
+                value = data.get(key)
+                if key > last_key and value is not None:
+                    yield token, key, value
+            idx = key_view.bisect_right(token)
+        else:
+            idx = key_view.bisect_left(start_token)
+
+        while idx < len(key_view):
+            token = key_view[idx]
+            if token > max_token:
+                break
+            for key in sorted(token_map.get(token, ())):
+                value = data.get(key)
+                if value is not None:
+                    yield token, key, value
+            if idx < len(key_view) and key_view[idx] == token:
+                idx += 1
+            else:
+                idx = key_view.bisect_right(token)
+
     def remove_token_range(self, start_token, stop_token):
         """
         removes all keys in the store with tokens between the
@@ -130,33 +346,318 @@ class RedisStore(BaseStore):
         :param stop_token:
         :return:
         """
-        token_map = self.token_map
+        if self._snapshot is not None:
+            self._snapshot_removed_ranges.append((start_token, stop_token))
+        token_map = self._token_map
         key_view = token_map.viewkeys()
         start_idx = key_view.bisect_left(start_token)
-        for token in key_view[start_idx:]:
-            if token > stop_token:
-                break
-            for key in token_map[token]:
-                self._data.pop(key, None)
+        stop_idx = key_view.bisect_right(stop_token)
+        for token in list(key_view[start_idx:stop_idx]):
+            for key in token_map.pop(token):
+                value = self._data.pop(key, None)
+                self.merkle_tree.update(token, key, value, None)
+                if value is not None:
+                    self._account(token, -approximate_size(key, value))
 
     def all_keys(self):
+        self._snapshot_loaded.wait()
         return self._data.keys()
 
     def get_raw_value(self, key):
-        return self._data.get(key)
+        value = self._data.get(key)
+        if value is None and self._snapshot is not None:
+            return self._get_snapshot_value(key)
+        return value
+
+    # ------------- tombstones -------------
+
+    def purge_tombstones(self, now=None, batch_size=1000):
+        """
+        removes deleted values that are older than the tombstone grace
+        period, yielding to other greenlets every `batch_size` tombstones
+
+        :param now: the current time, in microseconds since the epoch
+        :return: the number of tombstones purged
+        """
+        now = now or now_timestamp()
+        expiration = now - (self.tombstone_grace_period * 1000000)
+        tombstones = self._tombstones
+
+        purged = 0
+        checked = 0
+        while tombstones and tombstones[0][0] <= expiration:
+            timestamp, key = heapq.heappop(tombstones)
+            value = self._data.get(key)
+            if value is not None and value.data is None and value.timestamp == timestamp:
+                self._pop(key)
+                purged += 1
+                self.metrics.incr('tombstones_purged')
+                self.metrics.incr('tombstone_bytes_reclaimed', approximate_size(key, value))
+
+            checked += 1
+            if checked % batch_size == 0:
+                gevent.sleep(0)
+
+        self.metrics.set('tombstones', len(tombstones))
+        return purged
+
+    # ------------- eviction -------------
+
+    def get_memory_usage(self, start_token=0, stop_token=None):
+        """
+        returns the approximate size of the keys and values in the given
+        token range. The range is rounded out to the merkle tree's leaves
+        """
+        stop_token = self.partitioner.max_token if stop_token is None else stop_token
+        first_leaf = self.merkle_tree.leaf_for_token(start_token)
+        last_leaf = self.merkle_tree.leaf_for_token(stop_token)
+        return sum(self._range_memory[first_leaf:last_leaf + 1])
+
+    def _lfu_counter(self, access, now_minutes):
+        """ returns the decayed counter from the access info of an lfu value """
+        if not access:
+            return self.lfu_init_value
+        last_minutes, counter = access >> 8, access & 0xff
+        return max(counter - ((now_minutes - last_minutes) // self.lfu_decay_time), 0)
+
+    def _touch(self, value):
+        """ updates the access info the eviction policy uses """
+        if self.eviction_policy == RedisStore.EvictionPolicy.LFU:
+            now_minutes = int(time.time() // 60)
+            counter = self._lfu_counter(value.access, now_minutes)
+            # increments get less likely as the counter grows
+            base = max(counter - self.lfu_init_value, 0)
+            if counter < 255 and random.random() < 1.0 / ((base * self.lfu_log_factor) + 1):
+                counter += 1
+            value.access = (now_minutes << 8) | counter
+        else:
+            value.access = time.time()
+
+    def _eviction_score(self, value, now_minutes):
+        """ values with lower scores are evicted first """
+        if self.eviction_policy == RedisStore.EvictionPolicy.LFU:
+            return self._lfu_counter(value.access, now_minutes)
+        return value.access
+
+    def _evict(self, exclude=None):
+        """
+        evicts the least recently, or least frequently used key out of
+        a random sample of keys
+
+        :param exclude: a key that shouldn't be evicted
+        :return: True if a key was evicted
+        """
+        token_view = self._token_map.viewkeys()
+        if not token_view:
+            return False
+        now_minutes = int(time.time() // 60)
+        candidate = None
+        for _ in range(self.eviction_samples):
+            # the token map is a sorted dict, so sampling by
+            # index doesn't need a list of every key
+            token = token_view[random.randrange(len(token_view))]
+            for key in self._token_map[token]:
+                if key == exclude:
+                    continue
+                score = self._eviction_score(self._data[key], now_minutes)
+                if candidate is None or score < candidate[0]:
+                    candidate = score, key
+        if candidate is None:
+            return False
+
+        key = candidate[1]
+        value = self._pop(key)
+        self._evicted.pop(key, None)
+        self._evicted[key] = value.timestamp
+        if len(self._evicted) > self.max_evicted_keys:
+            self._evicted.popitem(last=False)
+        self.metrics.incr('evicted_keys')
+        return True
+
+    def _was_evicted(self, key, value):
+        """ indicates that the value is no newer than a value for the key that was evicted """
+        if not self._evicted:
+            return False
+        timestamp = self._evicted.get(key)
+        return timestamp is not None and value.timestamp <= timestamp
+
+    # ------------- expiry -------------
+
+    def _expire(self, key, value):
+        """ replaces an expired value with a tombstone """
+        tombstone = Value(None, value.expires)
+        self._put(key, tombstone)
+        self.metrics.incr('keys_expired')
+        return tombstone
+
+    def expire_keys(self, now=None, batch_size=1000):
+        """
+        expires the values whose expiry time has passed, yielding to
+        other greenlets every `batch_size` values
+
+        :param now: the current time, in microseconds since the epoch
+        :return: the number of values expired
+        """
+        now = now or now_timestamp()
+        expired = 0
+        for i, (expires, key) in enumerate(self._expirations.advance(now)):
+            # the key may have been written or deleted since it was scheduled
+            value = self._current_value(key)
+            if value is not None and value.data is not None and value.expires == expires:
+                self._expire(key, value)
+                expired += 1
+            if (i + 1) % batch_size == 0:
+                gevent.sleep(0)
+        self.metrics.set('expiring_keys', len(self._expirations))
+        return expired
+
+    # ------------- merkle tree -------------
+
+    def get_merkle_hash(self, level, idx, start_token=0, stop_token=None):
+        """
+        returns the hash of the values in the given merkle tree node's
+        token range that also fall between the start and stop token.
+        Nodes that are entirely inside the range are read from the
+        tree, leaves that are partially inside it are hashed from
+        the store's values
+        """
+        self._snapshot_loaded.wait()
+        stop_token = self.partitioner.max_token if stop_token is None else stop_token
+        tree = self.merkle_tree
+        node_start, node_stop = tree.node_range(level, idx)
+        if node_stop < start_token or node_start > stop_token:
+            return 0
+        if start_token <= node_start and node_stop <= stop_token:
+            return tree.get_hash(level, idx)
+        if level < tree.depth:
+            return (self.get_merkle_hash(level + 1, idx * 2, start_token, stop_token) ^
+                    self.get_merkle_hash(level + 1, (idx * 2) + 1, start_token, stop_token))
+
+        merkle_hash = 0
+        for _, key, value in self._iter_token_range(max(start_token, node_start), min(stop_token, node_stop)):
+            merkle_hash ^= tree.hash_value(key, value)
+        return merkle_hash
+
+    def _rehash_token_range(self, start_token, stop_token):
+        """ recomputes the merkle tree leaves covering the given token range """
+        tree = self.merkle_tree
+        first_leaf = tree.leaf_for_token(start_token)
+        last_leaf = tree.leaf_for_token(stop_token)
+        for leaf in range(first_leaf, last_leaf + 1):
+            tree.reset_leaf(leaf)
+        range_start = tree.node_range(tree.depth, first_leaf)[0]
+        range_stop = tree.node_range(tree.depth, last_leaf)[1]
+        for token, key, value in self._iter_token_range(range_start, range_stop):
+            tree.update(token, key, None, value)
+
+    # ------------- snapshots -------------
+
+    def write_snapshot(self, path):
+        """
+        writes a point in time snapshot of the store to the given path
+        """
+        Snapshot.write(path, self._iter_token_range(0, self.partitioner.max_token))
+
+    def load_snapshot(self, path):
+        """
+        memory maps a snapshot written by write_snapshot. Reads are
+        served from the snapshot until rebuild_from_snapshot has
+        copied its values into the store
+        """
+        self._snapshot = Snapshot(path, self.partitioner)
+        self._snapshot_removed_ranges = []
+        self._snapshot_loaded.clear()
+
+    @property
+    def is_loading_snapshot(self):
+        return self._snapshot is not None
+
+    def _in_removed_snapshot_range(self, key):
+        if not self._snapshot_removed_ranges:
+            return False
+        token = self.partitioner.get_key_token(key)
+        return any(start <= token <= stop for start, stop in self._snapshot_removed_ranges)
+
+    def _get_snapshot_value(self, key):
+        if self._snapshot is None or self._in_removed_snapshot_range(key):
+            return None
+        result = self._snapshot.get(key)
+        return Value(*result) if result is not None else None
+
+    def rebuild_from_snapshot(self, batch_size=1000):
+        """
+        copies the values in the loaded snapshot into the store,
+        yielding to other greenlets every `batch_size` values. Values
+        written since the snapshot was loaded are kept if they're newer
+        """
+        for _ in self.iter_snapshot_rebuild(batch_size):
+            gevent.sleep(0)
+
+    def iter_snapshot_rebuild(self, batch_size=1000):
+        """
+        rebuilds the store from the loaded snapshot like rebuild_from_snapshot,
+        as a generator that yields after every `batch_size` values, so the
+        caller decides how the rebuild is interleaved with other requests
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            return
+        for i, (key, data, timestamp, expires) in enumerate(snapshot.iter_items()):
+            if i and i % batch_size == 0:
+                yield
+            if self._in_removed_snapshot_range(key):
+                continue
+            existing = self._data.get(key)
+            if existing is None or existing.timestamp < timestamp:
+                self._put(key, Value(data, timestamp, expires))
+
+        self._snapshot = None
+        self._snapshot_removed_ranges = []
+        snapshot.close()
+        self._snapshot_loaded.set()
 
     def set_and_reconcile_raw_value(self, key, value):
-        self._data[key] = value
+        existing = self.get_raw_value(key)
+        if existing is not None and existing.timestamp >= value.timestamp:
+            return
+        if self._was_evicted(key, value):
+            return
+        self._put(key, value)
+
+    def _put_if_newer(self, key, value):
+        existing = self.get_raw_value(key)
+        if value.timestamp:
+            if existing and existing.timestamp >= value.timestamp:
+                return
+            # read repair would otherwise write evicted keys right back
+            if self._was_evicted(key, value):
+                return
+        self._put(key, value)
 
     def set(self, key, val, timestamp):
         # if timestamp was provided, check against
         # check against existing value
+        self._put_if_newer(key, Value(val, timestamp))
+
+    def setex(self, key, seconds, val, timestamp):
+        """ sets the value, expiring it the given number of seconds after the timestamp """
         val = Value(val, timestamp)
-        existing = self._data.get(key)
-        if timestamp:
-            if existing and existing.timestamp >= val.timestamp:
-                return
-        self._data[key] = val
+        val.expires = (val.timestamp or now_timestamp()) + (int(seconds) * 1000000)
+        self._put_if_newer(key, val)
+
+    def expire(self, key, seconds, timestamp):
+        """
+        sets the expiry time of an existing value. The value is
+        rewritten with the given timestamp, so the expiry time is
+        resolved and replicated like any other write
+
+        :return: True if the key exists
+        """
+        existing = self.get(key)
+        if existing is None or existing.data is None:
+            return False
+        self.setex(key, seconds, existing.data, timestamp)
+        return True
 
     def get_random_token(self):
         return self.partitioner.get_random_token()
@@ -165,19 +666,34 @@ class RedisStore(BaseStore):
     def resolve_set(cls, key, args, timestamp, values):
         return Value(True, None)
 
+    @classmethod
+    def resolve_setex(cls, key, args, timestamp, values):
+        return Value(True, None)
+
+    @classmethod
+    def resolve_expire(cls, key, args, timestamp, values):
+        return Value(any(values), None)
+
     def get(self, key):
         """ :rtype: Value """
-        return self._data.get(key)
+        value = self.get_raw_value(key)
+        if value is not None and value.data is not None and value.is_expired():
+            value = self._expire(key, value)
+        elif value is not None and self.maxmemory is not None:
+            self._touch(value)
+        return value
 
     def delete(self, key, timestamp):
         # if timestamp was provided, check against
         # check against existing value
         val = Value(None, timestamp)
         if timestamp:
-            existing = self._data.get(key)
+            existing = self.get_raw_value(key)
             if existing and existing.timestamp >= val.timestamp:
                 return
-        self._data[key] = val
+            if self._was_evicted(key, val):
+                return
+        self._put(key, val)
 
     @classmethod
     def resolve_get(cls, key, args, values):
@@ -190,6 +706,18 @@ class RedisStore(BaseStore):
         _ = args
         return cls.resolve(values)
 
+    @classmethod
+    def digest(cls, value):
+        """
+        returns a digest of a retrieved value, so replicas can
+        be compared without sending the whole value. The value's
+        fields are hashed as msgpack bytes, which are the same for
+        equal values, whatever their containers or int types
+        """
+        if value is None:
+            return None
+        return hashlib.md5(msgpack.dumps(value.serialize())).digest()
+
     @classmethod
     def resolve_get_instructions(cls, key, args, value_map):
         """
@@ -202,7 +730,11 @@ class RedisStore(BaseStore):
         :return:
         """
         value = cls.resolve_get(key, args, filter(None, value_map.values()))
-        if value.data:
+        if value.data and value.expires is not None:
+            seconds = (value.expires - value.timestamp) // 1000000
+            instruction = Instruction('setex', key, [seconds, value.data], value.timestamp)
+            return {nid: [instruction] for nid, val in value_map.items() if val != value}
+        elif value.data:
             return {nid: [Instruction('set', key, [value.data], value.timestamp)] for nid, val in value_map.items() if val != value}
         else:
             return {nid: [Instruction('delete', key, [], value.timestamp)] for nid, val in value_map.items() if val != value}
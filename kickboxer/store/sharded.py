@@ -0,0 +1,392 @@
+"""
+runs a node's store as several worker processes, each holding the keys
+for an equal sub range of the token space, so a single node can use
+more than one core
+
+workers are started with `python -m kickboxer.store.sharded`, and are
+sent requests over a unix socket. Requests and responses are pickled,
+and framed with a 4 byte length prefix:
+[body size (4b)][pickled body]
+
+requests are (method, args) tuples, and responses are
+(ok, result) tuples, where result is the raised exception if ok is False
+"""
+import cPickle as pickle
+from itertools import islice
+import os
+import socket as _socket
+import struct
+import subprocess
+import sys
+
+import gevent
+from gevent.lock import Semaphore
+from gevent import socket
+
+from kickboxer.metrics import Metrics
+from kickboxer.store.base import BaseStore
+from kickboxer.store.merkle import MerkleTree
+from kickboxer.store.redis import RedisStore
+
+
+class ShardException(Exception): pass
+
+
+_frame_header = struct.Struct('!I')
+
+
+def _send_frame(sock, obj):
+    body = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+    sock.sendall(_frame_header.pack(len(body)) + body)
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise EOFError
+        chunks.append(chunk)
+        size -= len(chunk)
+    return ''.join(chunks)
+
+
+def _recv_frame(sock):
+    size, = _frame_header.unpack(_recv_exactly(sock, _frame_header.size))
+    return pickle.loads(_recv_exactly(sock, size))
+
+
+class ShardWorker(object):
+    """ the store wrapper that runs in each worker process """
+
+    def __init__(self, store):
+        super(ShardWorker, self).__init__()
+        self.store = store
+        self._rebuild = None
+
+    def scan_page(self, start_token, max_token, cursor, count):
+        """
+        returns up to `count` (token, key, value) tuples from the token range,
+        the cursor to resume from, and whether the scan is exhausted
+        """
+        scan = self.store.scan_token_range(start_token, max_token, cursor)
+        items = list(islice(scan, count))
+        return items, scan.cursor, scan.exhausted
+
+    def rebuild_snapshot_batch(self, batch_size):
+        """
+        copies the next `batch_size` values from the loaded snapshot into
+        the store, and returns True once the rebuild is finished
+        """
+        if self._rebuild is None:
+            self._rebuild = self.store.iter_snapshot_rebuild(batch_size)
+        try:
+            next(self._rebuild)
+            return False
+        except StopIteration:
+            self._rebuild = None
+            return True
+
+    def metrics(self):
+        return self.store.metrics.snapshot()
+
+    def attribute(self, name):
+        return getattr(self.store, name)
+
+    def serve(self, sock):
+        while True:
+            try:
+                method, args = _recv_frame(sock)
+            except EOFError:
+                return
+            try:
+                target = getattr(self, method, None) or getattr(self.store, method)
+                response = True, target(*args)
+            except Exception as ex:
+                response = False, ex
+            _send_frame(sock, response)
+
+
+class Shard(object):
+    """ the parent process' handle on a worker process """
+
+    def __init__(self, idx, start_token, stop_token, store_class, args, kwargs):
+        super(Shard, self).__init__()
+        self.idx = idx
+        self.start_token = start_token
+        self.stop_token = stop_token
+
+        parent_sock, child_sock = socket.socketpair(_socket.AF_UNIX, _socket.SOCK_STREAM)
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        # the worker's end of the socket is passed in as stdin, so
+        # no other descriptors (like listening sockets) are inherited
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'kickboxer.store.sharded'],
+            stdin=child_sock.fileno(),
+            close_fds=True,
+            env=env
+        )
+        child_sock.close()
+        self._sock = parent_sock
+        self._lock = Semaphore()
+        self.call('__init__', store_class, args, kwargs)
+
+    def __repr__(self):
+        return '<Shard {} [{}, {}]>'.format(self.idx, self.start_token, self.stop_token)
+
+    def call(self, method, *args):
+        """ calls a method on the worker's store, and returns the result """
+        with self._lock:
+            try:
+                _send_frame(self._sock, (method, args))
+                ok, result = _recv_frame(self._sock)
+            except (EOFError, socket.error) as ex:
+                raise ShardException('{} is unavailable: {}'.format(self, ex))
+        if not ok:
+            raise result
+        return result
+
+    def close(self):
+        self._sock.close()
+        self.process.wait()
+
+
+class ShardedStore(BaseStore):
+    """
+    splits the store into `num_workers` worker processes, each with
+    it's own store, and keys in an equal sub range of the token space.
+
+    Single key operations are sent to the worker that owns the key,
+    and operations over the whole store, or a token range, are sent
+    to the workers concurrently, and their results are combined. Since
+    the parent process waits on the workers cooperatively, requests
+    for keys on different workers are served in parallel
+    """
+
+    def __init__(self, partitioner, num_workers, store_class=RedisStore, **store_kwargs):
+        """
+        :param partitioner:
+        :type partitioner: kickboxer.partitioner.base.BasePartitioner
+        :param num_workers: the number of worker processes to start
+        :param store_class: the store class the workers run
+        :param store_kwargs: args for the store class. If there's a
+            data_dir, each worker uses a subdirectory of it
+        """
+        super(ShardedStore, self).__init__()
+        self.partitioner = partitioner
+        self.store_class = store_class
+        self.retrieval_instructions = store_class.retrieval_instructions
+        self.mutation_instructions = store_class.mutation_instructions
+
+        # the shards' trees are combined, this one is only used for it's layout
+        self.merkle_tree = MerkleTree(partitioner.max_token)
+
+        span = partitioner.max_token + 1
+        self.shards = []
+        for i in range(num_workers):
+            kwargs = dict(store_kwargs)
+            if kwargs.get('data_dir'):
+                kwargs['data_dir'] = os.path.join(kwargs['data_dir'], 'shard-{}'.format(i))
+            start_token = (i * span) // num_workers
+            stop_token = (((i + 1) * span) // num_workers) - 1
+            self.shards.append(Shard(i, start_token, stop_token, store_class, (partitioner,), kwargs))
+
+    def __getattr__(self, item):
+        # resolution and digests are done by the coordinating node, with the store class' classmethods
+        if item.startswith('resolve') or item == 'digest':
+            return getattr(self.store_class, item)
+        raise AttributeError(item)
+
+    def __contains__(self, item):
+        return self._shard_for_key(item).call('__contains__', item)
+
+    def _shard_for_key(self, key):
+        token = self.partitioner.get_key_token(key)
+        return self.shards[(token * len(self.shards)) // (self.partitioner.max_token + 1)]
+
+    def _shards_for_range(self, start_token, stop_token):
+        return [s for s in self.shards if s.stop_token >= start_token and s.start_token <= stop_token]
+
+    @staticmethod
+    def _call_concurrently(calls):
+        """
+        makes (shard, method, args) calls concurrently, and returns their results, in order
+        """
+        greenlets = [gevent.spawn(shard.call, method, *args) for shard, method, args in calls]
+        gevent.joinall(greenlets, raise_error=True)
+        return [g.value for g in greenlets]
+
+    def _call_all(self, method, *args):
+        """ calls the method on every worker, and returns their results, in shard order """
+        return self._call_concurrently([(s, method, args) for s in self.shards])
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+    # ------------- instructions -------------
+
+    def get(self, key):
+        return self._shard_for_key(key).call('get', key)
+
+    def set(self, key, val, timestamp):
+        return self._shard_for_key(key).call('set', key, val, timestamp)
+
+    def delete(self, key, timestamp):
+        return self._shard_for_key(key).call('delete', key, timestamp)
+
+    def setex(self, key, seconds, val, timestamp):
+        return self._shard_for_key(key).call('setex', key, seconds, val, timestamp)
+
+    def expire(self, key, seconds, timestamp):
+        return self._shard_for_key(key).call('expire', key, seconds, timestamp)
+
+    def _group_by_shard(self, keys):
+        """ returns a list of (shard, [index, ...]) tuples, for the indexes of the keys each shard owns """
+        groups = {}
+        for i, key in enumerate(keys):
+            shard = self._shard_for_key(key)
+            groups.setdefault(shard.idx, (shard, []))[1].append(i)
+        return groups.values()
+
+    @staticmethod
+    def _ungroup(groups, group_results, num_items):
+        results = [None] * num_items
+        for (_, indexes), shard_results in zip(groups, group_results):
+            for i, result in zip(indexes, shard_results):
+                results[i] = result
+        return results
+
+    def execute_batch_retrieval(self, instruction, keys, args):
+        """ sends one request to each worker that owns some of the keys """
+        groups = self._group_by_shard(keys)
+        group_results = self._call_concurrently([
+            (shard, 'execute_batch_retrieval', (instruction, [keys[i] for i in indexes], args))
+            for shard, indexes in groups
+        ])
+        return self._ungroup(groups, group_results, len(keys))
+
+    def execute_batch_mutation(self, mutations):
+        """ sends one request to each worker that owns some of the mutated keys """
+        groups = self._group_by_shard([m[1] for m in mutations])
+        group_results = self._call_concurrently([
+            (shard, 'execute_batch_mutation', ([mutations[i] for i in indexes],))
+            for shard, indexes in groups
+        ])
+        return self._ungroup(groups, group_results, len(mutations))
+
+    # ------------- raw values -------------
+
+    def get_raw_value(self, key):
+        return self._shard_for_key(key).call('get_raw_value', key)
+
+    def set_and_reconcile_raw_value(self, key, value):
+        return self._shard_for_key(key).call('set_and_reconcile_raw_value', key, value)
+
+    def all_keys(self):
+        return sum(self._call_all('all_keys'), [])
+
+    def get_random_token(self):
+        return self.partitioner.get_random_token()
+
+    def _iter_token_range(self, start_token, max_token, cursor=None, page_size=1000):
+        for shard in self._shards_for_range(start_token, max_token):
+            if cursor is not None and cursor.token > shard.stop_token:
+                continue
+            shard_cursor = cursor if cursor is not None and cursor.token >= shard.start_token else None
+            exhausted = False
+            while not exhausted:
+                items, shard_cursor, exhausted = shard.call(
+                    'scan_page', start_token, max_token, shard_cursor, page_size
+                )
+                for item in items:
+                    yield item
+
+    def remove_token_range(self, start_token, stop_token):
+        self._call_concurrently([
+            (s, 'remove_token_range', (max(start_token, s.start_token), min(stop_token, s.stop_token)))
+            for s in self._shards_for_range(start_token, stop_token)
+        ])
+
+    def get_merkle_hash(self, level, idx, start_token=0, stop_token=None):
+        merkle_hash = 0
+        for shard_hash in self._call_all('get_merkle_hash', level, idx, start_token, stop_token):
+            merkle_hash ^= shard_hash
+        return merkle_hash
+
+    # ------------- maintenance -------------
+
+    @property
+    def metrics(self):
+        """ the sum of the workers' metrics """
+        metrics = Metrics()
+        for snapshot in self._call_all('metrics'):
+            for name, value in snapshot.items():
+                metrics.incr(name, value)
+        return metrics
+
+    @property
+    def used_memory(self):
+        return sum(self._call_all('attribute', 'used_memory'))
+
+    @property
+    def recovered(self):
+        return any(self._call_all('attribute', 'recovered'))
+
+    def get_memory_usage(self, start_token=0, stop_token=None):
+        return sum(self._call_all('get_memory_usage', start_token, stop_token))
+
+    def purge_tombstones(self, now=None, batch_size=1000):
+        return sum(self._call_all('purge_tombstones', now, batch_size))
+
+    def expire_keys(self, now=None, batch_size=1000):
+        return sum(self._call_all('expire_keys', now, batch_size))
+
+    # ------------- snapshots -------------
+
+    @staticmethod
+    def _shard_path(path, shard):
+        return '{}.{}'.format(path, shard.idx)
+
+    @property
+    def is_loading_snapshot(self):
+        return any(self._call_all('attribute', 'is_loading_snapshot'))
+
+    def write_snapshot(self, path):
+        self._call_concurrently([(s, 'write_snapshot', (self._shard_path(path, s),)) for s in self.shards])
+
+    def load_snapshot(self, path):
+        for shard in self.shards:
+            shard_path = self._shard_path(path, shard)
+            if os.path.exists(shard_path):
+                shard.call('load_snapshot', shard_path)
+
+    def rebuild_from_snapshot(self, batch_size=1000):
+        """
+        rebuilds the workers a batch at a time, so the shard's lock is
+        released between batches, and requests for the shard's keys don't
+        wait for the whole rebuild
+        """
+        def _rebuild(shard):
+            while not shard.call('rebuild_snapshot_batch', batch_size):
+                # let greenlets waiting on the shard have a turn
+                gevent.sleep(0)
+
+        gevent.joinall([gevent.spawn(_rebuild, s) for s in self.shards], raise_error=True)
+
+
+def _worker_main():
+    sock = _socket.fromfd(0, _socket.AF_UNIX, _socket.SOCK_STREAM)
+    os.close(0)
+    # the parent's gevent socket was non blocking
+    sock.setblocking(1)
+
+    method, (store_class, args, kwargs) = _recv_frame(sock)
+    assert method == '__init__'
+    worker = ShardWorker(store_class(*args, **kwargs))
+    _send_frame(sock, (True, None))
+    worker.serve(sock)
+
+
+if __name__ == '__main__':
+    _worker_main()
@@ -0,0 +1,124 @@
+import mmap
+import os
+import struct
+
+from kickboxer.store.records import write_record, read_records
+
+
+class SnapshotException(Exception): pass
+
+
+class Snapshot(object):
+    """
+    a point in time copy of a store's values, in a token sorted
+    binary layout that can be read through a memory map, without
+    loading it first
+
+    file layout:
+    [magic (8b)][record count (8b)][index offset (8b)]
+    [records][index]
+
+    records are length prefixed [key, data, timestamp, expires] lists
+    (see kickboxer.store.records), sorted by token, then by key. The index
+    has a fixed width entry per record:
+    [token high bits (8b)][token low bits (8b)][record offset (8b)]
+    so lookups are a binary search over the mapped index
+    """
+
+    magic = 'KBSNAP01'
+    header = struct.Struct('!8sQQ')
+    index_entry = struct.Struct('!QQQ')
+
+    def __init__(self, path, partitioner):
+        """
+        :param path:
+        :param partitioner:
+        :type partitioner: kickboxer.partitioner.base.BasePartitioner
+        """
+        super(Snapshot, self).__init__()
+        self.path = path
+        self.partitioner = partitioner
+
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.num_records, self._index_offset = self.header.unpack_from(self._map, 0)
+        if magic != self.magic:
+            raise SnapshotException('{} is not a snapshot file'.format(path))
+
+    def __len__(self):
+        return self.num_records
+
+    @staticmethod
+    def _split_token(token):
+        return token >> 64, token & 0xffffffffffffffff
+
+    @classmethod
+    def write(cls, path, items):
+        """
+        writes a snapshot file
+
+        :param items: (token, key, value) tuples, sorted by token, then key
+        """
+        tmp_path = path + '.tmp'
+        index = []
+        with open(tmp_path, 'wb') as f:
+            f.write(cls.header.pack(cls.magic, 0, 0))
+            offset = cls.header.size
+            for token, key, value in items:
+                index.append((token, offset))
+                offset += write_record(f, [key, value.data, value.timestamp, value.expires])
+
+            for token, record_offset in index:
+                f.write(cls.index_entry.pack(*(cls._split_token(token) + (record_offset,))))
+
+            f.seek(0)
+            f.write(cls.header.pack(cls.magic, len(index), offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, path)
+
+    @staticmethod
+    def _value_fields(record):
+        # records written before expiry was added don't have the expires field
+        data, timestamp = record[1:3]
+        return data, timestamp, record[3] if len(record) > 3 else None
+
+    def _index_token(self, idx):
+        high, low, _ = self.index_entry.unpack_from(self._map, self._index_offset + (idx * self.index_entry.size))
+        return (high << 64) | low
+
+    def _record_offset(self, idx):
+        return self.index_entry.unpack_from(self._map, self._index_offset + (idx * self.index_entry.size))[2]
+
+    def get(self, key):
+        """
+        returns a (data, timestamp, expires) tuple for the given key, or None
+        """
+        token = self.partitioner.get_key_token(key)
+
+        # find the first index entry for the token
+        lo, hi = 0, self.num_records
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._index_token(mid) < token:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        # then check each key with the same token
+        idx = lo
+        while idx < self.num_records and self._index_token(idx) == token:
+            _, record = next(read_records(self._map, self._record_offset(idx), self._index_offset))
+            if record[0] == key:
+                return self._value_fields(record)
+            idx += 1
+        return None
+
+    def iter_items(self):
+        """ yields (key, data, timestamp, expires) tuples for every record, in token order """
+        for _, record in read_records(self._map, self.header.size, self._index_offset):
+            yield (record[0],) + self._value_fields(record)
+
+    def close(self):
+        self._map.close()
@@ -1,6 +1,13 @@
 from datetime import datetime, timedelta
 import time
 
+import gevent
+from mock import patch
+
+from kickboxer.cluster import messages
+from kickboxer.cluster.cluster import Cluster
+from kickboxer.cluster.node.remote import RemoteNode
+
 from kickboxer.tests.base import BaseNodeTestCase
 
 
@@ -81,8 +88,92 @@ class GetTest(BaseClusteredStorageTest):
             else:
                 self.assertIsNone(val)
 
+    def test_digest_reads(self):
+        """ full values should only be read from one replica when the digests agree """
+        self.create_nodes(10)
+        for node in self.nodes:
+            node.start()
+        time.sleep(0.01)
+        ts = datetime.utcnow()
+        for node in self.nodes:
+            if node.replicates_key('a'):
+                node.cluster.store.set('a', 'b', timestamp=ts)
+
+        sent = []
+        send_message = RemoteNode.send_message
+
+        def _send_message(node, message, *args, **kwargs):
+            sent.append(type(message))
+            return send_message(node, message, *args, **kwargs)
+
+        node0 = [n for n in self.nodes if not n.replicates_key('a')][0]
+        with patch.object(RemoteNode, 'send_message', _send_message):
+            val = node0.cluster.execute_retrieval_instruction(
+                'get', 'a', [], consistency=Cluster.ConsistencyLevel.ALL, synchronous=True
+            )
+        self.assertEqual(val, 'b')
+        self.assertEqual(sent.count(messages.RetrievalValueRequest), 1)
+        self.assertEqual(sent.count(messages.RetrievalDigestRequest), 2)
+        self.assertEqual(node0.cluster.metrics['digest_mismatches'], 0)
+
+        # mismatched digests should fall back to reading full values
+        replica = [n for n in self.nodes if n.replicates_key('a')][-1]
+        replica.cluster.store.set('a', 'c', timestamp=ts + timedelta(seconds=1))
+        val = node0.cluster.execute_retrieval_instruction(
+            'get', 'a', [], consistency=Cluster.ConsistencyLevel.ALL, synchronous=True
+        )
+        self.assertEqual(val, 'c')
+        self.assertEqual(node0.cluster.metrics['digest_mismatches'], 1)
+
+    def test_late_digest_mismatches_are_read_at_the_requested_consistency(self):
+        """ a mismatched digest that arrives after the read returns shouldn't escalate to reading every replica """
+        self.create_nodes(10)
+        for node in self.nodes:
+            node.start()
+        time.sleep(0.01)
+        ts = datetime.utcnow()
+        replicas = [n for n in self.nodes if n.replicates_key('a')]
+        for node in replicas:
+            node.cluster.store.set('a', 'b', timestamp=ts)
+
+        node0 = [n for n in self.nodes if not n.replicates_key('a')][0]
+        # full values are read from the first replica, and digests from the rest
+        data_node_id = node0.cluster.get_nodes_for_key('a')[0].node_id
+        stale = [n for n in replicas if n.node_id != data_node_id][-1]
+        stale.cluster.store._pop('a')
+
+        # the stale replica's digest arrives after the quorum has replied
+        peer = node0.cluster.get_node(stale.node_id)
+        execute = peer.execute_retrieval_instruction
+
+        def _execute(*args, **kwargs):
+            gevent.sleep(0.05)
+            return execute(*args, **kwargs)
+
+        consistencies = []
+        full_retrieval = Cluster._execute_full_retrieval
+
+        def _execute_full_retrieval(cluster, instruction, key, args, nodes, consistency, synchronous):
+            consistencies.append(consistency)
+            return full_retrieval(cluster, instruction, key, args, nodes, consistency, synchronous)
+
+        with patch.object(peer, 'execute_retrieval_instruction', _execute), \
+                patch.object(Cluster, '_execute_full_retrieval', _execute_full_retrieval):
+            val = node0.cluster.execute_retrieval_instruction(
+                'get', 'a', [], consistency=Cluster.ConsistencyLevel.QUORUM, synchronous=True
+            )
+        self.assertEqual(val, 'b')
+        self.assertEqual(consistencies, [Cluster.ConsistencyLevel.QUORUM])
+        self.assertEqual(stale.cluster.store.get('a').data, 'b')
+
     def test_unknown_value(self):
-        pass
+        """ reading a key that no replica has should return None """
+        self.create_nodes(5)
+        for node in self.nodes:
+            node.start()
+        time.sleep(0.01)
+        for node in self.nodes:
+            self.assertIsNone(node.cluster.execute_retrieval_instruction('get', 'a', []))
 
     def test_value_resolution(self):
         pass
@@ -125,6 +216,108 @@ class SetTests(BaseClusteredStorageTest):
                 self.assertIsNone(val)
 
 
+    def test_expiry_is_distributed(self):
+        """ replicas should all agree on the expiry time of a value """
+        self.create_nodes(10)
+        for node in self.nodes:
+            node.start()
+        time.sleep(0.01)
+
+        node0 = self.nodes[0]
+        node0.cluster.execute_mutation_instruction('setex', 'a', [10, 'b'], synchronous=True)
+        values = [n.cluster.store.get('a') for n in self.nodes if n.replicates_key('a')]
+        self.assertEqual(len(values), 3)
+        self.assertIsNotNone(values[0].expires)
+        for value in values:
+            self.assertEqual(value, values[0])
+
+
+class ShardedStoreTest(BaseClusteredStorageTest):
+
+    def test_sharded_nodes(self):
+        """ nodes with their stores split across workers should serve reads and writes """
+        for _ in range(3):
+            self.create_node(store_workers=2)
+        for node in self.nodes:
+            node.start()
+        time.sleep(0.01)
+
+        try:
+            keys = [str(i) for i in range(20)]
+            self.nodes[0].cluster.execute_batch_mutation_instruction('set', [(k, [k]) for k in keys], synchronous=True)
+            for key in keys:
+                self.assertEqual(self.nodes[1].cluster.execute_retrieval_instruction('get', key, []), key)
+            for node in self.nodes:
+                self.assertEqual(len(node.store.all_keys()), 20)
+        finally:
+            for node in self.nodes:
+                node.store.close()
+
+
+class BatchTest(BaseClusteredStorageTest):
+
+    def setUp(self):
+        super(BatchTest, self).setUp()
+        self.create_nodes(10)
+        for node in self.nodes:
+            node.start()
+        time.sleep(0.01)
+        self.keys = [str(i) for i in range(20)]
+
+    def test_batch_set_is_distributed(self):
+        """ values set in a batch should be distributed to each key's replicas """
+        node0 = self.nodes[0]
+        result = node0.cluster.execute_batch_mutation_instruction(
+            'set', [(k, [k + 'v']) for k in self.keys], synchronous=True
+        )
+        self.assertEqual(sorted(result.keys()), sorted(self.keys))
+
+        for key in self.keys:
+            for node in self.nodes:
+                val = node.cluster.store.get(key)
+                if node.replicates_key(key):
+                    self.assertEqual(val.data, key + 'v')
+                else:
+                    self.assertIsNone(val)
+
+    def test_batch_get(self):
+        """ batch gets should resolve each key, and return None for unknown keys """
+        ts = datetime.utcnow()
+        for key in self.keys:
+            for i, node in enumerate([n for n in self.nodes if n.replicates_key(key)]):
+                node.cluster.store.set(key, '{}-{}'.format(key, i), timestamp=ts + timedelta(seconds=i))
+
+        result = self.nodes[0].cluster.execute_batch_retrieval_instruction(
+            'get', self.keys + ['missing'], [], consistency=Cluster.ConsistencyLevel.ALL, synchronous=True
+        )
+        self.assertIsNone(result['missing'])
+        for key in self.keys:
+            self.assertEqual(result[key], '{}-2'.format(key))
+
+        # out of date replicas should have been repaired
+        for key in self.keys:
+            for node in self.nodes:
+                if node.replicates_key(key):
+                    self.assertEqual(node.cluster.store.get(key).data, '{}-2'.format(key))
+
+    def test_one_message_per_node(self):
+        """ a batch should send at most one request to each remote node """
+        sent = []
+        send_message = RemoteNode.send_message
+
+        def _send_message(node, message, *args, **kwargs):
+            sent.append((node.node_id, type(message)))
+            return send_message(node, message, *args, **kwargs)
+
+        with patch.object(RemoteNode, 'send_message', _send_message):
+            self.nodes[0].cluster.execute_batch_mutation_instruction(
+                'set', [(k, ['v']) for k in self.keys], synchronous=True
+            )
+        self.assertTrue(sent)
+        self.assertEqual(len(sent), len(set(sent)))
+        self.assertEqual({t for _, t in sent}, {messages.BatchMutationRequest})
+
+
 class DeleteTest(BaseClusteredStorageTest):
 
     def test_delete_is_distributed(self):
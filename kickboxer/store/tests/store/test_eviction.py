@@ -0,0 +1,105 @@
+from unittest import TestCase
+
+from kickboxer.store.redis import RedisStore, Value, approximate_size
+from kickboxer.utils import now_timestamp
+
+from kickboxer.tests.base import LiteralPartitioner
+
+
+class MemoryAccountingTest(TestCase):
+
+    def setUp(self):
+        super(MemoryAccountingTest, self).setUp()
+        self.store = RedisStore(LiteralPartitioner())
+        self.ts = now_timestamp()
+
+    def test_used_memory(self):
+        """ used memory should follow values as they're written and removed """
+        self.store.set('1', 'a', self.ts)
+        self.assertEqual(self.store.used_memory, approximate_size('1', Value('a', self.ts)))
+        self.store.set('1', 'a' * 1000, self.ts + 1)
+        self.assertEqual(self.store.used_memory, approximate_size('1', Value('a' * 1000, self.ts)))
+
+        for i in range(2, 100):
+            self.store.set(str(i), 'a', self.ts)
+        self.store.remove_token_range(0, 49)
+        expected = sum(approximate_size(k, v) for k, v in self.store._data.items())
+        self.assertEqual(self.store.used_memory, expected)
+
+    def test_memory_usage_by_token_range(self):
+        for i in range(0, 10000, 10):
+            self.store.set(str(i), 'a', self.ts)
+        # ranges are rounded out to the merkle tree leaves
+        middle = self.store.merkle_tree.node_range(1, 1)[0]
+        low = self.store.get_memory_usage(0, middle - 1)
+        high = self.store.get_memory_usage(middle, 10000)
+        self.assertEqual(low + high, self.store.used_memory)
+        self.assertEqual(self.store.get_memory_usage(), self.store.used_memory)
+        self.assertTrue(0 < low < self.store.used_memory)
+
+
+class EvictionTest(TestCase):
+
+    def setUp(self):
+        super(EvictionTest, self).setUp()
+        self.ts = now_timestamp()
+        self.value_size = approximate_size('10', Value('a', self.ts))
+
+    def fill_store(self, store, num_keys):
+        for i in range(num_keys):
+            store.set(str(i), 'a', self.ts)
+
+    def test_maxmemory_is_enforced(self):
+        store = RedisStore(LiteralPartitioner(), maxmemory=self.value_size * 50)
+        self.fill_store(store, 100)
+        self.assertTrue(store.used_memory <= store.maxmemory)
+        self.assertEqual(len(store._data) + store.metrics['evicted_keys'], 100)
+        # the key that was just written shouldn't be evicted
+        self.assertIn('99', store._data)
+
+    def test_lru_eviction(self):
+        """ the least recently used of the sampled keys should be evicted """
+        store = RedisStore(LiteralPartitioner(), maxmemory=self.value_size * 10)
+        store.eviction_samples = 100
+        self.fill_store(store, 10)
+        for i in range(10):
+            store._data[str(i)].access = 100 - i
+
+        store.set('10', 'a', self.ts)
+        self.assertNotIn('9', store._data)
+        self.assertEqual(len(store._data), 10)
+
+    def test_lfu_eviction(self):
+        """ the least frequently used of the sampled keys should be evicted """
+        store = RedisStore(
+            LiteralPartitioner(),
+            maxmemory=self.value_size * 10,
+            eviction_policy=RedisStore.EvictionPolicy.LFU
+        )
+        store.eviction_samples = 100
+        store.lfu_log_factor = 0
+        self.fill_store(store, 10)
+        for i in range(10):
+            if i != 3:
+                store.get(str(i))
+
+        store.set('10', 'a', self.ts)
+        self.assertNotIn('3', store._data)
+
+    def test_evicted_keys_are_not_resurrected(self):
+        """ writes that aren't newer than an evicted value should be ignored """
+        store = RedisStore(LiteralPartitioner(), maxmemory=self.value_size * 10)
+        store.eviction_samples = 100
+        self.fill_store(store, 10)
+        store._data['0'].access = 0
+        store.set('10', 'a', self.ts)
+        self.assertNotIn('0', store._data)
+
+        # read repair, or streaming the evicted value back
+        store.set('0', 'a', self.ts)
+        store.set_and_reconcile_raw_value('0', Value('a', self.ts))
+        self.assertNotIn('0', store._data)
+
+        # new writes are accepted
+        store.set('0', 'b', self.ts + 1)
+        self.assertEqual(store.get('0').data, 'b')
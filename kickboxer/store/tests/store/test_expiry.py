@@ -0,0 +1,122 @@
+import shutil
+import tempfile
+from unittest import TestCase
+
+from kickboxer.store.lsm import LogStructuredStore
+from kickboxer.store.redis import RedisStore, Value
+from kickboxer.store.timing_wheel import TimingWheel
+from kickboxer.utils import now_timestamp
+
+from kickboxer.tests.base import LiteralPartitioner
+
+
+SECOND = 1000000
+
+
+class TimingWheelTest(TestCase):
+
+    def test_items_are_returned_once_due(self):
+        """ items should come out on the first advance past their deadline, across every wheel """
+        wheel = TimingWheel(0, tick=1, wheel_bits=2, num_wheels=3)
+        deadlines = [1, 3, 4, 5, 17, 63, 64, 100, 1000]
+        for deadline in deadlines:
+            wheel.schedule(deadline, deadline)
+        self.assertEqual(len(wheel), len(deadlines))
+
+        expired = []
+        for now in range(1, 1001):
+            due = wheel.advance(now)
+            for deadline, item in due:
+                self.assertEqual(deadline, now)
+            expired.extend(item for _, item in due)
+        self.assertEqual(expired, deadlines)
+        self.assertEqual(len(wheel), 0)
+
+    def test_past_deadlines(self):
+        """ items scheduled in the past should be returned on the next advance """
+        wheel = TimingWheel(100 * SECOND)
+        wheel.schedule('a', 50 * SECOND)
+        self.assertEqual(wheel.advance(100 * SECOND), [])
+        self.assertEqual(wheel.advance(101 * SECOND), [(50 * SECOND, 'a')])
+
+    def test_large_jumps(self):
+        wheel = TimingWheel(0, tick=1, wheel_bits=2, num_wheels=2)
+        wheel.schedule('a', 10)
+        wheel.schedule('b', 500)
+        self.assertEqual(wheel.advance(1000), [(10, 'a'), (500, 'b')])
+
+
+class ExpiryTest(TestCase):
+
+    def setUp(self):
+        super(ExpiryTest, self).setUp()
+        self.store = RedisStore(LiteralPartitioner())
+        self.ts = now_timestamp()
+
+    def test_setex(self):
+        self.store.setex('1', 10, 'a', self.ts)
+        value = self.store.get('1')
+        self.assertEqual(value.data, 'a')
+        self.assertEqual(value.expires, self.ts + (10 * SECOND))
+
+    def test_expire(self):
+        """ expire should rewrite existing values with an expiry time """
+        self.assertFalse(self.store.expire('1', 10, self.ts))
+        self.store.set('1', 'a', self.ts)
+        self.assertTrue(self.store.expire('1', 10, self.ts + 1))
+        value = self.store.get('1')
+        self.assertEqual(value, Value('a', self.ts + 1, self.ts + 1 + (10 * SECOND)))
+
+        # a newer write should clear the expiry time
+        self.store.set('1', 'b', self.ts + 2)
+        self.assertIsNone(self.store.get('1').expires)
+
+    def test_lazy_expiry(self):
+        """ expired values should be replaced with tombstones when they're read """
+        self.store.setex('1', 1, 'a', self.ts - (2 * SECOND))
+        value = self.store.get('1')
+        self.assertIsNone(value.data)
+        self.assertEqual(value.timestamp, self.ts - SECOND)
+        self.assertIsNone(self.store._data['1'].data)
+        self.assertEqual(self.store.metrics['keys_expired'], 1)
+
+    def test_expire_keys(self):
+        """ the timing wheel should expire values that are never read """
+        self.store.setex('1', 5, 'a', self.ts)
+        self.store.setex('2', 10, 'b', self.ts)
+        self.store.setex('3', 5, 'c', self.ts)
+        self.store.set('3', 'd', self.ts + 1)
+
+        self.assertEqual(self.store.expire_keys(self.ts + (6 * SECOND)), 1)
+        self.assertIsNone(self.store._data['1'].data)
+        self.assertEqual(self.store._data['2'].data, 'b')
+        self.assertEqual(self.store._data['3'].data, 'd')
+
+        self.assertEqual(self.store.expire_keys(self.ts + (11 * SECOND)), 1)
+        self.assertIsNone(self.store._data['2'].data)
+
+    def test_read_repair_keeps_expiry(self):
+        value = Value('a', self.ts, self.ts + (10 * SECOND))
+        instructions = RedisStore.resolve_get_instructions('1', [], {'n1': value, 'n2': None})
+        instruction = instructions['n2'][0]
+        self.assertEqual(instruction.instruction, 'setex')
+        self.store.setex('1', *instruction.args, timestamp=instruction.timestamp)
+        self.assertEqual(self.store.get('1'), value)
+
+    def test_expiry_is_persisted(self):
+        data_dir = tempfile.mkdtemp()
+        try:
+            store = LogStructuredStore(LiteralPartitioner(), data_dir, memtable_size=2)
+            store.setex('1', 10, 'a', self.ts)
+            store.setex('2', 20, 'b', self.ts)
+            store.setex('3', 30, 'c', self.ts)
+            store.close()
+
+            store = LogStructuredStore(LiteralPartitioner(), data_dir, memtable_size=2)
+            self.assertEqual(store.get('1').expires, self.ts + (10 * SECOND))
+            self.assertEqual(store.get('3').expires, self.ts + (30 * SECOND))
+            self.assertEqual(store.expire_keys(self.ts + (25 * SECOND)), 2)
+            self.assertIsNone(store.get('2').data)
+            store.close()
+        finally:
+            shutil.rmtree(data_dir)
@@ -3,7 +3,7 @@ from unittest import TestCase
 
 from kickboxer.partitioner.md5 import MD5Partitioner
 from kickboxer.store.redis import RedisStore, Value
-from kickboxer.utils import serialize_timestamp, deserialize_timestamp
+from kickboxer.utils import serialize_timestamp
 
 
 class ValueTests(TestCase):
@@ -11,12 +11,29 @@ class ValueTests(TestCase):
     def test_serialization(self):
         ts = datetime.utcnow()
         val = Value('a', ts)
-        assert val.serialize(), ('a', serialize_timestamp(ts))
+        self.assertEqual(val.serialize(), ('a', serialize_timestamp(ts)))
 
     def test_deserialization(self):
         val = Value.deserialize(('a', 123))
         assert val.data == 'a'
-        assert val.timestamp == deserialize_timestamp(123)
+        assert val.timestamp == 123
+
+    def test_timestamps_are_stored_as_microseconds(self):
+        ts = datetime.utcnow()
+        val = Value('a', ts)
+        self.assertEqual(val.timestamp, serialize_timestamp(ts))
+        self.assertEqual(Value('a', 123).timestamp, 123)
+
+    def test_values_are_slotted(self):
+        val = Value('a', 123)
+        self.assertFalse(hasattr(val, '__dict__'))
+
+    def test_digests_dont_depend_on_types(self):
+        """ equal values should have the same digest, however they were built """
+        digest = RedisStore.digest(Value('a', 123))
+        self.assertEqual(RedisStore.digest(Value('a', 123L)), digest)
+        self.assertEqual(RedisStore.digest(Value.deserialize(['a', 123])), digest)
+        self.assertNotEqual(RedisStore.digest(Value('a', 124)), digest)
 
 
 class StoreTests(TestCase):
@@ -30,7 +47,7 @@ class StoreTests(TestCase):
         self.store.set('a', 'b', timestamp=ts)
         val = self.store._data['a']
         assert val.data == 'b'
-        assert val.timestamp == ts
+        assert val.timestamp == serialize_timestamp(ts)
 
     def test_conflicting_set(self):
         """
@@ -49,7 +66,7 @@ class StoreTests(TestCase):
         self.store.set('a', 'b', timestamp=ts)
         val = self.store.get('a')
         assert val.data == 'b'
-        assert val.timestamp == ts
+        assert val.timestamp == serialize_timestamp(ts)
 
     def test_delete(self):
         self.store.set('a', 'b', datetime.utcnow())
@@ -57,7 +74,7 @@ class StoreTests(TestCase):
         self.store.delete('a', timestamp=ts)
         val = self.store.get('a')
         assert val.data is None
-        assert val.timestamp == ts
+        assert val.timestamp == serialize_timestamp(ts)
 
     def test_value_resolution(self):
         ts = datetime.utcnow()
@@ -65,7 +82,7 @@ class StoreTests(TestCase):
         values = [Value(i, ts + timedelta(seconds=i)) for i in range(num_values)]
         val = RedisStore.resolve(values)
         assert val.data == num_values - 1
-        assert val.timestamp == ts + timedelta(seconds=num_values-1)
+        assert val.timestamp == serialize_timestamp(ts + timedelta(seconds=num_values-1))
 
 class TokenTests(TestCase):
 
@@ -0,0 +1,172 @@
+from datetime import datetime, timedelta
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from kickboxer.store.lsm import LogStructuredStore
+from kickboxer.utils import serialize_timestamp
+
+from kickboxer.tests.base import LiteralPartitioner
+
+
+class LogStructuredStoreTest(TestCase):
+
+    def setUp(self):
+        super(LogStructuredStoreTest, self).setUp()
+        self.data_dir = tempfile.mkdtemp()
+        self.stores = []
+
+    def tearDown(self):
+        super(LogStructuredStoreTest, self).tearDown()
+        for store in self.stores:
+            store.close()
+        shutil.rmtree(self.data_dir)
+
+    def open_store(self, **kwargs):
+        store = LogStructuredStore(LiteralPartitioner(), self.data_dir, **kwargs)
+        self.stores.append(store)
+        return store
+
+    def segment_files(self):
+        return [f for f in os.listdir(self.data_dir) if f.startswith('segment-')]
+
+    def test_commit_log_is_replayed(self):
+        ts = datetime.utcnow()
+        store = self.open_store()
+        for i in range(100):
+            store.set(str(i), str(i), ts)
+        store.delete('5', ts + timedelta(seconds=1))
+        self.assertEqual(self.segment_files(), [])
+        store.close()
+
+        store = self.open_store()
+        self.assertTrue(store.recovered)
+        self.assertEqual(len(store.all_keys()), 100)
+        self.assertEqual(store.get('10').data, '10')
+        self.assertEqual(store.get('10').timestamp, serialize_timestamp(ts))
+        self.assertIsNone(store.get('5').data)
+
+    def test_memtable_is_flushed_to_segments(self):
+        ts = datetime.utcnow()
+        store = self.open_store(memtable_size=10, compaction_threshold=100)
+        for i in range(95):
+            store.set(str(i), str(i), ts)
+        self.assertEqual(len(self.segment_files()), 9)
+        self.assertEqual(len(store._data), 5)
+
+        # newer values in the memtable should shadow segment values
+        store.set('3', 'x', ts + timedelta(seconds=1))
+        # and older values shouldn't be written
+        store.set('4', 'y', ts - timedelta(seconds=1))
+        self.assertEqual(store.get('3').data, 'x')
+        self.assertEqual(store.get('4').data, '4')
+
+        store.close()
+        store = self.open_store(memtable_size=10, compaction_threshold=100)
+        self.assertEqual(len(store.all_keys()), 95)
+        self.assertEqual(store.get('3').data, 'x')
+        self.assertEqual(store.get('94').data, '94')
+
+    def test_compaction(self):
+        ts = datetime.utcnow()
+        store = self.open_store(memtable_size=10, compaction_threshold=3)
+        for i in range(10):
+            store.set(str(i), 'old', ts)
+        for i in range(10):
+            store.set(str(i), 'new', ts + timedelta(seconds=1))
+        for i in range(10, 20):
+            store.set(str(i), 'new', ts)
+
+        self.assertEqual(len(self.segment_files()), 1)
+        self.assertEqual(len(store._segments), 1)
+        self.assertEqual(store._segments[0].num_records, 20)
+        for i in range(20):
+            self.assertEqual(store.get(str(i)).data, 'new')
+
+    def test_token_range_spans_memtable_and_segments(self):
+        ts = datetime.utcnow()
+        store = self.open_store(memtable_size=50, compaction_threshold=100)
+        for i in range(0, 200, 2):
+            store.set(str(i), str(i), ts)
+        for i in range(1, 200, 2):
+            store.set(str(i), str(i), ts)
+
+        results = store.get_token_range(100, 119, 10)
+        self.assertEqual([k for k, _ in results], [str(i) for i in range(100, 110)])
+
+        scan = store.scan_token_range(100, 149)
+        first_page = [next(scan)[1] for _ in range(10)]
+        self.assertEqual(first_page, [str(i) for i in range(100, 110)])
+        resumed = store.scan_token_range(100, 149, cursor=scan.cursor)
+        self.assertEqual([k for _, k, _ in resumed], [str(i) for i in range(110, 150)])
+
+    def test_removed_token_range_stays_removed(self):
+        ts = datetime.utcnow()
+        store = self.open_store(memtable_size=30, compaction_threshold=100)
+        for i in range(100):
+            store.set(str(i), str(i), ts)
+        store.remove_token_range(10, 59)
+        self.assertIsNone(store.get('10'))
+        self.assertIsNone(store.get('59'))
+        self.assertEqual(store.get('60').data, '60')
+
+        store.close()
+        store = self.open_store(memtable_size=30, compaction_threshold=100)
+        self.assertEqual(sorted(int(k) for k in store.all_keys()), range(10) + range(60, 100))
+
+    def test_removing_a_token_range_doesnt_rewrite_segments(self):
+        """ removed ranges should be skipped by reads, and dropped by the next compaction """
+        ts = datetime.utcnow()
+        store = self.open_store(memtable_size=30, compaction_threshold=100)
+        for i in range(90):
+            store.set(str(i), str(i), ts)
+        segments = sorted(self.segment_files())
+        store.remove_token_range(10, 59)
+        self.assertEqual(sorted(self.segment_files()), segments)
+        self.assertEqual([k for _, k, _ in store.scan_token_range(0, 19)], [str(i) for i in range(10)])
+
+        # values written after the removal are kept
+        store.set('20', 'new', ts)
+        store.flush()
+        store.close()
+        store = self.open_store(memtable_size=30, compaction_threshold=100)
+        self.assertEqual(store.get('20').data, 'new')
+        self.assertIsNone(store.get('21'))
+        self.assertEqual(sorted(int(k) for k in store.all_keys()), range(10) + [20] + range(60, 90))
+
+        store.compact()
+        self.assertEqual(store._segments[0].num_records, 41)
+        self.assertFalse(os.path.exists(store.removed_ranges_path))
+        self.assertEqual(store.get('20').data, 'new')
+
+    def test_torn_commit_log_record(self):
+        """ records written after a torn record should survive the next restarts """
+        ts = datetime.utcnow()
+        store = self.open_store()
+        for i in range(10):
+            store.set(str(i), str(i), ts)
+        store.close()
+        with open(store.commit_log_path, 'r+b') as f:
+            f.truncate(os.path.getsize(store.commit_log_path) - 3)
+
+        store = self.open_store()
+        self.assertIsNone(store.get('9'))
+        store.set('10', '10', ts)
+        store.close()
+
+        for _ in range(2):
+            store = self.open_store()
+            self.assertEqual(sorted(int(k) for k in store.all_keys()), range(9) + [10])
+            store.close()
+
+    def test_scans_continue_across_flushes(self):
+        ts = datetime.utcnow()
+        store = self.open_store(memtable_size=1000, compaction_threshold=100)
+        for i in range(100):
+            store.set(str(i), str(i), ts)
+        scan = store.scan_token_range(0, 99)
+        keys = [next(scan)[1] for _ in range(10)]
+        store.flush()
+        keys.extend(k for _, k, _ in scan)
+        self.assertEqual(keys, [str(i) for i in range(100)])
@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta
+import shutil
+import tempfile
+from unittest import TestCase
+
+from kickboxer.store.lsm import LogStructuredStore
+from kickboxer.store.merkle import MerkleTree
+from kickboxer.store.redis import RedisStore, Value
+
+from kickboxer.tests.base import LiteralPartitioner
+
+
+class MerkleTreeTest(TestCase):
+
+    def test_node_ranges_cover_token_space(self):
+        """ each level's nodes should cover every token exactly once """
+        tree = MerkleTree(10000, depth=4)
+        for level in range(tree.depth + 1):
+            last_stop = -1
+            for idx in range(1 << level):
+                start, stop = tree.node_range(level, idx)
+                self.assertEqual(start, last_stop + 1)
+                last_stop = stop
+            self.assertEqual(last_stop, 10000)
+
+        for token in (0, 624, 625, 9999, 10000):
+            start, stop = tree.node_range(tree.depth, tree.leaf_for_token(token))
+            self.assertTrue(start <= token <= stop)
+
+    def test_updates_are_incremental(self):
+        """ updating values in place should match hashing the final values from scratch """
+        tree = MerkleTree(10000, depth=4)
+        expected = MerkleTree(10000, depth=4)
+        for i in range(100):
+            tree.update(i * 100, str(i), None, Value('a', 1))
+        for i in range(100):
+            tree.update(i * 100, str(i), Value('a', 1), Value('b', 2))
+            expected.update(i * 100, str(i), None, Value('b', 2))
+        tree.update(0, '0', Value('b', 2), None)
+        expected.update(0, '0', Value('b', 2), None)
+
+        self.assertEqual(tree._levels, expected._levels)
+        tree.reset_leaf(0)
+        self.assertEqual(tree.get_hash(tree.depth, 0), 0)
+
+
+class StoreMerkleTreeTest(TestCase):
+
+    def setUp(self):
+        super(StoreMerkleTreeTest, self).setUp()
+        self.ts = datetime.utcnow()
+
+    def test_range_hashes(self):
+        """ stores should agree on the hashes of ranges they have the same data for """
+        store1 = RedisStore(LiteralPartitioner())
+        store2 = RedisStore(LiteralPartitioner())
+        for i in range(0, 10000, 7):
+            store1.set(str(i), str(i), self.ts)
+            store2.set(str(i), str(i), self.ts)
+        store1.set('1', 'x', self.ts)
+        store2.set('9998', 'y', self.ts)
+        store2.remove_token_range(5000, 5100)
+
+        self.assertNotEqual(store1.get_merkle_hash(0, 0), store2.get_merkle_hash(0, 0))
+        self.assertEqual(store1.get_merkle_hash(0, 0, 2, 4999), store2.get_merkle_hash(0, 0, 2, 4999))
+        self.assertEqual(store1.get_merkle_hash(0, 0, 5101, 9997), store2.get_merkle_hash(0, 0, 5101, 9997))
+        self.assertNotEqual(store1.get_merkle_hash(0, 0, 5000, 5100), store2.get_merkle_hash(0, 0, 5000, 5100))
+
+    def test_reconcile_keeps_newest_value(self):
+        store = RedisStore(LiteralPartitioner())
+        store.set('1', 'new', self.ts)
+        store.set_and_reconcile_raw_value('1', Value('old', self.ts - timedelta(seconds=1)))
+        self.assertEqual(store.get('1').data, 'new')
+        store.set_and_reconcile_raw_value('1', Value('newer', self.ts + timedelta(seconds=1)))
+        self.assertEqual(store.get('1').data, 'newer')
+
+    def test_log_structured_store_tree(self):
+        """ the tree should track the newest value across the memtable and segments """
+        data_dir = tempfile.mkdtemp()
+        try:
+            expected = RedisStore(LiteralPartitioner())
+            store = LogStructuredStore(LiteralPartitioner(), data_dir, memtable_size=10, compaction_threshold=100)
+            for i in range(50):
+                store.set(str(i), 'old', self.ts)
+            for i in range(0, 50, 3):
+                store.set(str(i), 'new', self.ts + timedelta(seconds=1))
+            store.remove_token_range(40, 44)
+            for _, key, value in store.scan_token_range(0, 10000):
+                expected.set(key, value.data, value.timestamp)
+            self.assertEqual(store.merkle_tree._levels, expected.merkle_tree._levels)
+
+            store.close()
+            store = LogStructuredStore(LiteralPartitioner(), data_dir, memtable_size=10, compaction_threshold=100)
+            self.assertEqual(store.merkle_tree._levels, expected.merkle_tree._levels)
+            store.close()
+        finally:
+            shutil.rmtree(data_dir)
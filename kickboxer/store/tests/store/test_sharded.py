@@ -0,0 +1,134 @@
+from datetime import datetime, timedelta
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import gevent
+
+from kickboxer.store.redis import RedisStore
+from kickboxer.store.sharded import ShardedStore
+
+from kickboxer.tests.base import LiteralPartitioner
+
+
+class ShardedStoreTest(TestCase):
+
+    def setUp(self):
+        super(ShardedStoreTest, self).setUp()
+        self.store = ShardedStore(LiteralPartitioner(), 3)
+        self.ts = datetime.utcnow()
+
+    def tearDown(self):
+        super(ShardedStoreTest, self).tearDown()
+        self.store.close()
+
+    def fill_store(self, store):
+        for i in range(0, 10000, 100):
+            store.set(str(i), str(i), self.ts)
+
+    def test_keys_are_routed_to_shards(self):
+        """ keys should be stored by the worker owning their token """
+        self.fill_store(self.store)
+        self.assertEqual(self.store.get('500').data, '500')
+        self.assertIn('500', self.store)
+        self.assertNotIn('501', self.store)
+        self.assertEqual(len(self.store.all_keys()), 100)
+
+        for shard in self.store.shards:
+            keys = shard.call('all_keys')
+            self.assertTrue(keys)
+            for key in keys:
+                self.assertTrue(shard.start_token <= int(key) <= shard.stop_token)
+
+        self.store.delete('500', self.ts + timedelta(seconds=1))
+        self.assertIsNone(self.store.get('500').data)
+
+    def test_token_range_scan(self):
+        """ scans should cross shards in token order, and resume from cursors """
+        self.fill_store(self.store)
+        self.assertEqual(
+            [k for k, _ in self.store.get_token_range(3000, 7000, 100)],
+            [str(i) for i in range(3000, 7001, 100)]
+        )
+
+        scan = self.store.scan_token_range(0, 10000)
+        first_page = [next(scan)[1] for _ in range(50)]
+        self.assertEqual(first_page, [str(i) for i in range(0, 5000, 100)])
+        resumed = self.store.scan_token_range(0, 10000, cursor=scan.cursor)
+        self.assertEqual([k for _, k, _ in resumed], [str(i) for i in range(5000, 10000, 100)])
+
+        self.store.remove_token_range(2000, 8000)
+        self.assertEqual(len(self.store.all_keys()), 39)
+
+    def test_batches(self):
+        keys = [str(i) for i in range(0, 10000, 250)]
+        mutations = [('set', k, [k], self.ts) for k in keys]
+        self.store.execute_batch_mutation(mutations)
+        values = self.store.execute_batch_retrieval('get', keys + ['1'], [])
+        self.assertEqual([v.data for v in values[:-1]], keys)
+        self.assertIsNone(values[-1])
+
+    def test_merkle_hashes_are_combined(self):
+        """ the combined hashes should match an unsharded store with the same data """
+        expected = RedisStore(LiteralPartitioner())
+        self.fill_store(expected)
+        self.fill_store(self.store)
+        self.assertEqual(self.store.get_merkle_hash(0, 0), expected.get_merkle_hash(0, 0))
+        self.assertEqual(self.store.get_merkle_hash(1, 1, 10, 9000), expected.get_merkle_hash(1, 1, 10, 9000))
+
+    def test_metrics_are_combined(self):
+        for shard_idx in range(3):
+            key = str(self.store.shards[shard_idx].start_token + 1)
+            self.store.setex(key, 1, 'a', self.ts - timedelta(seconds=2))
+            self.store.get(key)
+        self.assertEqual(self.store.metrics['keys_expired'], 3)
+
+    def test_worker_errors_are_raised(self):
+        with self.assertRaises(AttributeError):
+            self.store.shards[0].call('not_a_method')
+        # the worker should keep serving requests
+        self.assertEqual(self.store.shards[0].call('all_keys'), [])
+
+    def test_snapshots(self):
+        data_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(data_dir, 'snapshot')
+            self.fill_store(self.store)
+            self.store.write_snapshot(path)
+
+            store = ShardedStore(LiteralPartitioner(), 3)
+            try:
+                store.load_snapshot(path)
+                self.assertTrue(store.is_loading_snapshot)
+                self.assertEqual(store.get('500').data, '500')
+                store.rebuild_from_snapshot()
+                self.assertFalse(store.is_loading_snapshot)
+                self.assertEqual(len(store.all_keys()), 100)
+            finally:
+                store.close()
+        finally:
+            shutil.rmtree(data_dir)
+
+    def test_requests_are_served_during_snapshot_rebuilds(self):
+        """ rebuilding a shard shouldn't hold it's lock for the whole rebuild """
+        data_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(data_dir, 'snapshot')
+            self.fill_store(self.store)
+            self.store.write_snapshot(path)
+
+            store = ShardedStore(LiteralPartitioner(), 3)
+            try:
+                store.load_snapshot(path)
+                rebuild = gevent.spawn(store.rebuild_from_snapshot, batch_size=1)
+                gevent.sleep(0)
+                self.assertEqual(store.get('500').data, '500')
+                self.assertTrue(store.is_loading_snapshot)
+                rebuild.get(timeout=10)
+                self.assertFalse(store.is_loading_snapshot)
+                self.assertEqual(len(store.all_keys()), 100)
+            finally:
+                store.close()
+        finally:
+            shutil.rmtree(data_dir)
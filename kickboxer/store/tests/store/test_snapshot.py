@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from kickboxer.partitioner.md5 import MD5Partitioner
+from kickboxer.store.redis import RedisStore
+from kickboxer.store.snapshot import Snapshot, SnapshotException
+from kickboxer.utils import serialize_timestamp
+
+from kickboxer.tests.base import LiteralPartitioner
+
+
+class SnapshotTest(TestCase):
+
+    def setUp(self):
+        super(SnapshotTest, self).setUp()
+        self.data_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.data_dir, 'snapshot')
+        self.ts = datetime.utcnow()
+        self.store = RedisStore(LiteralPartitioner())
+        for i in range(100):
+            self.store.set(str(i), str(i), self.ts)
+        self.delete_ts = self.ts + timedelta(seconds=1)
+        self.store.delete('7', self.delete_ts)
+        self.store.write_snapshot(self.path)
+
+    def tearDown(self):
+        super(SnapshotTest, self).tearDown()
+        shutil.rmtree(self.data_dir)
+
+    def test_snapshot_lookups(self):
+        snapshot = Snapshot(self.path, LiteralPartitioner())
+        self.assertEqual(len(snapshot), 100)
+        self.assertEqual(snapshot.get('42'), ('42', serialize_timestamp(self.ts), None))
+        self.assertEqual(snapshot.get('7'), (None, serialize_timestamp(self.delete_ts), None))
+        self.assertIsNone(snapshot.get('100'))
+        self.assertEqual([k for k, _, _, _ in snapshot.iter_items()], [str(i) for i in range(100)])
+
+    def test_md5_tokens(self):
+        """ 128 bit tokens should survive the split index entries """
+        store = RedisStore(MD5Partitioner())
+        for i in range(100):
+            store.set(str(i), str(i), self.ts)
+        store.write_snapshot(self.path)
+        snapshot = Snapshot(self.path, MD5Partitioner())
+        for i in range(100):
+            self.assertEqual(snapshot.get(str(i))[0], str(i))
+
+    def test_invalid_file(self):
+        with open(self.path, 'wb') as f:
+            f.write('x' * 100)
+        with self.assertRaises(SnapshotException):
+            Snapshot(self.path, LiteralPartitioner())
+
+    def test_reads_are_served_while_loading(self):
+        store = RedisStore(LiteralPartitioner())
+        store.load_snapshot(self.path)
+        self.assertTrue(store.is_loading_snapshot)
+        self.assertEqual(len(store._data), 0)
+
+        self.assertEqual(store.get('42').data, '42')
+        self.assertIn('42', store)
+        self.assertIsNone(store.get('7').data)
+
+        # writes made while loading should win if they're newer
+        store.set('10', 'new', self.ts + timedelta(seconds=1))
+        store.set('11', 'old', self.ts - timedelta(seconds=1))
+        store.remove_token_range(20, 29)
+        self.assertIsNone(store.get('25'))
+
+        store.rebuild_from_snapshot(batch_size=10)
+        self.assertFalse(store.is_loading_snapshot)
+        self.assertEqual(len(store.all_keys()), 90)
+        self.assertEqual(store.get('10').data, 'new')
+        self.assertEqual(store.get('11').data, '11')
+        self.assertIsNone(store.get('25'))
+        self.assertEqual([k for k, _ in store.get_token_range(40, 49, 10)], [str(i) for i in range(40, 50)])
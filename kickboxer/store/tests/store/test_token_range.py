@@ -1,4 +1,5 @@
 from datetime import datetime
+from itertools import islice
 from unittest import TestCase
 
 from kickboxer.store.redis import RedisStore
@@ -23,3 +24,51 @@ class TokenRangeTest(TestCase):
             self.assertEqual(key, str(start_token + i))
             self.assertEqual(val.data, str(start_token + i))
 
+
+    def test_token_map_is_maintained(self):
+        """ the token index should track keys as they're added and removed """
+        ts = datetime.utcnow()
+        store = RedisStore(LiteralPartitioner())
+        for i in range(100):
+            store.set(str(i), str(i), ts)
+        store.delete('5', ts)
+        self.assertEqual(list(store.token_map.keys()), range(100))
+        self.assertEqual(store.token_map[5], {'5'})
+
+        store.remove_token_range(10, 19)
+        self.assertEqual(list(store.token_map.keys()), range(10) + range(20, 100))
+        self.assertNotIn('15', store)
+        self.assertIn('20', store)
+
+
+class TokenRangeScanTest(TestCase):
+
+    def setUp(self):
+        super(TokenRangeScanTest, self).setUp()
+        ts = datetime.utcnow()
+        self.store = RedisStore(LiteralPartitioner())
+        for i in range(1000):
+            self.store.set(str(i), str(i), ts)
+
+    def test_scan_is_lazy_and_ordered(self):
+        scan = self.store.scan_token_range(100, 199)
+        self.assertIsNone(scan.cursor)
+        results = list(scan)
+        self.assertEqual([t for t, _, _ in results], range(100, 200))
+        self.assertEqual([k for _, k, _ in results], [str(i) for i in range(100, 200)])
+        self.assertEqual(scan.cursor, (199, '199'))
+        self.assertTrue(scan.exhausted)
+
+    def test_scan_resumes_from_cursor(self):
+        scan = self.store.scan_token_range(100, 199)
+        first_page = [k for _, k, _ in islice(scan, 10)]
+        self.assertEqual(first_page, [str(i) for i in range(100, 110)])
+        self.assertFalse(scan.exhausted)
+
+        # writes between pages shouldn't affect the resumed scan
+        self.store.set('150', 'x', datetime.utcnow())
+        self.store.remove_token_range(111, 112)
+
+        resumed = self.store.scan_token_range(100, 199, cursor=scan.cursor)
+        keys = [k for _, k, _ in resumed]
+        self.assertEqual(keys, ['110'] + [str(i) for i in range(113, 200)])
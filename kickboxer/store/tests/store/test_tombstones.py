@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+import shutil
+import tempfile
+from unittest import TestCase
+
+from kickboxer.store.lsm import LogStructuredStore
+from kickboxer.store.redis import RedisStore
+from kickboxer.utils import serialize_timestamp
+
+from kickboxer.tests.base import LiteralPartitioner
+
+
+class TombstonePurgeTest(TestCase):
+
+    def setUp(self):
+        super(TombstonePurgeTest, self).setUp()
+        self.ts = datetime.utcnow()
+        self.store = RedisStore(LiteralPartitioner(), tombstone_grace_period=60)
+        for i in range(100):
+            self.store.set(str(i), str(i), self.ts)
+
+    def purge_at(self, seconds):
+        return self.store.purge_tombstones(now=serialize_timestamp(self.ts + timedelta(seconds=seconds)), batch_size=3)
+
+    def test_expired_tombstones_are_purged(self):
+        for i in range(10):
+            self.store.delete(str(i), self.ts + timedelta(seconds=i + 1))
+
+        # nothing has passed the grace period yet
+        self.assertEqual(self.purge_at(59), 0)
+        self.assertIn('0', self.store)
+
+        self.assertEqual(self.purge_at(65), 5)
+        for i in range(5):
+            self.assertNotIn(str(i), self.store)
+            self.assertNotIn(i, self.store.token_map)
+        self.assertIn('5', self.store)
+        self.assertEqual(self.store.metrics['tombstones_purged'], 5)
+        self.assertGreater(self.store.metrics['tombstone_bytes_reclaimed'], 0)
+        self.assertEqual(self.store.metrics['tombstones'], 5)
+
+        self.assertEqual(self.purge_at(100), 5)
+        self.assertEqual(len(self.store.all_keys()), 90)
+
+    def test_overwritten_tombstones_are_kept(self):
+        self.store.delete('1', self.ts + timedelta(seconds=1))
+        self.store.set('1', 'x', self.ts + timedelta(seconds=2))
+        self.store.delete('2', self.ts + timedelta(seconds=1))
+        self.store.delete('2', self.ts + timedelta(seconds=90))
+
+        self.assertEqual(self.purge_at(100), 0)
+        self.assertEqual(self.store.get('1').data, 'x')
+        self.assertIsNone(self.store.get('2').data)
+
+    def test_compaction_drops_expired_tombstones(self):
+        data_dir = tempfile.mkdtemp()
+        try:
+            store = LogStructuredStore(LiteralPartitioner(), data_dir, memtable_size=10, tombstone_grace_period=60)
+            old = datetime.utcnow() - timedelta(seconds=120)
+            for i in range(10):
+                store.set(str(i), str(i), old)
+            store.delete('1', old + timedelta(seconds=1))
+            store.delete('2', datetime.utcnow())
+            store.flush()
+            store.compact()
+            self.assertIsNone(store.get('1'))
+            self.assertIsNone(store.get('2').data)
+            self.assertEqual(store.metrics['tombstones_purged'], 1)
+            store.close()
+        finally:
+            shutil.rmtree(data_dir)
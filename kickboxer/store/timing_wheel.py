@@ -0,0 +1,104 @@
+class TimingWheel(object):
+    """
+    a hierarchical timing wheel, used to find items whose deadlines
+    have passed without scanning every scheduled item
+
+    time is split into ticks of `tick` microseconds. The first wheel
+    has a slot for each of the next `wheel_size` ticks, the second
+    wheel has a slot for each of the next `wheel_size` rotations of
+    the first wheel, and so on. When a wheel completes a rotation, the
+    items in the next wheel's current slot are cascaded down into the
+    finer grained wheels. Items further out than the last wheel can
+    hold are kept in an overflow list, and rescheduled each time the
+    last wheel rotates
+
+    scheduling and advancing past an item are both O(1), amortized
+    over the number of wheels. Items aren't removed when they're
+    rescheduled, it's up to the caller to ignore stale deadlines
+    """
+
+    def __init__(self, now, tick=1000000, wheel_bits=6, num_wheels=4):
+        """
+        :param now: the current time, in microseconds
+        :param tick: the resolution of the wheel, in microseconds
+        :param wheel_bits: each wheel has 2 ** wheel_bits slots
+        :param num_wheels:
+        """
+        super(TimingWheel, self).__init__()
+        self.tick = tick
+        self.wheel_bits = wheel_bits
+        self.wheel_size = 1 << wheel_bits
+        self.num_wheels = num_wheels
+        self.current_tick = now // tick
+
+        self._wheels = [[[] for _ in range(self.wheel_size)] for _ in range(num_wheels)]
+        self._overflow = []
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def _place(self, deadline_tick, entry):
+        mask = self.wheel_size - 1
+        for level in range(self.num_wheels):
+            shift = self.wheel_bits * level
+            if (deadline_tick >> shift) - (self.current_tick >> shift) < self.wheel_size:
+                self._wheels[level][(deadline_tick >> shift) & mask].append(entry)
+                return
+        self._overflow.append(entry)
+
+    def schedule(self, item, deadline):
+        """
+        schedules the item to be returned by `advance` once the
+        deadline, in microseconds, has passed
+        """
+        # items are due on the first tick at or after their deadline,
+        # and the current tick has already been processed
+        deadline_tick = max(-(-deadline // self.tick), self.current_tick + 1)
+        self._place(deadline_tick, (deadline_tick, deadline, item))
+        self._len += 1
+
+    def _cascade(self, level):
+        """ moves the items in the given wheel's current slot into the wheels below it """
+        if level < self.num_wheels:
+            shift = self.wheel_bits * level
+            slot = (self.current_tick >> shift) & (self.wheel_size - 1)
+            entries = self._wheels[level][slot]
+            self._wheels[level][slot] = []
+        else:
+            entries = self._overflow
+            self._overflow = []
+        for entry in entries:
+            self._place(entry[0], entry)
+
+    def advance(self, now):
+        """
+        moves the wheel forward to the given time, in microseconds
+
+        :return: a list of (deadline, item) tuples whose deadlines have passed
+        """
+        target_tick = now // self.tick
+        expired = []
+        mask = self.wheel_size - 1
+        while self.current_tick < target_tick:
+            if not self._len:
+                self.current_tick = target_tick
+                break
+            self.current_tick += 1
+
+            # cascade from the coarsest wheel that's completed a rotation
+            levels = []
+            for level in range(1, self.num_wheels + 1):
+                if (self.current_tick >> (self.wheel_bits * (level - 1))) & mask:
+                    break
+                levels.append(level)
+            for level in reversed(levels):
+                self._cascade(level)
+
+            slot = self.current_tick & mask
+            entries = self._wheels[0][slot]
+            if entries:
+                self._wheels[0][slot] = []
+                self._len -= len(entries)
+                expired.extend((deadline, item) for _, deadline, item in entries)
+        return expired
@@ -37,7 +37,9 @@ class BaseNodeTestCase(TestCase):
                     cluster_status=Cluster.Status.NORMAL,
                     token=None,
                     partitioner=_default_partitioner,
-                    name=None):
+                    name=None,
+                    store_workers=None,
+                    num_tokens=1):
         port = self.next_port
         self.next_port += 1
         if not seeds:
@@ -53,7 +55,9 @@ class BaseNodeTestCase(TestCase):
             node_id=node_id,
             cluster_status=cluster_status,
             token=token,
-            partitioner=partitioner
+            num_tokens=num_tokens,
+            partitioner=partitioner,
+            store_workers=store_workers
         )
         self.nodes.append(node)
         return node
@@ -62,7 +66,8 @@ class BaseNodeTestCase(TestCase):
                      num_nodes,
                      cluster_status=Cluster.Status.NORMAL,
                      tokens=None,
-                     partitioner=_default_partitioner):
+                     partitioner=_default_partitioner,
+                     num_tokens=1):
         if tokens:
             assert len(tokens) == num_nodes
         else:
@@ -70,7 +75,8 @@ class BaseNodeTestCase(TestCase):
         return [self.create_node(cluster_status=cluster_status,
                                  token=tokens[i],
                                  partitioner=partitioner,
-                                 name='N{}'.format(i))
+                                 name='N{}'.format(i),
+                                 num_tokens=num_tokens)
                 for i in range(num_nodes)]
 
     def start_cluster(self):
@@ -1,4 +1,5 @@
 from datetime import datetime
+import time
 
 __epoch__ = datetime(1970, 1, 1)
 
@@ -12,3 +13,8 @@ def deserialize_timestamp(ts):
     assert isinstance(ts, (int, long))
     return datetime.utcfromtimestamp(ts / 1000000.0)
 
+
+def now_timestamp():
+    """ returns the current utc time in microseconds since the epoch """
+    return long(time.time() * 1000000)
+